@@ -19,14 +19,25 @@
 # args:
 # MODULE : module name (required)
 # PY3 : Path of the Python 3 interpreter to use to run the manifest compiler
-#       script.
+#       script. The script is always run by this interpreter rather than
+#       through its /bin/sh header, which sources envsetup.sh to find the
+#       interpreter on every invocation. Defaults to python3 from $PATH.
 # MODULE_CONSTANTS : JSON files with constants used for both the manifest and C
 # 		headers (optional) (CONSTANTS is a deprecated equivalent to
 # 		MODULE_CONSTANTS)
 # MANIFEST : manifest for the application (optional)
+# MANIFEST_COMPILER : manifest compiler script (optional). Set it to
+# 		trusty/user/base/tools/manifest_compiler_client.py to compile through
+# 		a manifest_compiler_server.py listening on $MANIFEST_COMPILER_SOCKET.
+# MANIFEST_EMIT_OBJECT : if true, the manifest compiler also writes the
+# 		manifest as an ELF object with a .trusty_app.manifest section, which
+# 		trusted_app.mk links into the app. Only supported for the arm, arm64
+# 		and x86 ARCHes (optional)
 #
 # outputs:
 # TRUSTY_APP_MANIFEST_BIN : manifest binary name, if MANIFEST
+# TRUSTY_APP_MANIFEST_OBJ : manifest ELF object name, if MANIFEST and
+# 		MANIFEST_EMIT_OBJECT
 #
 # If neither MODULE_CONSTANTS nor MANIFEST are set, this file does nothing.
 
@@ -43,66 +54,123 @@ ifeq ($(strip $(MANIFEST_COMPILER)),)
 MANIFEST_COMPILER := trusty/user/base/tools/manifest_compiler.py
 endif
 
-# build manifest objects if we are building an app, otherwise generate shared
-# constants headers if constants provided
+# Outputs are rebuilt when the compiler or any module it imports changes. The
+# client runs the same modules, in a server or in a local compiler.
+include $(dir $(lastword $(MAKEFILE_LIST)))manifest_compiler_modules.mk
+MANIFEST_COMPILER_DEPS := $(sort $(MANIFEST_COMPILER) \
+	$(addprefix $(dir $(MANIFEST_COMPILER)),manifest_compiler.py \
+		$(MANIFEST_COMPILER_MODULE_NAMES)))
+
+ifeq ($(strip $(PY3)),)
+PY3 := $(shell which python3)
+$(warning No $$PY3 provided; using python3 from $$PATH: $(PY3))
+endif
+
+# generate constants headers if constants provided
+ifneq ($(strip $(MODULE_CONSTANTS)),)
+
+# Unchanged headers are left untouched, the stamp file records when the rule
+# last ran.
+CONSTANTS_HEADER_STAMP := $(BUILDDIR)/constants/headers.stamp
+
+$(CONSTANTS_HEADER_STAMP): MANIFEST_COMPILER := $(MANIFEST_COMPILER)
+$(CONSTANTS_HEADER_STAMP): PY3 := $(PY3)
+$(CONSTANTS_HEADER_STAMP): CONFIG_CONSTANTS := $(MODULE_CONSTANTS)
+$(CONSTANTS_HEADER_STAMP): HEADER_DIR := $(CONSTANTS_HEADER_DIR)
+$(CONSTANTS_HEADER_STAMP): $(MANIFEST_COMPILER_DEPS) $(MODULE_CONSTANTS)
+	@$(MKDIR)
+	@echo compiling constants for $(MODULE)
+	$(PY3) $(MANIFEST_COMPILER) $(addprefix -c,$(CONFIG_CONSTANTS)) --header-dir $(HEADER_DIR) \
+	--stamp $@
+
+# We need the constants headers to be generated before the sources are compiled
+MODULE_SRCDEPS += $(CONSTANTS_HEADER_STAMP)
+
+endif # MODULE_CONSTANTS is non-empty
+
+# build manifest objects if we are building an app
 ifeq ($(call TOBOOL,$(TRUSTY_APP)),true)
 
 TRUSTY_APP_MANIFEST_BIN := $(BUILDDIR)/$(TRUSTY_APP_NAME).manifest
+TRUSTY_APP_MANIFEST_STAMP := $(TRUSTY_APP_MANIFEST_BIN).stamp
 
 # Save the manifest path for use in user-tasks.mk
 _MODULES_$(MODULE)_TRUSTY_APP_MANIFEST_BIN := $(TRUSTY_APP_MANIFEST_BIN)
 $(info generating manifest for $(MODULE): $(TRUSTY_APP_MANIFEST_BIN))
 
+# --object-arch of each ARCH
+MANIFEST_OBJECT_ARCH_arm := arm
+MANIFEST_OBJECT_ARCH_arm64 := arm64
+MANIFEST_OBJECT_ARCH_x86 := x86_64
+ifeq (true,$(call TOBOOL,$(MANIFEST_EMIT_OBJECT)))
+ifeq ($(MANIFEST_OBJECT_ARCH_$(ARCH)),)
+$(error $(MODULE): MANIFEST_EMIT_OBJECT is not supported for ARCH $(ARCH))
+endif
+TRUSTY_APP_MANIFEST_OBJ := $(TRUSTY_APP_MANIFEST_BIN).o
+else
+TRUSTY_APP_MANIFEST_OBJ :=
+endif
+# The rules of the stamp and of the outputs run the compiler with the same
+# variables
+TRUSTY_APP_MANIFEST_TARGETS := $(TRUSTY_APP_MANIFEST_STAMP) \
+	$(TRUSTY_APP_MANIFEST_BIN) $(TRUSTY_APP_MANIFEST_OBJ)
+COMPILE_TRUSTY_APP_MANIFEST = $(PY3) $(MANIFEST_COMPILER) -i $(MANIFEST_INPUT) \
+	-o $(MANIFEST_BIN) $(addprefix -c,$(CONFIG_CONSTANTS)) $(TRUSTY_APP_ENABLE_SCS) \
+	$(DEFAULT_USER_SHADOW_STACK_SIZE) $(EMIT_OBJECT) --stamp $(MANIFEST_STAMP) -MD
+
 # TODO Until the SDK supports library variants, this flag will only work as
 # intended for applications that have no library dependencies.
-$(TRUSTY_APP_MANIFEST_BIN): TRUSTY_APP_ENABLE_SCS :=
+$(TRUSTY_APP_MANIFEST_TARGETS): TRUSTY_APP_ENABLE_SCS :=
 ifeq (false,$(call TOBOOL,$(TRUSTY_APP_DISABLE_SCS)))
 ifeq (true,$(call TOBOOL,$(SCS_ENABLED)))
-$(TRUSTY_APP_MANIFEST_BIN): TRUSTY_APP_ENABLE_SCS := --enable-shadow-call-stack
+$(TRUSTY_APP_MANIFEST_TARGETS): TRUSTY_APP_ENABLE_SCS := --enable-shadow-call-stack
 endif
 endif
 ifdef ARCH_$(ARCH)_DEFAULT_USER_SHADOW_STACK_SIZE
-$(TRUSTY_APP_MANIFEST_BIN): DEFAULT_USER_SHADOW_STACK_SIZE := \
+$(TRUSTY_APP_MANIFEST_TARGETS): DEFAULT_USER_SHADOW_STACK_SIZE := \
 --default-shadow-call-stack-size $(ARCH_$(ARCH)_DEFAULT_USER_SHADOW_STACK_SIZE)
 else
-$(TRUSTY_APP_MANIFEST_BIN): DEFAULT_USER_SHADOW_STACK_SIZE :=
+$(TRUSTY_APP_MANIFEST_TARGETS): DEFAULT_USER_SHADOW_STACK_SIZE :=
 endif
-$(TRUSTY_APP_MANIFEST_BIN): MANIFEST_COMPILER := $(MANIFEST_COMPILER)
-$(TRUSTY_APP_MANIFEST_BIN): PY3 := $(PY3)
-$(TRUSTY_APP_MANIFEST_BIN): CONFIG_CONSTANTS := $(MODULE_CONSTANTS)
-$(TRUSTY_APP_MANIFEST_BIN): HEADER_DIR := $(CONSTANTS_HEADER_DIR)
-$(TRUSTY_APP_MANIFEST_BIN): $(MANIFEST) $(MANIFEST_COMPILER) $(MODULE_CONSTANTS)
-	@$(MKDIR)
-	@echo compiling $< to $@
-	$(PY3) $(MANIFEST_COMPILER) -i $< -o $@ $(addprefix -c,$(CONFIG_CONSTANTS)) --header-dir $(HEADER_DIR) \
-	$(TRUSTY_APP_ENABLE_SCS) $(DEFAULT_USER_SHADOW_STACK_SIZE)
-
-# We need the constants headers to be generated before the sources are compiled
-MODULE_SRCDEPS += $(TRUSTY_APP_MANIFEST_BIN)
-
-else # we are not building an app
-
-ifneq ($(strip $(MODULE_CONSTANTS)),)
-
-# generate shared constants headers if only constants and no manifest provided
-$(CONSTANTS_HEADER_DIR): MANIFEST_COMPILER := $(MANIFEST_COMPILER)
-$(CONSTANTS_HEADER_DIR): PY3 := $(PY3)
-$(CONSTANTS_HEADER_DIR): CONFIG_CONSTANTS := $(MODULE_CONSTANTS)
-$(CONSTANTS_HEADER_DIR): HEADER_DIR := $(CONSTANTS_HEADER_DIR)
-$(CONSTANTS_HEADER_DIR): $(MANIFEST_COMPILER) $(MODULE_CONSTANTS)
+ifneq ($(TRUSTY_APP_MANIFEST_OBJ),)
+$(TRUSTY_APP_MANIFEST_TARGETS): EMIT_OBJECT := --emit-object $(TRUSTY_APP_MANIFEST_OBJ) \
+--object-arch $(MANIFEST_OBJECT_ARCH_$(ARCH))
+else
+$(TRUSTY_APP_MANIFEST_TARGETS): EMIT_OBJECT :=
+endif
+$(TRUSTY_APP_MANIFEST_TARGETS): MANIFEST_COMPILER := $(MANIFEST_COMPILER)
+$(TRUSTY_APP_MANIFEST_TARGETS): PY3 := $(PY3)
+$(TRUSTY_APP_MANIFEST_TARGETS): CONFIG_CONSTANTS := $(MODULE_CONSTANTS)
+$(TRUSTY_APP_MANIFEST_TARGETS): MANIFEST_BIN := $(TRUSTY_APP_MANIFEST_BIN)
+$(TRUSTY_APP_MANIFEST_TARGETS): MANIFEST_INPUT := $(MANIFEST)
+$(TRUSTY_APP_MANIFEST_TARGETS): MANIFEST_STAMP := $(TRUSTY_APP_MANIFEST_STAMP)
+$(TRUSTY_APP_MANIFEST_STAMP): $(MANIFEST) $(MANIFEST_COMPILER_DEPS)
 	@$(MKDIR)
-	@echo compiling constants for $(MODULE)
-	$(PY3) $(MANIFEST_COMPILER) $(addprefix -c,$(CONFIG_CONSTANTS)) --header-dir $(HEADER_DIR)
+	@echo compiling $(MANIFEST_INPUT) to $(MANIFEST_BIN)
+	$(COMPILE_TRUSTY_APP_MANIFEST)
 
-MODULE_SRCDEPS += $(CONSTANTS_HEADER_DIR)
+# The manifest compiler lists the constants files the manifest actually uses in
+# the dependency file, so editing other constants files does not recompile it.
+-include $(TRUSTY_APP_MANIFEST_STAMP).d
 
-endif # MODULE_CONSTANTS is non-empty
+# The manifest compiler only rewrites the manifest binary when its content
+# changes, so that an unchanged manifest does not trigger rebuilds. The stamp
+# file records when the rule last ran. An output deleted since is compiled
+# again, which touches the stamp file too.
+$(TRUSTY_APP_MANIFEST_BIN) $(TRUSTY_APP_MANIFEST_OBJ): $(TRUSTY_APP_MANIFEST_STAMP)
+	@test -f $@ || { echo compiling $(MANIFEST_INPUT) to $(MANIFEST_BIN); \
+	$(COMPILE_TRUSTY_APP_MANIFEST); }
 
-endif # TRUSTY_APP = false
+endif # TRUSTY_APP = true
 
 endif # MODULE_CONSTANTS and/or MANIFEST is non-empty
 
 CONSTANTS :=
 CONSTANTS_HEADER_DIR :=
+CONSTANTS_HEADER_STAMP :=
+MANIFEST_COMPILER_DEPS :=
+TRUSTY_APP_MANIFEST_STAMP :=
+TRUSTY_APP_MANIFEST_TARGETS :=
 MODULE_CONSTANTS :=
 MANIFEST :=
+MANIFEST_EMIT_OBJECT :=
@@ -0,0 +1,36 @@
+#
+# Copyright (c) 2020, Google, Inc. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# Modules imported by tools/manifest_compiler.py, which live next to it. Rules
+# running the manifest compiler depend on them, and the SDK installs them.
+MANIFEST_COMPILER_MODULE_NAMES := \
+	constants_db.py \
+	make_jobserver.py \
+	manifest_build.py \
+	manifest_cache.py \
+	manifest_columns.py \
+	manifest_decode.py \
+	manifest_defs.py \
+	manifest_elf.py \
+	manifest_headers.py \
+	manifest_index.py \
+	manifest_outputs.py \
+	manifest_overlay.py \
+	manifest_packer.py \
+	manifest_parser.py \
+	manifest_schema.py \
+	manifest_unpacker.py \
+
@@ -53,6 +53,8 @@ ifeq (,$(TRUSTY_APP_ALLOCATOR))
 TRUSTY_APP_ALLOCATOR_FOR_$(MODULE) ?= dlmalloc
 TRUSTY_APP_ALLOCATOR := $(TRUSTY_APP_ALLOCATOR_FOR_$(MODULE))
 endif
+# An allocator variant of the manifest usually only changes min_heap and can
+# extend the manifest with "base": "manifest.json", see manifest_overlay.py.
 MANIFEST_ALLOCATOR := $(subst .json,-$(TRUSTY_APP_ALLOCATOR).json,$(MANIFEST))
 ifneq (,$(wildcard $(MANIFEST_ALLOCATOR)))
     MANIFEST := $(MANIFEST_ALLOCATOR)
@@ -122,7 +124,10 @@ TRUSTY_APP_STRIP := $(CLANG_BINDIR)/llvm-strip
 # App build rules
 TRUSTY_APP_BIN := $(BUILDDIR)/$(TRUSTY_APP_NAME).bin
 TRUSTY_APP_SYMS_ELF := $(BUILDDIR)/$(TRUSTY_APP_NAME).syms.elf
-TRUSTY_APP_OBJS_NO_WHOLE_ARCHIVES := $(filter-out $(MODULE_WHOLE_ARCHIVES),$(ALLMODULE_OBJS))
+# The manifest object of MANIFEST_EMIT_OBJECT, if any, puts the manifest in the
+# .trusty_app.manifest section of the app
+TRUSTY_APP_OBJS_NO_WHOLE_ARCHIVES := $(filter-out $(MODULE_WHOLE_ARCHIVES),$(ALLMODULE_OBJS)) \
+	$(TRUSTY_APP_MANIFEST_OBJ)
 TRUSTY_APP_ALL_OBJS := $(TRUSTY_APP_OBJS_NO_WHOLE_ARCHIVES) $(MODULE_EXTRA_OBJECTS)
 
 # Link app elf
@@ -214,6 +219,7 @@ TRUSTY_APP_RUST_SRCDEPS :=
 TRUSTY_APP_APP :=
 
 TRUSTY_APP_MANIFEST_BIN :=
+TRUSTY_APP_MANIFEST_OBJ :=
 TRUSTY_APP_DISABLE_SCS :=
 
 ALLMODULE_OBJS :=
@@ -76,9 +76,21 @@ EXTRA_includes: $(EXTRA_SDK_HEADERS)
 	-cp -r -L $(EXTRA_SDK_HEADERS) $(TRUSTY_SDK_INCLUDE_DIR)
 ALL_SDK_INCLUDES += EXTRA_includes
 
+# Install the modules imported by the manifest compiler next to it
+include make/manifest_compiler_modules.mk
+MANIFEST_COMPILER_MODULES := \
+	$(addprefix $(TRUSTY_SDK_DIR)/tools/,$(MANIFEST_COMPILER_MODULE_NAMES))
+
+$(MANIFEST_COMPILER_MODULES): $(TRUSTY_SDK_DIR)/tools/%: trusty/user/base/tools/%
+	@$(MKDIR)
+	$(NOECHO)cp $^ $@
+ALL_SDK_EXTRA_FILES += $(MANIFEST_COMPILER_MODULES)
+
 # Rewrite the exec header from the manifest compiler to remove the extra setup
-# we use in-tree to force the use of our hermetic python host binary.
-$(TRUSTY_SDK_DIR)/tools/manifest_compiler.py: trusty/user/base/tools/manifest_compiler.py
+# we use in-tree to force the use of our hermetic python host binary. The
+# --help check below imports the modules installed above.
+$(TRUSTY_SDK_DIR)/tools/manifest_compiler.py: trusty/user/base/tools/manifest_compiler.py \
+	| $(MANIFEST_COMPILER_MODULES)
 	@$(MKDIR)
 	$(NOECHO)rm -f $@.tmp
 	$(NOECHO)printf '#!/usr/bin/env python3\n"""' > $@.tmp
@@ -0,0 +1,546 @@
+#!/bin/sh
+""":" # Shell script (in docstring to appease pylint)
+# Find and invoke hermetic python3 interpreter
+. "`dirname $0`/../../../vendor/google/aosp/scripts/envsetup.sh"
+exec "$PY3" "$0" "$@"
+# Shell script end
+
+Benchmarks for manifest_compiler.py.
+
+USAGE:
+    bench_manifest_compiler.py <benchmark> [options]
+
+    batch: times --batch compiles of a synthetic tree of manifests sharing one
+        constants file with 1, 2, 4, ... up to --max-jobs worker processes.
+
+    constants: times compiling one manifest against a large constants file,
+        once through --constants and once through --constants-db.
+
+    startup: times compiler processes compiling a small manifest, started
+        through the /bin/sh header of manifest_compiler.py, which sources
+        envsetup.sh to find the interpreter, and by running the interpreter
+        directly as gen_manifest.mk does.
+
+    codec: times parsing, packing and unpacking a manifest with --count
+        mem_map and start_ports records each. --baseline <revision> also
+        times the compiler of that git revision, in a separate process.
+
+    pack: packs --count parsed manifests back to back into one buffer, once
+        by joining the bytes returned by pack_manifest_data() and once with
+        pack_manifest_into() into a bytearray sized by packed_size(), and
+        reports the time and the peak of traced memory of each.
+
+    check: times one compiler process validating a synthetic tree of --count
+        manifests with --check, and one compiler process compiling one of
+        them.
+
+    cross-check: times --cross-check over a synthetic tree of --count
+        manifest configs sharing one constants file, and over their
+        compiled binaries.
+
+    memory: measures the memory held per parsed manifest with tracemalloc,
+        keeping --count parsed manifests alive. --baseline <revision> also
+        measures the compiler of that git revision.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+import manifest_compiler
+
+
+def write_json_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as out_file:
+        json.dump(data, out_file)
+
+
+def make_synthetic_tree(root, count):
+    """Writes count manifests using a shared constants file and a batch file
+    compiling all of them.
+
+    :returns: tuple of the batch file and constants file paths
+    """
+    constants = [{"name": f"APP{i}_UUID",
+                  "value": f"{i:08x}-0000-4000-8000-000000000000",
+                  "type": "uuid"} for i in range(count)]
+    constants.append({"name": "HEAP_SIZE", "value": 4096, "type": "int",
+                      "unsigned": True})
+    consts = os.path.join(root, "consts.json")
+    write_json_file(consts, {"header": "consts.h", "constants": constants})
+
+    os.makedirs(os.path.join(root, "out"))
+    lines = []
+    for i in range(count):
+        manifest = os.path.join(root, "apps", f"app{i}", "manifest.json")
+        write_json_file(manifest, {
+            "app_name": f"app{i}",
+            "uuid": f"APP{i}_UUID",
+            "min_heap": "HEAP_SIZE",
+            "min_stack": 4096,
+            "mem_map": [{"id": 1, "addr": "0x70000000", "size": "0x1000"}],
+            "start_ports": [{"name": f"com.android.trusty.app{i}",
+                             "flags": {"allow_ta_connect": True,
+                                       "allow_ns_connect": False}}],
+        })
+        output = os.path.join(root, "out", f"app{i}.bin")
+        lines.append(f"-i {manifest} -o {output}")
+
+    batch_file = os.path.join(root, "manifests.rsp")
+    with open(batch_file, "w", encoding="utf-8") as out_file:
+        out_file.write("\n".join(lines) + "\n")
+    return batch_file, consts
+
+
+def bench_batch(args):
+    jobs_list = []
+    jobs = 1
+    while jobs < args.max_jobs:
+        jobs_list.append(jobs)
+        jobs *= 2
+    jobs_list.append(args.max_jobs)
+
+    with tempfile.TemporaryDirectory() as root:
+        batch_file, consts = make_synthetic_tree(root, args.count)
+        print(f"{args.count} manifests, best of {args.repeat} runs")
+        baseline = None
+        for jobs in jobs_list:
+            best = None
+            for _ in range(args.repeat):
+                shared_args = argparse.Namespace(constants=[consts],
+                                                 header_dir=None)
+                start = time.perf_counter()
+                with contextlib.redirect_stderr(io.StringIO()):
+                    failures = manifest_compiler.compile_batch(
+                        batch_file, shared_args, jobs=jobs)
+                elapsed = time.perf_counter() - start
+                if failures:
+                    sys.stderr.write(f"Error: {failures} entries failed\n")
+                    return 1
+                best = elapsed if best is None else min(best, elapsed)
+            baseline = baseline or best
+            print(f"jobs={jobs:<3} {best:8.3f}s  "
+                  f"speedup {baseline / best:5.2f}x")
+
+    return 0
+
+
+def bench_constants(args):
+    with tempfile.TemporaryDirectory() as root:
+        _, consts = make_synthetic_tree(root, args.count)
+        manifest = os.path.join(root, "apps", "app0", "manifest.json")
+        output = os.path.join(root, "out", "app0.bin")
+        db_file = os.path.join(root, "consts.db")
+        if manifest_compiler.main(["--build-constants-db", db_file,
+                                   "-c", consts]):
+            return 1
+
+        print(f"{args.count} constants, best of {args.repeat} compiles")
+        for name, const_args in (("--constants", ["-c", consts]),
+                                 ("--constants-db",
+                                  ["--constants-db", db_file])):
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                # a new cache per compile, like a new compiler process
+                if manifest_compiler.main(["-i", manifest, "-o", output] +
+                                          const_args,
+                                          manifest_compiler.CompilerCache()):
+                    return 1
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:<16} {best * 1000:8.2f}ms")
+
+    return 0
+
+
+def time_command(argv, repeat, env=None):
+    """Returns the shortest wall time of repeat runs of a command, or None if
+    it fails
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(argv, env=env, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, check=False)
+        elapsed = time.perf_counter() - start
+        if result.returncode:
+            return None
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# Run with the directory of a manifest compiler as working directory. Prints
+# the best parse, pack and unpack times of a manifest file in seconds as JSON.
+CODEC_TIMER = """
+import json
+import sys
+import time
+
+import manifest_compiler
+
+manifest_file, repeat = sys.argv[1], int(sys.argv[2])
+with open(manifest_file, encoding="utf-8") as json_file:
+    text = json_file.read()
+
+best = None
+for _ in range(repeat):
+    manifest_dict = json.loads(text)
+    log = manifest_compiler.Log()
+    start = time.perf_counter()
+    manifest = manifest_compiler.parse_manifest_config(manifest_dict, {},
+                                                       "app", log)
+    parsed = time.perf_counter()
+    packed_data = manifest_compiler.pack_manifest_data(manifest)
+    packed = time.perf_counter()
+    manifest_compiler.unpack_binary_manifest_to_data(packed_data)
+    unpacked = time.perf_counter()
+    times = (parsed - start, packed - parsed, unpacked - packed)
+    best = times if best is None else [min(a, b) for a, b in zip(best, times)]
+
+print(json.dumps(best))
+"""
+
+
+# Run with the directory of a manifest compiler as working directory. Prints
+# the bytes allocated per parsed manifest of the JSON list read from stdin.
+MEMORY_PROBE = """
+import json
+import sys
+import tracemalloc
+
+import manifest_compiler
+
+manifest_dicts = json.load(sys.stdin)
+tracemalloc.start()
+log = manifest_compiler.Log()
+before = tracemalloc.get_traced_memory()[0]
+manifests = [manifest_compiler.parse_manifest_config(manifest_dict, {}, "app",
+                                                     log)
+             for manifest_dict in manifest_dicts]
+after = tracemalloc.get_traced_memory()[0]
+print(json.dumps((after - before) / len(manifests)))
+"""
+
+
+def make_app_manifest(index):
+    return {
+        "uuid": f"{index:08x}-0000-4000-8000-000000000000",
+        "app_name": f"app{index}",
+        "min_heap": 4096,
+        "min_stack": 4096,
+        "mem_map": [{"id": i, "addr": hex(0x70000000 + i * 0x1000),
+                     "size": "0x1000"} for i in range(2)],
+        "mgmt_flags": {"restart_on_exit": True},
+        "start_ports": [{"name": f"com.android.trusty.app{index}.port{i}",
+                         "flags": {"allow_ta_connect": True,
+                                   "allow_ns_connect": False}}
+                        for i in range(2)],
+        "version": 1,
+    }
+
+
+def make_large_manifest(count):
+    return {
+        "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+        "min_heap": 4096,
+        "min_stack": 4096,
+        "mem_map": [{"id": i, "addr": hex(0x70000000 + i * 0x1000),
+                     "size": "0x1000", "type": "cached",
+                     "non_secure": i % 2 == 0} for i in range(count)],
+        "start_ports": [{"name": f"com.android.trusty.port{i}",
+                         "flags": {"allow_ta_connect": True,
+                                   "allow_ns_connect": False}}
+                        for i in range(count)],
+    }
+
+
+def extract_revision(tools_dir, revision, dest_dir):
+    """Extracts the directory holding this script at a git revision"""
+    toplevel, prefix = subprocess.run(
+        ["git", "-C", tools_dir, "rev-parse", "--show-toplevel",
+         "--show-prefix"], stdout=subprocess.PIPE, check=True,
+        universal_newlines=True).stdout.splitlines()
+    archive = subprocess.run(
+        ["git", "-C", toplevel, "archive", f"{revision}:{prefix}"],
+        stdout=subprocess.PIPE, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(dest_dir)
+
+
+def bench_codec(args):
+    tools_dir = os.path.dirname(os.path.abspath(__file__))
+
+    with tempfile.TemporaryDirectory() as root:
+        manifest = os.path.join(root, "manifest.json")
+        write_json_file(manifest, make_large_manifest(args.count))
+        trees = [("current", tools_dir)]
+        if args.baseline:
+            baseline_dir = os.path.join(root, "baseline")
+            extract_revision(tools_dir, args.baseline, baseline_dir)
+            trees.insert(0, (args.baseline, baseline_dir))
+
+        print(f"{args.count} mem_map and start_ports records, "
+              f"best of {args.repeat} runs")
+        print(f"{'':<16} {'parse':>10} {'pack':>10} {'unpack':>10}")
+        for name, tree in trees:
+            result = subprocess.run(
+                [sys.executable, "-c", CODEC_TIMER, manifest,
+                 str(args.repeat)], cwd=tree, stdout=subprocess.PIPE,
+                check=False, universal_newlines=True)
+            if result.returncode:
+                print(f"{name:<16} failed")
+                continue
+            times = json.loads(result.stdout)
+            print(f"{name:<16} " +
+                  " ".join(f"{elapsed * 1000:8.2f}ms" for elapsed in times))
+
+    return 0
+
+
+def bench_memory(args):
+    tools_dir = os.path.dirname(os.path.abspath(__file__))
+    manifest_dicts = json.dumps([make_app_manifest(i)
+                                 for i in range(args.count)])
+
+    with tempfile.TemporaryDirectory() as root:
+        trees = [("current", tools_dir)]
+        if args.baseline:
+            baseline_dir = os.path.join(root, "baseline")
+            extract_revision(tools_dir, args.baseline, baseline_dir)
+            trees.insert(0, (args.baseline, baseline_dir))
+
+        print(f"{args.count} parsed manifests with 2 mem_map and 2 "
+              "start_ports records each")
+        for name, tree in trees:
+            result = subprocess.run(
+                [sys.executable, "-c", MEMORY_PROBE], input=manifest_dicts,
+                cwd=tree, stdout=subprocess.PIPE, check=False,
+                universal_newlines=True)
+            if result.returncode:
+                print(f"{name:<16} failed")
+                continue
+            per_manifest = json.loads(result.stdout)
+            print(f"{name:<16} {per_manifest:8.0f} bytes per manifest")
+
+    return 0
+
+
+def pack_joined(manifests):
+    return b"".join(manifest_compiler.pack_manifest_data(manifest)
+                    for manifest in manifests)
+
+
+def pack_arena(manifests):
+    arena = bytearray(sum(manifest_compiler.packed_size(manifest)
+                          for manifest in manifests))
+    offset = 0
+    for manifest in manifests:
+        offset = manifest_compiler.pack_manifest_into(arena, offset, manifest)
+    return arena
+
+
+def bench_pack(args):
+    # pylint: disable=import-outside-toplevel
+    import tracemalloc
+
+    log = manifest_compiler.Log()
+    manifests = [manifest_compiler.parse_manifest_config(
+        make_app_manifest(i), {}, "app", log) for i in range(args.count)]
+    if log.error_occurred():
+        return 1
+    if pack_joined(manifests) != pack_arena(manifests):
+        sys.stderr.write("Error: the packed data differs\n")
+        return 1
+
+    print(f"{args.count} manifests, best of {args.repeat} runs")
+    for name, pack in (("pack_manifest_data", pack_joined),
+                       ("pack_manifest_into", pack_arena)):
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            pack(manifests)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        tracemalloc.start()
+        packed_data = pack(manifests)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:<20} {best * 1000:8.2f}ms  peak {peak / 1024:8.1f}KiB "
+              f"for {len(packed_data) / 1024:.1f}KiB")
+
+    return 0
+
+
+def bench_check(args):
+    tools_dir = os.path.dirname(os.path.abspath(__file__))
+    compiler = os.path.join(tools_dir, "manifest_compiler.py")
+    env = dict(os.environ, PYTHONPATH=tools_dir)
+    env.pop("MAKEFLAGS", None)
+
+    with tempfile.TemporaryDirectory() as root:
+        _, consts = make_synthetic_tree(root, args.count)
+        # make_synthetic_tree writes apps/app<i>/manifest.json
+        print(f"best of {args.repeat} runs")
+        for name, argv in (
+                (f"--check {args.count} manifests",
+                 ["--check", os.path.join(root, "apps"), "-c", consts]),
+                ("compile 1 manifest",
+                 ["-i", os.path.join(root, "apps", "app0", "manifest.json"),
+                  "-o", os.path.join(root, "out", "app0.bin"), "-c",
+                  consts])):
+            best = time_command([sys.executable, compiler] + argv,
+                                args.repeat, env)
+            if best is None:
+                print(f"{name:<24} failed")
+            else:
+                print(f"{name:<24} {best * 1000:8.2f}ms")
+
+    return 0
+
+
+def bench_cross_check(args):
+    with tempfile.TemporaryDirectory() as root:
+        batch_file, consts = make_synthetic_tree(root, args.count)
+        with contextlib.redirect_stderr(io.StringIO()):
+            if manifest_compiler.compile_batch(
+                    batch_file, argparse.Namespace(constants=[consts],
+                                                   header_dir=None)):
+                return 1
+
+        print(f"{args.count} manifests, best of {args.repeat} runs")
+        for name, argv in (
+                ("manifest.json", [os.path.join(root, "apps"), "-c", consts]),
+                ("*.manifest", [os.path.join(root, "out", "*.bin")])):
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                if manifest_compiler.main(["--cross-check"] + argv):
+                    return 1
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:<16} {best * 1000:8.2f}ms")
+
+    return 0
+
+
+def bench_startup(args):
+    tools_dir = os.path.dirname(os.path.abspath(__file__))
+    compiler = os.path.join(tools_dir, "manifest_compiler.py")
+    py3 = args.py3 or sys.executable
+    env = dict(os.environ, PYTHONPATH=tools_dir)
+    env.pop("MAKEFLAGS", None)
+
+    with tempfile.TemporaryDirectory() as root:
+        _, consts = make_synthetic_tree(root, 1)
+        compile_args = ["-i", os.path.join(root, "apps", "app0",
+                                           "manifest.json"),
+                        "-o", os.path.join(root, "out", "app0.bin"),
+                        "-c", consts]
+        print(f"best of {args.repeat} runs")
+        for name, argv in (
+                ("interpreter only", [py3, "-c", "pass"]),
+                ("sh + envsetup.sh", ["/bin/sh", compiler]),
+                ("$(PY3) script", [py3, compiler]),
+                ("$(PY3) -m", [py3, "-m", "manifest_compiler"])):
+            if argv[-1] != "pass":
+                argv = argv + compile_args
+            best = time_command(argv, args.repeat, env)
+            if best is None:
+                print(f"{name:<18} failed")
+            else:
+                print(f"{name:<18} {best * 1000:8.2f}ms")
+
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    batch_parser = subparsers.add_parser(
+        "batch", help="Scaling of --batch with the number of worker processes")
+    batch_parser.add_argument("--count", type=int, default=5000,
+                              help="Number of synthetic manifests")
+    batch_parser.add_argument("--max-jobs", type=int,
+                              default=manifest_compiler.default_jobs(),
+                              help="Largest number of worker processes")
+    batch_parser.add_argument("--repeat", type=int, default=3,
+                              help="Number of runs per job count")
+    batch_parser.set_defaults(func=bench_batch)
+
+    constants_parser = subparsers.add_parser(
+        "constants", help="Constants lookups from JSON and from a database")
+    constants_parser.add_argument("--count", type=int, default=20000,
+                                  help="Number of synthetic constants")
+    constants_parser.add_argument("--repeat", type=int, default=10,
+                                  help="Number of compiles per variant")
+    constants_parser.set_defaults(func=bench_constants)
+
+    startup_parser = subparsers.add_parser(
+        "startup", help="Process startup through sh and through $(PY3)")
+    startup_parser.add_argument("--py3", type=str,
+                                help="Python interpreter, defaults to the one "
+                                     "running this benchmark")
+    startup_parser.add_argument("--repeat", type=int, default=20,
+                                help="Number of runs per variant")
+    startup_parser.set_defaults(func=bench_startup)
+
+    codec_parser = subparsers.add_parser(
+        "codec", help="Parsing, packing and unpacking a large manifest")
+    codec_parser.add_argument("--count", type=int, default=5000,
+                              help="Number of mem_map and start_ports records")
+    codec_parser.add_argument("--repeat", type=int, default=5,
+                              help="Number of runs per compiler")
+    codec_parser.add_argument("--baseline", type=str, metavar="REVISION",
+                              help="Also time the compiler of this git "
+                                   "revision")
+    codec_parser.set_defaults(func=bench_codec)
+
+    pack_parser = subparsers.add_parser(
+        "pack", help="Packing many manifests into one buffer")
+    pack_parser.add_argument("--count", type=int, default=5000,
+                             help="Number of manifests")
+    pack_parser.add_argument("--repeat", type=int, default=5,
+                             help="Number of runs per variant")
+    pack_parser.set_defaults(func=bench_pack)
+
+    check_parser = subparsers.add_parser(
+        "check", help="Validating a tree of manifests with --check")
+    check_parser.add_argument("--count", type=int, default=1000,
+                              help="Number of synthetic manifests")
+    check_parser.add_argument("--repeat", type=int, default=3,
+                              help="Number of runs per variant")
+    check_parser.set_defaults(func=bench_check)
+
+    cross_check_parser = subparsers.add_parser(
+        "cross-check", help="Cross-checking a tree of manifests")
+    cross_check_parser.add_argument("--count", type=int, default=5000,
+                                    help="Number of synthetic manifests")
+    cross_check_parser.add_argument("--repeat", type=int, default=3,
+                                    help="Number of runs per input format")
+    cross_check_parser.set_defaults(func=bench_cross_check)
+
+    memory_parser = subparsers.add_parser(
+        "memory", help="Memory held by parsed manifests")
+    memory_parser.add_argument("--count", type=int, default=2000,
+                               help="Number of parsed manifests")
+    memory_parser.add_argument("--baseline", type=str, metavar="REVISION",
+                               help="Also measure the compiler of this git "
+                                    "revision")
+    memory_parser.set_defaults(func=bench_memory)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
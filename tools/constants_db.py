@@ -0,0 +1,246 @@
+"""Precompiled database of manifest constants.
+
+manifest_compiler.py --build-constants-db parses a set of constants config
+files once and stores all of their constants in a single binary file. Compiles
+given --constants-db map that file and only decode the constants their
+manifest looks up, without reading any JSON.
+
+File layout, all integers little-endian:
+    header    magic, version, source, entry and bucket counts
+    sources   per constants config file: path and (mtime_ns, size) signature
+    buckets   open addressing hash table of entry index + 1, 0 if empty
+    entries   per constant: name hash, name, type, value, source and flags
+    strings   names, types, values and paths referenced by offset and length
+
+Buckets are indexed by the CRC-32 of the UTF-8 constant name modulo the bucket
+count, a power of two, and probed linearly.
+"""
+
+import mmap
+import struct
+import zlib
+
+MAGIC = b"TACONSDB"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<8sIIII")
+SOURCE = struct.Struct("<IIqq")
+BUCKET = struct.Struct("<I")
+ENTRY = struct.Struct("<IIIIIIIIBBBx")
+
+# Encodings of constant values
+KIND_STR = 0
+KIND_BYTES = 1
+KIND_INT = 2
+KIND_BOOL = 3
+
+
+def name_hash(name):
+    return zlib.crc32(name.encode("utf-8"))
+
+
+def encode_value(value):
+    # bool is a subclass of int and has to be checked first
+    if isinstance(value, bool):
+        return KIND_BOOL, b"\x01" if value else b"\x00"
+    if isinstance(value, int):
+        return KIND_INT, str(value).encode()
+    if isinstance(value, (bytes, bytearray)):
+        return KIND_BYTES, bytes(value)
+    return KIND_STR, value.encode("utf-8")
+
+
+def decode_value(kind, data):
+    if kind == KIND_BOOL:
+        return data != b"\x00"
+    if kind == KIND_INT:
+        return int(data)
+    if kind == KIND_BYTES:
+        return bytes(data)
+    return bytes(data).decode("utf-8")
+
+
+def pack_database(constants, sources):
+    """Packs a constants database.
+
+    :param constants: Constant objects, a later constant replaces an earlier
+                      one of the same name
+    :param sources: list of (path, signature) of the constants config files
+                    the constants are defined in, in the order they were given
+    :returns: the database as bytes
+    """
+    by_name = {}
+    for const in constants:
+        by_name[const.name] = const
+    source_index = {path: index for index, (path, _) in enumerate(sources)}
+
+    bucket_count = 1
+    while bucket_count < 2 * len(by_name):
+        bucket_count *= 2
+
+    strings_offset = (HEADER.size + SOURCE.size * len(sources) +
+                      BUCKET.size * bucket_count + ENTRY.size * len(by_name))
+    strings = bytearray()
+    string_offsets = {}
+
+    def add_string(data):
+        if data not in string_offsets:
+            string_offsets[data] = strings_offset + len(strings)
+            strings.extend(data)
+        return string_offsets[data], len(data)
+
+    packed_sources = []
+    for path, (mtime_ns, size) in sources:
+        packed_sources.append(SOURCE.pack(*add_string(path.encode("utf-8")),
+                                          mtime_ns, size))
+
+    buckets = [0] * bucket_count
+    packed_entries = []
+    for index, const in enumerate(by_name.values()):
+        hash_ = name_hash(const.name)
+        bucket = hash_ % bucket_count
+        while buckets[bucket]:
+            bucket = (bucket + 1) % bucket_count
+        buckets[bucket] = index + 1
+
+        kind, value = encode_value(const.value)
+        packed_entries.append(ENTRY.pack(
+            hash_, *add_string(const.name.encode("utf-8")),
+            *add_string(const.type.encode("utf-8")), *add_string(value),
+            source_index.get(const.source, len(sources)), kind,
+            bool(const.unsigned), bool(const.hex_num)))
+
+    return b"".join([HEADER.pack(MAGIC, FORMAT_VERSION, len(sources),
+                                 len(by_name), bucket_count)] +
+                    packed_sources +
+                    [BUCKET.pack(bucket) for bucket in buckets] +
+                    packed_entries + [bytes(strings)])
+
+
+class ConstantsDatabase(object):
+    """Read-only view of a constants database file. The file is mapped on the
+    first lookup and constants are decoded on demand by make_constant, which
+    is called like the Constant constructor.
+    """
+
+    def __init__(self, path, make_constant):
+        self.path = path
+        self.make_constant = make_constant
+        self.data = None
+        self.sources = None
+        self.entry_count = 0
+        self.bucket_count = 0
+        self.buckets_offset = 0
+        self.entries_offset = 0
+        self.decoded = {}
+
+    def __getstate__(self):
+        # mappings cannot be pickled, other processes map the file again
+        state = self.__dict__.copy()
+        state["data"] = None
+        return state
+
+    def open(self):
+        """Maps the database file.
+
+        :raises OSError: if the file cannot be read
+        :raises ValueError: if the file is not a valid database
+        """
+        if self.data is not None:
+            return
+        with open(self.path, "rb") as db_file:
+            try:
+                data = mmap.mmap(db_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                data = b""
+        if len(data) < HEADER.size:
+            raise ValueError("not a constants database")
+        magic, version, source_count, self.entry_count, self.bucket_count = \
+            HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("not a constants database or unsupported version")
+        # lookups take the hash modulo the bucket count and need an empty
+        # bucket to end the probing of missing names
+        if self.bucket_count == 0 or \
+                self.bucket_count & (self.bucket_count - 1) or \
+                self.entry_count >= self.bucket_count:
+            raise ValueError("invalid constants database bucket count "
+                             f"{self.bucket_count}")
+        self.buckets_offset = HEADER.size + SOURCE.size * source_count
+        self.entries_offset = (self.buckets_offset +
+                               BUCKET.size * self.bucket_count)
+        if len(data) < self.entries_offset + ENTRY.size * self.entry_count:
+            raise ValueError("truncated constants database")
+        self.data = data
+
+        sources = []
+        try:
+            for index in range(source_count):
+                path_offset, path_size, mtime_ns, size = SOURCE.unpack_from(
+                    data, HEADER.size + SOURCE.size * index)
+                path = self.string(path_offset, path_size).decode("utf-8")
+                sources.append((path, (mtime_ns, size)))
+        except ValueError:
+            self.data = None
+            raise
+        self.sources = sources
+
+    def string(self, offset, size):
+        if offset + size > len(self.data):
+            raise ValueError("truncated constants database")
+        return self.data[offset:offset + size]
+
+    def stale_sources(self, signature):
+        """Returns the source files whose signature, as computed by the given
+        function, changed since the database was built
+        """
+        self.open()
+        stale = []
+        for path, recorded in self.sources:
+            try:
+                current = signature(path)
+            except OSError:
+                current = None
+            if current != recorded:
+                stale.append(path)
+        return stale
+
+    def get(self, name):
+        """Returns the constant called name, or None if there is none"""
+        if not isinstance(name, str):
+            return None
+        if name in self.decoded:
+            return self.decoded[name]
+
+        self.open()
+        const = None
+        encoded_name = name.encode("utf-8")
+        hash_ = name_hash(name)
+        bucket = hash_ % self.bucket_count
+        for _ in range(self.bucket_count):
+            (index,) = BUCKET.unpack_from(
+                self.data, self.buckets_offset + BUCKET.size * bucket)
+            if not index:
+                break
+            entry = ENTRY.unpack_from(
+                self.data, self.entries_offset + ENTRY.size * (index - 1))
+            if entry[0] == hash_ and \
+                    self.string(entry[1], entry[2]) == encoded_name:
+                const = self.decode_entry(name, entry)
+                break
+            bucket = (bucket + 1) % self.bucket_count
+
+        self.decoded[name] = const
+        return const
+
+    def decode_entry(self, name, entry):
+        (_, _, _, type_offset, type_size, value_offset, value_size,
+         source_index, kind, unsigned, hex_num) = entry
+        type_ = self.string(type_offset, type_size).decode("utf-8")
+        value = decode_value(kind, self.string(value_offset, value_size))
+        source = None
+        if source_index < len(self.sources):
+            source = self.sources[source_index][0]
+        return self.make_constant(name, value, type_, bool(unsigned),
+                                  bool(hex_num), source)
@@ -0,0 +1,166 @@
+"""Client of the GNU make jobserver.
+
+A recursive make invocation shares its job slots with its children through a
+jobserver: a pipe (--jobserver-auth=R,W, or --jobserver-fds=R,W before make
+4.2) or a named pipe (--jobserver-auth=fifo:PATH since make 4.4) holding one
+token byte per free slot. Every child implicitly owns one slot and has to read
+a token before running any additional job in parallel, and write the same
+token back once that job has finished.
+
+make only passes the pipe file descriptors to recipes it considers recursive,
+i.e. recipes that start with '+' or reference $(MAKE). The named pipe style
+works for every recipe.
+
+Tokens are read without blocking, as other clients can take a token between
+select() and read(): from a private non-blocking open file description of the
+pipe where /proc allows it, and otherwise with O_NONBLOCK set only while
+reading.
+"""
+
+import errno
+import fcntl
+import os
+import select
+
+# Seconds between checks whether waiting for a token is still needed
+POLL_INTERVAL = 0.1
+
+
+def parse_makeflags(makeflags):
+    """Finds the jobserver in the value of MAKEFLAGS.
+
+    :returns: ("fifo", path), ("pipe", read_fd, write_fd) or None if make did
+              not announce a jobserver
+    """
+    auth = None
+    for word in makeflags.split():
+        if word == "--":
+            # the remaining words are variable definitions
+            break
+        for option in ("--jobserver-auth=", "--jobserver-fds="):
+            if word.startswith(option):
+                auth = word[len(option):]
+
+    if auth is None:
+        return None
+    if auth.startswith("fifo:"):
+        return ("fifo", auth[len("fifo:"):])
+
+    try:
+        read_fd, write_fd = (int(fd) for fd in auth.split(","))
+    except ValueError:
+        return None
+    if read_fd < 0 or write_fd < 0:
+        # make disabled the jobserver for this command
+        return None
+    return ("pipe", read_fd, write_fd)
+
+
+def fd_is_open(fd):
+    try:
+        os.fstat(fd)
+    except OSError:
+        return False
+    return True
+
+
+def open_nonblocking(path):
+    try:
+        return os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return None
+
+
+class Jobserver(object):
+    """Token pipe shared with make. owned_fds are closed by close()."""
+
+    def __init__(self, read_fd, write_fd, owned_fds=()):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.owned_fds = owned_fds
+
+    @classmethod
+    def from_environ(cls, environ=None):
+        """Connects to the jobserver announced in MAKEFLAGS.
+
+        :returns: a Jobserver, or None if there is no usable jobserver
+        """
+        if environ is None:
+            environ = os.environ
+        auth = parse_makeflags(environ.get("MAKEFLAGS", ""))
+        if auth is None:
+            return None
+
+        if auth[0] == "fifo":
+            # a private, non-blocking open file description of the fifo
+            read_fd = open_nonblocking(auth[1])
+            if read_fd is None:
+                return None
+            try:
+                write_fd = os.open(auth[1], os.O_WRONLY)
+            except OSError:
+                os.close(read_fd)
+                return None
+            return cls(read_fd, write_fd, (read_fd, write_fd))
+
+        _, read_fd, write_fd = auth
+        if not fd_is_open(read_fd) or not fd_is_open(write_fd):
+            # the recipe was not run as a recursive make command
+            return None
+        private_fd = open_nonblocking(f"/proc/self/fd/{read_fd}")
+        if private_fd is None:
+            return cls(read_fd, write_fd)
+        return cls(private_fd, write_fd, (private_fd,))
+
+    def close(self):
+        for fd in self.owned_fds:
+            os.close(fd)
+        self.owned_fds = ()
+
+    def read_token(self):
+        """Reads a token without blocking.
+
+        :raises BlockingIOError: if there is no token
+        """
+        flags = fcntl.fcntl(self.read_fd, fcntl.F_GETFL)
+        if flags & os.O_NONBLOCK:
+            return os.read(self.read_fd, 1)
+        fcntl.fcntl(self.read_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        try:
+            return os.read(self.read_fd, 1)
+        finally:
+            fcntl.fcntl(self.read_fd, fcntl.F_SETFL, flags)
+
+    def acquire(self, stop_event):
+        """Waits for a token until stop_event is set.
+
+        :returns: the token, or None if stop_event was set first
+        """
+        while not stop_event.is_set():
+            readable, _, _ = select.select([self.read_fd], [], [],
+                                           POLL_INTERVAL)
+            if not readable:
+                continue
+            try:
+                token = self.read_token()
+            except BlockingIOError:
+                # another client took the token
+                continue
+            except InterruptedError:
+                continue
+            if not token:
+                # make closed the pipe
+                return None
+            return token
+        return None
+
+    def release(self, token):
+        """Returns a token acquired with acquire() to make"""
+        while True:
+            try:
+                os.write(self.write_fd, token)
+                return
+            except OSError as ex:
+                if ex.errno not in (errno.EINTR, errno.EAGAIN):
+                    raise
+                select.select([], [self.write_fd], [], POLL_INTERVAL)
@@ -0,0 +1,1082 @@
+"""Compile driver of manifest_compiler.py: the compile options, the
+CompilerCache of parsed files, the output cache, dependency files and batch
+compiles.
+
+Modules only needed by some runs are imported where they are used, so that
+e.g. a header-only run never imports the packer and a manifest compile never
+imports the header generator.
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+
+from manifest_defs import BASE, Constant, Log, OBJECT_ARCHES
+from manifest_outputs import write_file_if_changed, write_stamp_file
+from manifest_parser import (
+    index_constants, parse_config_constant, read_json_config_file
+)
+
+
+# Environment variable holding the default output cache directory
+CACHE_DIR_ENV = "MANIFEST_COMPILER_CACHE_DIR"
+
+
+class TrackedConstants(object):
+    """Wraps an index of constants and records the constants config files of
+    the constants looked up through it
+    """
+
+    def __init__(self, constants):
+        self.constants = constants
+        self.sources = set()
+        self.missed_identifiers = False
+
+    def get(self, key):
+        const = self.constants.get(key)
+        if const is not None:
+            self.sources.add(const.source)
+        elif isinstance(key, str) and key.isidentifier():
+            # Defining a constant with this name in any constants config file
+            # would change the result of the lookup.
+            self.missed_identifiers = True
+        return const
+
+    def used_files(self, const_config_files):
+        """Returns the given constants config files which the looked up
+        constants depend on
+        """
+        if self.missed_identifiers:
+            return list(const_config_files)
+        return [const_file for const_file in const_config_files
+                if os.path.abspath(const_file) in self.sources]
+
+
+def file_signature(path):
+    """Returns a value which changes whenever the given file is modified"""
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class CompilerCache(object):
+    """Keeps parsed manifest and constants config files in memory so that
+    several manifests compiled by one process can share them. A cached file is
+    parsed again when its (path, mtime, size) changes. The bases of manifest
+    configs are kept by their content by a manifest_overlay.ManifestResolver.
+    """
+
+    def __init__(self):
+        self.manifests = {}
+        self.config_constants = {}
+        self.constants_dbs = {}
+        self.written_headers = set()
+        self.manifest_resolver = None
+
+    def resolver(self):
+        """Returns the ManifestResolver shared by the manifests of the cache"""
+        if self.manifest_resolver is None:
+            import manifest_overlay  # pylint: disable=import-outside-toplevel
+            self.manifest_resolver = manifest_overlay.ManifestResolver()
+        return self.manifest_resolver
+
+    def forget_written_headers(self):
+        """Makes the next process_config_constants calls write their headers
+        again, e.g. because they may have been deleted since.
+        """
+        self.written_headers.clear()
+
+    def read_manifest(self, input_file, log):
+        """Returns the parsed JSON of a manifest config file. It is shared by
+        all calls for the file, which must not modify it.
+        """
+        path = os.path.abspath(input_file)
+        try:
+            signature = file_signature(path)
+        except OSError:
+            self.manifests.pop(path, None)
+            return read_json_config_file(input_file, log)
+
+        entry = self.manifests.get(path)
+        if entry is None or entry[0] != signature:
+            manifest_dict = read_json_config_file(input_file, log)
+            if log.error_occurred():
+                self.manifests.pop(path, None)
+                return None
+            entry = (signature, manifest_dict)
+            self.manifests[path] = entry
+
+        return entry[1]
+
+    def get_config_constants(self, const_file, log):
+        """Returns the parsed ConfigConstants of a constants file or None if the
+        file could not be read or parsed.
+        """
+        path = os.path.abspath(const_file)
+        try:
+            signature = file_signature(path)
+        except OSError:
+            signature = None
+
+        entry = self.config_constants.get(path)
+        if entry is None or signature is None or entry[0] != signature:
+            file_log = Log(out=io.StringIO())
+            const_config = read_json_config_file(const_file, file_log)
+            config_constants = None
+            if not file_log.error_occurred():
+                config_constants = parse_config_constant(const_config,
+                                                         file_log, path)
+            if file_log.error_occurred():
+                config_constants = None
+            entry = (signature, config_constants, file_log.messages)
+            self.config_constants[path] = entry
+
+        # report the errors of invalid files to every user of the file
+        for msg in entry[2]:
+            log.error(msg)
+        return entry[1]
+
+    def open_constants_db(self, db_file, log):
+        """Returns the ConstantsDatabase in db_file, or None if it cannot be
+        read or one of the constants files it was built from has changed.
+        """
+        path = os.path.abspath(db_file)
+        try:
+            signature = file_signature(path)
+        except OSError:
+            signature = None
+
+        entry = self.constants_dbs.get(path)
+        if entry is None or signature is None or entry[0] != signature:
+            import constants_db  # pylint: disable=import-outside-toplevel
+            entry = (signature,
+                     constants_db.ConstantsDatabase(path, Constant))
+            self.constants_dbs[path] = entry
+
+        try:
+            stale = entry[1].stale_sources(file_signature)
+        except (OSError, ValueError) as ex:
+            self.constants_dbs.pop(path, None)
+            log.error(f"{db_file}: unable to open constants database: {ex}")
+            return None
+        if stale:
+            log.error(f"{db_file}: constants database is out of date, "
+                      f"{stale[0]} has changed")
+            return None
+
+        return entry[1]
+
+    def process_config_constants(self, const_config_files, header_dir, log):
+        """Collects config constants and writes their headers, like
+        process_config_constants, reusing previously parsed files.
+        """
+        if const_config_files is None:
+            return []
+
+        config_constants = [self.get_config_constants(const_file, log)
+                            for const_file in const_config_files]
+        if log.error_occurred():
+            return []
+
+        if header_dir:
+            import manifest_headers  # pylint: disable=import-outside-toplevel
+            for const_file, const_config in zip(const_config_files,
+                                                config_constants):
+                key = (os.path.abspath(const_file),
+                       os.path.abspath(header_dir),
+                       self.config_constants[os.path.abspath(const_file)][0])
+                if key in self.written_headers:
+                    continue
+                manifest_headers.write_consts_to_header_file(const_config,
+                                                             header_dir, log)
+                self.written_headers.add(key)
+
+        return config_constants
+
+
+class BatchEntryError(Exception):
+    """Invalid options on a line of a batch file"""
+
+
+class BatchEntryParser(argparse.ArgumentParser):
+    """Argument parser for batch file lines which reports errors by raising
+    BatchEntryError instead of exiting the program.
+    """
+
+    def error(self, message):
+        raise BatchEntryError(message)
+
+
+def add_compile_arguments(parser, environ=None):
+    """Adds the options used to compile a single manifest to the parser.
+    Option defaults are read from environ, os.environ by default.
+    """
+    if environ is None:
+        environ = os.environ
+    # set by resolve_client_paths
+    parser.set_defaults(cwd=None, client_paths={})
+    parser.add_argument(
+        "-i", "--input",
+        dest="input_filename",
+        required=False,
+        type=str,
+        help="It should be trusty app manifest config JSON file"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        dest="output_filename",
+        required=False,
+        type=str,
+        help="It will be binary file with packed manifest data"
+    )
+    parser.add_argument(
+        "-c", "--constants",
+        dest="constants",
+        required=False,
+        action="append",
+        help="JSON file with manifest config constants"
+    )
+    parser.add_argument(
+        "--emit-object",
+        dest="object_filename",
+        required=False,
+        type=str,
+        metavar="OBJECT",
+        help="Also write the packed manifest as a relocatable ELF object "
+             "holding it in the .trusty_app.manifest section"
+    )
+    parser.add_argument(
+        "--object-arch",
+        dest="object_arch",
+        required=False,
+        choices=OBJECT_ARCHES,
+        help="Architecture of the --emit-object object"
+    )
+    parser.add_argument(
+        "--constants-db",
+        dest="constants_db",
+        required=False,
+        type=str,
+        help="Constants database built by --build-constants-db, used instead "
+             "of --constants"
+    )
+    parser.add_argument(
+        "--header-dir",
+        dest="header_dir",
+        required=False,
+        type=str,
+        help="Directory path for generating headers"
+    )
+    parser.add_argument(
+        "--enable-shadow-call-stack",
+        dest="shadow_call_stack",
+        required=False,
+        action="store_true",  # implies default := False
+        help="Allow apps to opt into having a shadow call stack. "
+             "Without this flag, apps will not have shadow stacks "
+             "even if their manifests define \"min_shadow_stack\"."
+    )
+    parser.add_argument(
+        "--default-shadow-call-stack-size",
+        dest="default_shadow_call_stack_size",
+        required=False,
+        default=4096,
+        type=int,
+        metavar="DEFAULT_SIZE",
+        help="Controls the size of the default shadow call stack."
+             "This option has no effect unless shadow call stacks "
+             "are enabled via the --enable-shadow-call-stack flag."
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        required=False,
+        default=environ.get(CACHE_DIR_ENV),
+        type=str,
+        help="Directory of a cache of compiled manifests and constants headers "
+             "shared between builds. Defaults to $" + CACHE_DIR_ENV + "."
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        dest="cache_max_size",
+        required=False,
+        type=int,
+        metavar="BYTES",
+        help="Size limit of the cache directory, 256 MiB by default"
+    )
+    parser.add_argument(
+        "--stamp",
+        dest="stamp_file",
+        required=False,
+        type=str,
+        help="File to touch after a successful run. Outputs are only "
+             "rewritten when their content changes, so build rules can use "
+             "the stamp file as their target."
+    )
+    parser.add_argument(
+        "--depfile",
+        dest="depfile",
+        required=False,
+        type=str,
+        help="Write a make dependency file listing the manifest and the "
+             "constants files whose constants the manifest uses. Its target "
+             "is the --stamp file if one is given, else the output file."
+    )
+    parser.add_argument(
+        "-MD",
+        dest="make_depfile",
+        required=False,
+        action="store_true",
+        help="Write the dependency file to <target>.d"
+    )
+
+
+# Options of add_compile_arguments holding paths
+PATH_OPTIONS = ("input_filename", "output_filename", "constants",
+                "object_filename", "constants_db", "header_dir", "cache_dir",
+                "stamp_file", "depfile")
+
+
+def resolve_client_paths(args, cwd, options=PATH_OPTIONS):
+    """Joins the relative paths of the given options of args to cwd, the
+    working directory of the client which gave them, so that they do not
+    depend on the working directory of this process. The paths as given are
+    kept in args.client_paths for the dependency file.
+    """
+    client_paths = dict(args.client_paths)
+
+    def resolve(path):
+        if os.path.isabs(path):
+            return path
+        resolved = os.path.join(cwd, path)
+        client_paths[resolved] = path
+        return resolved
+
+    for option in options:
+        value = getattr(args, option, None)
+        if isinstance(value, list):
+            setattr(args, option, [resolve(path) for path in value])
+        elif value:
+            setattr(args, option, resolve(value))
+    args.cwd = cwd
+    args.client_paths = client_paths
+
+
+def client_path(args, path):
+    """Returns a path of args as the client gave it, see resolve_client_paths.
+    Other paths under the working directory of the client, e.g. of manifest
+    bases, are made relative to it.
+    """
+    if args.cwd is None:
+        return path
+    if path in args.client_paths:
+        return args.client_paths[path]
+    if path.startswith(os.path.join(args.cwd, "")):
+        return os.path.relpath(path, args.cwd)
+    return path
+
+
+def app_dir_name(args):
+    """Returns the name of the directory of the input file, the default app
+    name of the manifest
+    """
+    return os.path.basename(os.path.dirname(
+        client_path(args, args.input_filename)))
+
+
+def check_compile_arguments(args, error):
+    """Validates the options of a single manifest compilation, reporting
+    problems through the given error callback.
+    """
+    if args.constants and not args.header_dir and not args.output_filename:
+        error("--header-dir is required if --constants are specified")
+
+    if args.input_filename and not args.output_filename:
+        error("Input file provided with no manifest output file.")
+
+    if args.constants_db and args.constants:
+        error("--constants and --constants-db cannot be combined")
+
+    if args.constants_db and not args.output_filename:
+        error("--constants-db requires a manifest output file.")
+
+    if args.output_filename and not args.input_filename:
+        error("Building a manifest output file requires an input file.")
+
+    if args.default_shadow_call_stack_size <= 0:
+        error("--default-shadow-call-stack-size expects a positive integer")
+
+    if args.cache_max_size is not None and args.cache_max_size < 0:
+        error("--cache-max-size expects a non-negative integer")
+
+    if (args.depfile or args.make_depfile) and not args.output_filename:
+        error("A dependency file requires a manifest output file.")
+
+    if args.object_filename and not args.output_filename:
+        error("--emit-object requires a manifest output file.")
+
+    if bool(args.object_filename) != bool(args.object_arch):
+        error("--emit-object and --object-arch must be given together")
+
+
+def parse_manifest_file(input_filename, constants, shadow_call_stack,
+                        default_shadow_call_stack_size, log, cache=None,
+                        dependencies=None, default_app_name=None):
+    """Parses the given manifest input file, merged into its bases if it has
+    any, and applies the shadow call stack options. Errors are reported
+    through log. The input file is read through cache if one is given.
+
+    :param dependencies: list the paths of the bases are appended to
+    :param default_app_name: app name of manifests without one, the name of
+                             the directory of the input file by default
+    :returns: the parsed Manifest, or None if it is invalid
+    """
+    if not os.path.exists(input_filename):
+        log.error(
+            f"Manifest config JSON file doesn't exist: {input_filename}")
+        return None
+
+    if cache is None:
+        manifest_dict = read_json_config_file(input_filename, log)
+    else:
+        manifest_dict = cache.read_manifest(input_filename, log)
+    if log.error_occurred():
+        return None
+
+    if isinstance(manifest_dict, dict) and BASE in manifest_dict:
+        if cache is None:
+            import manifest_overlay  # pylint: disable=import-outside-toplevel
+            resolver = manifest_overlay.ManifestResolver()
+        else:
+            resolver = cache.resolver()
+        resolved = resolver.resolve(input_filename, manifest_dict, log)
+        if resolved is None:
+            return None
+        manifest_dict, bases = resolved
+        if dependencies is not None:
+            dependencies.extend(bases)
+
+    # By default, app directory name will be used as app-name
+    if default_app_name is None:
+        default_app_name = os.path.basename(os.path.dirname(input_filename))
+
+    import manifest_schema  # pylint: disable=import-outside-toplevel
+
+    # parse the manifest config
+    manifest = manifest_schema.parse_manifest_config(manifest_dict, constants,
+                                                     default_app_name, log)
+
+    if log.error_occurred():
+        return None
+
+    # Optionally adjust min_shadow_stack based on command line arguments
+    if shadow_call_stack:
+        # If shadow callstack is enabled but the size is not specified in the
+        # manifest, set it to the default value.
+        if manifest.min_shadow_stack is None:
+            manifest = manifest.replace(
+                min_shadow_stack=default_shadow_call_stack_size)
+    else:
+        # If shadow call stack is not enabled, make sure the size is set to
+        # zero in the binary manifest. In the future, "not present" may
+        # indicate the binary does not use a shadow callstack, but for now
+        # we're making sure a value is always present.
+        manifest = manifest.replace(min_shadow_stack=0)
+
+    assert (shadow_call_stack and manifest.min_shadow_stack > 0) != \
+           (manifest.min_shadow_stack == 0)
+
+    return manifest
+
+
+def write_object_file(packed_data, object_file, object_arch, log):
+    """Writes packed manifest data to a relocatable ELF object file"""
+    import manifest_elf  # pylint: disable=import-outside-toplevel
+    try:
+        write_file_if_changed(object_file,
+                              manifest_elf.pack_object(packed_data,
+                                                       object_arch))
+    except IOError as ex:
+        log.error(f"Unable to write to object file: {object_file}\n" +
+                  str(ex))
+
+
+def compile_manifest(input_filename, output_filename, constants,
+                     shadow_call_stack, default_shadow_call_stack_size, log,
+                     cache=None, dependencies=None, object_file=None,
+                     object_arch=None, default_app_name=None):
+    """Parses the given manifest input file, packs it and writes the packed data
+    to the binary output file, and to an ELF object file for object_arch if
+    object_file is given. Errors are reported through log. The input file is
+    read through cache if one is given, the paths of its bases are appended
+    to dependencies.
+    """
+    manifest = parse_manifest_file(input_filename, constants,
+                                   shadow_call_stack,
+                                   default_shadow_call_stack_size, log, cache,
+                                   dependencies, default_app_name)
+    if manifest is None:
+        return
+
+    import manifest_packer  # pylint: disable=import-outside-toplevel
+
+    # Pack the data as per C structures
+    packed_data = manifest_packer.pack_manifest_data(manifest)
+    if log.error_occurred():
+        return
+
+    # Write to file.
+    manifest_packer.write_packed_data_to_bin_file(packed_data, output_filename,
+                                                  log)
+    if object_file:
+        write_object_file(packed_data, object_file, object_arch, log)
+
+
+# Modules whose source determines the compiler outputs
+COMPILER_MODULES = (
+    "constants_db",
+    "manifest_build",
+    "manifest_compiler",
+    "manifest_defs",
+    "manifest_headers",
+    "manifest_outputs",
+    "manifest_overlay",
+    "manifest_packer",
+    "manifest_parser",
+    "manifest_schema",
+)
+
+_compiler_version = None
+
+
+def compiler_version():
+    """Returns a hash of the source of this compiler, used to invalidate
+    cached outputs of other compiler versions
+    """
+    global _compiler_version
+    if _compiler_version is None:
+        import hashlib  # pylint: disable=import-outside-toplevel
+        digest = hashlib.sha256()
+        for module in COMPILER_MODULES:
+            with open(os.path.join(os.path.dirname(__file__), module + ".py"),
+                      "rb") as source_file:
+                digest.update(source_file.read())
+        _compiler_version = digest.digest()
+    return _compiler_version
+
+
+def output_cache_key(args):
+    """Computes the key of the outputs requested by one set of parsed compile
+    options in the output cache, or None if an input file cannot be read.
+    """
+    parts = [compiler_version(),
+             str(bool(args.shadow_call_stack)).encode(),
+             str(args.default_shadow_call_stack_size).encode(),
+             str(bool(args.header_dir)).encode()]
+    input_files = list(args.constants or [])
+    if args.constants_db:
+        input_files.append(args.constants_db)
+    if args.output_filename:
+        # By default, app directory name will be used as app-name
+        parts.append(app_dir_name(args).encode())
+        input_files.append(args.input_filename)
+
+    try:
+        if args.output_filename:
+            input_files.extend(manifest_bases(args.input_filename))
+        for input_file in input_files:
+            with open(input_file, "rb") as read_file:
+                parts.append(read_file.read())
+    except (IOError, ValueError):
+        return None
+
+    import manifest_cache  # pylint: disable=import-outside-toplevel
+    return manifest_cache.hash_key(parts)
+
+
+def manifest_bases(input_file):
+    """Returns the paths of the bases of a manifest config file.
+
+    :raises IOError: if a manifest config cannot be read
+    :raises ValueError: if a manifest config is invalid
+    """
+    import manifest_overlay  # pylint: disable=import-outside-toplevel
+    return manifest_overlay.manifest_bases(input_file)
+
+
+def depfile_target(args):
+    """The make target of the dependency file: the stamp file if one is given,
+    otherwise the manifest output file
+    """
+    return args.stamp_file or args.output_filename
+
+
+def depfile_path(args):
+    if args.depfile:
+        return args.depfile
+    if args.make_depfile:
+        return depfile_target(args) + ".d"
+    return None
+
+
+def escape_make_path(path):
+    return path.replace("$", "$$").replace(" ", "\\ ").replace("#", "\\#")
+
+
+def write_args_depfile(args, depfile, dependencies, log):
+    """Writes the dependency file of one set of parsed compile options, with
+    the paths as given by the client
+    """
+    write_depfile(depfile, client_path(args, depfile_target(args)),
+                  client_path(args, args.input_filename),
+                  [client_path(args, path) for path in dependencies], log)
+
+
+def write_depfile(depfile, target, input_file, dependencies, log):
+    """Writes a make dependency file making target depend on the input file and
+    the given dependencies. Like gcc -MP, an empty rule is added for every
+    dependency so that deleting one does not break the build.
+    """
+    prerequisites = [input_file] + dependencies
+    lines = [escape_make_path(target) + ": " + " \\\n  ".join(
+        escape_make_path(path) for path in prerequisites) + "\n"]
+    for path in dependencies:
+        lines.append("\n" + escape_make_path(path) + ":\n")
+
+    try:
+        write_file_if_changed(depfile, "".join(lines).encode("utf-8"))
+    except IOError as ex:
+        log.error(f"Unable to write to dependency file: {depfile}\n" + str(ex))
+
+
+def compile_args(args, cache, log):
+    """Generates the constants headers and the manifest binary requested by
+    one set of parsed compile options. If an output cache directory is given,
+    the outputs are taken from or added to the output cache.
+    """
+    const_config_files = args.constants or []
+    depfile = depfile_path(args)
+    output_cache = None
+    key = None
+    if args.cache_dir:
+        import manifest_cache  # pylint: disable=import-outside-toplevel
+        max_size = args.cache_max_size
+        if max_size is None:
+            max_size = manifest_cache.DEFAULT_MAX_SIZE
+        output_cache = manifest_cache.OutputCache(args.cache_dir, max_size)
+        key = output_cache_key(args)
+        metadata = None
+        if key:
+            metadata = output_cache.fetch(key, args.output_filename,
+                                          args.header_dir)
+        if metadata is not None:
+            if args.object_filename:
+                # objects are not cached, they only wrap the manifest binary
+                try:
+                    with open(args.output_filename, "rb") as output_file:
+                        packed_data = output_file.read()
+                except IOError as ex:
+                    log.error(f"{args.output_filename}: {ex}")
+                    return
+                write_object_file(packed_data, args.object_filename,
+                                  args.object_arch, log)
+            if depfile:
+                used_files = [const_config_files[index]
+                              for index in json.loads(metadata.decode())]
+                if args.output_filename:
+                    # the bases were read for the key
+                    used_files.extend(manifest_bases(args.input_filename))
+                if args.constants_db:
+                    used_files.append(args.constants_db)
+                write_args_depfile(args, depfile, used_files, log)
+            if args.stamp_file:
+                write_stamp_file(args.stamp_file, log)
+            return
+
+    if args.constants_db:
+        config_constants = []
+        constants = cache.open_constants_db(args.constants_db, log)
+    else:
+        config_constants = cache.process_config_constants(args.constants,
+                                                          args.header_dir, log)
+        constants = index_constants(config_constants)
+    if log.error_occurred():
+        return
+
+    used_files = []
+    bases = []
+    if args.output_filename:
+        constants = TrackedConstants(constants)
+        compile_manifest(args.input_filename, args.output_filename, constants,
+                         args.shadow_call_stack,
+                         args.default_shadow_call_stack_size, log, cache,
+                         bases, args.object_filename, args.object_arch,
+                         app_dir_name(args))
+        if log.error_occurred():
+            return
+        used_files = constants.used_files(const_config_files)
+
+    if depfile:
+        # the database is only rewritten when its content changes
+        db_files = [args.constants_db] if args.constants_db else []
+        write_args_depfile(args, depfile, used_files + bases + db_files, log)
+
+    if key:
+        headers = []
+        if args.header_dir:
+            headers = [const_config.header
+                       for const_config in config_constants]
+        # the used constants files are recorded by their position on the
+        # command line as the key does not depend on their paths
+        metadata = json.dumps([const_config_files.index(const_file)
+                               for const_file in used_files]).encode()
+        output_cache.store(key, args.output_filename, args.header_dir,
+                           headers, metadata)
+
+    if args.stamp_file:
+        write_stamp_file(args.stamp_file, log)
+
+
+def build_constants_db(db_file, const_config_files, header_dir, cache, log):
+    """Compiles the given constants config files into a constants database
+    and optionally writes their headers
+    """
+    config_constants = cache.process_config_constants(const_config_files,
+                                                      header_dir, log)
+    if log.error_occurred():
+        return
+
+    sources = []
+    for const_file in const_config_files:
+        path = os.path.abspath(const_file)
+        sources.append((path, cache.config_constants[path][0]))
+    constants = [const for const_config in config_constants
+                 for const in const_config.constants]
+
+    import constants_db  # pylint: disable=import-outside-toplevel
+    try:
+        write_file_if_changed(db_file,
+                              constants_db.pack_database(constants, sources))
+    except IOError as ex:
+        log.error(f"Unable to write to constants database: {db_file}\n" +
+                  str(ex))
+
+
+def read_constants(const_config_files, db_file, cache, log):
+    """Returns the constants by name of the given constants files, or the
+    database of the given constants database file, or None if they are
+    invalid
+    """
+    if db_file:
+        constants = cache.open_constants_db(db_file, log)
+    else:
+        constants = index_constants(
+            cache.process_config_constants(const_config_files, None, log))
+    if log.error_occurred():
+        return None
+    return constants
+
+
+def check_manifests(paths, const_config_files, db_file, shadow_call_stack,
+                    default_shadow_call_stack_size, cache, log):
+    """Validates the manifest configs found in paths like compiling them,
+    without packing them or writing any file. Each path is a manifest config,
+    a directory searched for manifest.json files or a glob pattern. The
+    constants are read once for all manifests. The errors of each manifest
+    are reported with its path.
+
+    :returns: number of invalid manifests, or None if the constants are
+              invalid
+    """
+    constants = read_constants(const_config_files, db_file, cache, log)
+    if constants is None:
+        return None
+
+    import manifest_decode  # pylint: disable=import-outside-toplevel
+    count = 0
+    failures = 0
+    for path in manifest_decode.find_manifest_files(
+            paths, log, (manifest_decode.JSON_MANIFEST_SUFFIX,)):
+        manifest_log = Log(path, log.out)
+        parse_manifest_file(path, constants, shadow_call_stack,
+                            default_shadow_call_stack_size, manifest_log,
+                            cache)
+        count += 1
+        if manifest_log.error_occurred():
+            failures += 1
+
+    if failures:
+        log.error(f"{failures} of {count} manifests are invalid")
+    return failures
+
+
+def cross_check(paths, const_config_files, db_file, cache, log,
+                mem_maps=False):
+    """Reports every UUID and start port used by more than one of the
+    manifests found in paths, resolving the constants of JSON manifest
+    configs through the given constants files or constants database. With
+    mem_maps, overlapping mem_map regions and mem_map ids used twice by one
+    manifest are reported as well.
+
+    :returns: manifest_index.ManifestIndex, or None if the constants are
+              invalid
+    """
+    constants = read_constants(const_config_files, db_file, cache, log)
+    if constants is None:
+        return None
+
+    import manifest_index  # pylint: disable=import-outside-toplevel
+    return manifest_index.cross_check_manifests(paths, constants, log,
+                                                mem_maps)
+
+
+def read_batch_file(batch_file, log):
+    """Reads the lines of a batch file. Each non-empty line holds the compile
+    options of one manifest, with shell-like quoting and # comments.
+
+    :returns: list of (location, argv, error) tuples where either argv holds
+              the options of the line or error describes its invalid quoting,
+              or None if the batch file cannot be read
+    """
+    try:
+        with open(batch_file, "r", encoding="utf-8") as read_file:
+            lines = read_file.readlines()
+    except IOError as ex:
+        log.error(f"{batch_file}: unable to open batch file: {ex}")
+        return None
+
+    import shlex  # pylint: disable=import-outside-toplevel
+    entries = []
+    for line_number, line in enumerate(lines, 1):
+        location = f"{batch_file}:{line_number}"
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError as ex:
+            entries.append((location, None, str(ex)))
+            continue
+        if argv:
+            entries.append((location, argv, None))
+
+    return entries
+
+
+def parse_batch_entries(entries, shared_args):
+    """Parses the options of batch file entries, as read by read_batch_file.
+
+    :returns: list of (location, args, error) tuples where either args holds
+              the parsed options or error describes the invalid options
+    """
+    parser = BatchEntryParser(add_help=False)
+    add_compile_arguments(parser)
+
+    parsed_entries = []
+    for location, argv, error in entries:
+        if error:
+            parsed_entries.append((location, None, error))
+            continue
+        try:
+            args = parser.parse_args(
+                argv, namespace=argparse.Namespace(**vars(shared_args)))
+            check_compile_arguments(args, parser.error)
+            if args.cwd is not None:
+                resolve_client_paths(args, args.cwd)
+        except BatchEntryError as ex:
+            parsed_entries.append((location, None, str(ex)))
+        else:
+            parsed_entries.append((location, args, None))
+
+    return parsed_entries
+
+
+# CompilerCache of batch worker processes
+_worker_cache = None
+
+# Chunks of a batch in flight per worker process
+CHUNKS_PER_JOB = 4
+
+
+def init_batch_worker(cache):
+    global _worker_cache
+    _worker_cache = cache
+
+
+def compile_batch_entry(entry, cache=None):
+    """Compiles one parsed batch entry, collecting its diagnostics instead of
+    printing them. Worker processes use the cache they were initialized with.
+
+    :returns: tuple of whether the entry failed and its diagnostics
+    """
+    location, args, error = entry
+    entry_log = Log(location, io.StringIO())
+    if error:
+        entry_log.error(error)
+    else:
+        if args.input_filename:
+            entry_log.context = f"{location}: {args.input_filename}"
+        compile_args(args, cache or _worker_cache, entry_log)
+
+    return entry_log.error_occurred(), entry_log.out.getvalue()
+
+
+def compile_batch_chunk(chunk):
+    return [compile_batch_entry(entry) for entry in chunk]
+
+
+def default_jobs():
+    return os.cpu_count() or 1
+
+
+def batch_jobs(jobs, jobserver, environ=None):
+    """Returns the number of worker processes of a batch. An explicit --jobs
+    is used as is. Without one, a batch run by make uses as many workers as
+    there are CPUs if make shares its job slots through a jobserver and a
+    single one otherwise, so that make -jN is not oversubscribed.
+    """
+    if environ is None:
+        environ = os.environ
+    if jobs:
+        return jobs
+    if jobserver is None and "MAKEFLAGS" in environ:
+        return 1
+    return default_jobs()
+
+
+def batch_executor(jobs, cache=None):
+    """Creates a pool of worker processes sharing the given cache, if any.
+    Where possible the workers are forked so that they inherit the cache
+    instead of receiving a pickled copy.
+    """
+    # pylint: disable=import-outside-toplevel
+    import concurrent.futures
+    import multiprocessing
+
+    context = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, mp_context=context, initializer=init_batch_worker,
+        initargs=(cache,))
+
+
+def run_batch_chunks(executor, chunks, jobs, jobserver=None,
+                     task=compile_batch_chunk, task_args=()):
+    """Runs task(chunk, *task_args) for every chunk on the executor with at
+    most jobs of them in flight. Each of the jobs slots is a thread that hands
+    one chunk at a time to the executor. With a jobserver, every slot but the
+    first holds a token from make while it runs a chunk. chunks can be any
+    iterable, at most CHUNKS_PER_JOB chunks per slot are taken from it ahead
+    of the results consumed.
+
+    :returns: iterator over the results of the chunks, in order
+    """
+    # pylint: disable=import-outside-toplevel
+    import collections
+    import concurrent.futures
+    import queue
+    import threading
+
+    queued = queue.Queue()
+    done = threading.Event()
+
+    def run_slot(slot):
+        while not done.is_set():
+            token = None
+            if slot and jobserver:
+                token = jobserver.acquire(done)
+                if token is None:
+                    return
+            try:
+                item = queued.get()
+                if item is None:
+                    return
+                chunk, result = item
+                try:
+                    result.set_result(executor.submit(
+                        task, chunk, *task_args).result())
+                except Exception as ex:  # pylint: disable=broad-except
+                    result.set_exception(ex)
+            finally:
+                if token is not None:
+                    jobserver.release(token)
+
+    threads = [threading.Thread(target=run_slot, args=(slot,), daemon=True)
+               for slot in range(jobs)]
+    for thread in threads:
+        thread.start()
+    pending = collections.deque()
+    try:
+        for chunk in chunks:
+            result = concurrent.futures.Future()
+            queued.put((chunk, result))
+            pending.append(result)
+            if len(pending) >= jobs * CHUNKS_PER_JOB:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        done.set()
+        # wake up the slots waiting for a chunk
+        for _ in threads:
+            queued.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def compile_batch(batch_file, shared_args, cache=None, jobs=1,
+                  jobserver=None, out=None):
+    """Compiles every manifest listed in a batch file. Options given on the
+    command line (shared_args) apply to every entry and are extended by the
+    options of the entry itself. Constants files are parsed only once and
+    errors are reported per entry, in the order of the batch file. The parsed
+    files are kept in cache if one is given.
+
+    With jobs > 1 the manifests are compiled by a pool of worker processes.
+    The constants files are parsed and their headers written before the pool
+    starts, so that every worker shares the same parsed constants. With a
+    make_jobserver.Jobserver only as many workers run at a time as make has
+    job slots to spare. Diagnostics are written to out, stderr by default.
+
+    :returns: number of failed entries, or None if the batch file is invalid
+    """
+    log = Log(out=out)
+    entries = read_batch_file(batch_file, log)
+    if log.error_occurred():
+        return None
+
+    entries = parse_batch_entries(entries, shared_args)
+    if cache is None:
+        cache = CompilerCache()
+
+    jobs = min(jobs, len(entries))
+    if jobs > 1:
+        for _, args, _ in entries:
+            if args:
+                # errors are reported again when the entry is compiled
+                cache.process_config_constants(args.constants, args.header_dir,
+                                               Log(out=io.StringIO()))
+        chunk_size = max(1, len(entries) // (jobs * 8))
+        chunks = [entries[i:i + chunk_size]
+                  for i in range(0, len(entries), chunk_size)]
+        executor = batch_executor(jobs, cache)
+        chunk_results = run_batch_chunks(executor, chunks, jobs, jobserver)
+        results = (result for chunk in chunk_results for result in chunk)
+    else:
+        executor = None
+        results = (compile_batch_entry(entry, cache) for entry in entries)
+
+    failures = 0
+    try:
+        for failed, diagnostics in results:
+            (out or sys.stderr).write(diagnostics)
+            if failed:
+                failures += 1
+    finally:
+        if executor:
+            chunk_results.close()
+            executor.shutdown()
+
+    if failures:
+        log.error(f"{batch_file}: {failures} of {len(entries)} entries failed")
+
+    return failures
@@ -0,0 +1,284 @@
+"""Content-addressed cache for the outputs of manifest_compiler.py.
+
+Each cache entry holds the packed manifest binary and the constants headers
+generated by one compilation. Entries are keyed by a hash of everything the
+outputs depend on, so product variants that regenerate byte-identical
+manifests reuse the outputs of earlier builds.
+
+Layout of the cache directory:
+    <cache_dir>/<key[:2]>/<key>/manifest    packed manifest binary
+    <cache_dir>/<key[:2]>/<key>/headers/... generated constants headers
+    <cache_dir>/<key[:2]>/usage             estimated size of the shard
+    <cache_dir>/tmp/                        entries being written or removed
+
+Several compilers may use the same cache directory concurrently. Entries are
+written to a private directory under tmp/ and renamed into place, and removed
+by renaming them back into tmp/ first, so readers never see partial entries
+and need no locks. The modification time of an entry directory records its
+last use and the least recently used entries of a shard are evicted when the
+shard grows beyond its share of the size limit.
+
+Stores append the size of their entry to the usage file of the shard, which
+starts with the size found by the last scan of the shard, so that a shard is
+only scanned when it is estimated to be full. The estimate can miss entries
+stored during a scan, they are counted by the next one. A shard always keeps
+the entry just stored, so tiny size limits still cache one entry per shard.
+Scans also remove what compilers killed while writing an entry left in tmp/.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# Entries are spread over this many shards (the first two hex digits of the
+# key). Each shard is trimmed to its share of the size limit independently.
+SHARD_COUNT = 256
+
+# Full shards are trimmed to this fraction of their share of the size limit,
+# so that the next stores do not scan them again right away
+SHARD_TRIM_RATIO = 0.75
+
+# Seconds after which anything left in tmp/ belongs to a killed compiler
+STALE_TMP_AGE = 60 * 60
+
+SHARD_USAGE = "usage"
+
+ENTRY_MANIFEST = "manifest"
+ENTRY_HEADERS = "headers"
+ENTRY_METADATA = "metadata"
+
+
+def hash_key(parts):
+    """Returns the cache key for the given list of bytes objects"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def file_size(path):
+    try:
+        return os.lstat(path).st_size
+    except OSError:
+        return 0
+
+
+def entry_size(entry_dir):
+    size = 0
+    for dir_path, _, file_names in os.walk(entry_dir):
+        for file_name in file_names:
+            size += file_size(os.path.join(dir_path, file_name))
+    return size
+
+
+def same_content(path1, path2):
+    try:
+        if os.path.getsize(path1) != os.path.getsize(path2):
+            return False
+        with open(path1, "rb") as file1, open(path2, "rb") as file2:
+            return file1.read() == file2.read()
+    except OSError:
+        return False
+
+
+def install_file(src, dst):
+    """Installs a cached file at its output location. An output with the same
+    content is left untouched. Otherwise the output is atomically replaced by a
+    hard link to the cached file, or a copy if linking is not possible. Outputs
+    are never modified in place, so linking cannot corrupt the cache.
+    """
+    if same_content(src, dst):
+        return
+
+    dir_name = os.path.dirname(dst) or "."
+    os.makedirs(dir_name, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=dir_name, prefix=".manifest_cache.")
+    tmp_path = os.path.join(tmp_dir, os.path.basename(dst))
+    try:
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class OutputCache(object):
+    """On-disk cache of manifest binaries and constants headers"""
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.shard_max_size = max_size // SHARD_COUNT
+        self.tmp_dir = os.path.join(cache_dir, "tmp")
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def fetch(self, key, output_file, header_dir):
+        """Installs the outputs of the cache entry for key.
+
+        :returns: the metadata stored with the entry on a cache hit, None if
+                  the outputs have to be compiled
+        """
+        entry_dir = self.entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, ENTRY_METADATA), "rb") as \
+                    metadata_file:
+                metadata = metadata_file.read()
+            if output_file:
+                install_file(os.path.join(entry_dir, ENTRY_MANIFEST),
+                             output_file)
+            headers_dir = os.path.join(entry_dir, ENTRY_HEADERS)
+            for dir_path, _, file_names in os.walk(headers_dir):
+                for file_name in file_names:
+                    src = os.path.join(dir_path, file_name)
+                    install_file(src, os.path.join(
+                        header_dir, os.path.relpath(src, headers_dir)))
+            # record the use of the entry for LRU eviction
+            os.utime(entry_dir)
+        except OSError:
+            # missing, or evicted while it was being read
+            return None
+
+        return metadata
+
+    def store(self, key, output_file, header_dir, headers, metadata=b""):
+        """Adds the given compiler outputs to the cache. headers are the paths
+        of the generated headers relative to header_dir, metadata is returned
+        by fetch along with the outputs. Failing to store an entry is not an
+        error, the outputs are simply not cached.
+        """
+        entry_dir = self.entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+
+        try:
+            os.makedirs(self.tmp_dir, exist_ok=True)
+            new_entry_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        except OSError:
+            return
+
+        try:
+            with open(os.path.join(new_entry_dir, ENTRY_METADATA), "wb") as \
+                    metadata_file:
+                metadata_file.write(metadata)
+            if output_file:
+                shutil.copyfile(output_file,
+                                os.path.join(new_entry_dir, ENTRY_MANIFEST))
+            for header in headers:
+                dst = os.path.join(new_entry_dir, ENTRY_HEADERS, header)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.copyfile(os.path.join(header_dir, header), dst)
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            # fails if another compiler stored the same entry meanwhile
+            os.rename(new_entry_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(new_entry_dir, ignore_errors=True)
+            return
+
+        shard_dir = os.path.dirname(entry_dir)
+        usage = self.add_usage(shard_dir, entry_size(entry_dir))
+        if usage is None or usage > self.shard_max_size:
+            self.trim_shard(shard_dir, entry_dir)
+
+    def remove_entry(self, entry_dir):
+        """Removes an entry without exposing partially deleted entries"""
+        try:
+            doomed_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+            os.rename(entry_dir, os.path.join(doomed_dir, "entry"))
+        except OSError:
+            return
+        shutil.rmtree(doomed_dir, ignore_errors=True)
+
+    def add_usage(self, shard_dir, size):
+        """Records an entry of size bytes stored in a shard.
+
+        :returns: the estimated size of the shard, None if it is unknown
+        """
+        usage_path = os.path.join(shard_dir, SHARD_USAGE)
+        if not os.path.exists(usage_path):
+            return None
+        try:
+            # appended in a single write, so that concurrent stores do not
+            # mix their lines
+            with open(usage_path, "a+b", buffering=0) as usage_file:
+                usage_file.write(b"%d\n" % size)
+                usage_file.seek(0)
+                usage = usage_file.read()
+            return sum(int(line) for line in usage.split())
+        except (OSError, ValueError):
+            return None
+
+    def write_usage(self, shard_dir, size):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as usage_file:
+                usage_file.write(b"%d\n" % size)
+            os.replace(tmp_path, os.path.join(shard_dir, SHARD_USAGE))
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def remove_stale_tmp(self):
+        """Removes what killed compilers left in tmp/"""
+        stale_time = time.time() - STALE_TMP_AGE
+        try:
+            with os.scandir(self.tmp_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.stat(follow_symlinks=False).st_mtime > \
+                                stale_time:
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            shutil.rmtree(entry.path, ignore_errors=True)
+                        else:
+                            os.remove(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            return
+
+    def trim_shard(self, shard_dir, keep=None):
+        """Evicts the least recently used entries of a shard, except the entry
+        keep, until it fits in SHARD_TRIM_RATIO of its share of the size
+        limit, and records the size of the shard in its usage file
+        """
+        self.remove_stale_tmp()
+        entries = []
+        total_size = 0
+        try:
+            with os.scandir(shard_dir) as it:
+                for entry in it:
+                    try:
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                        last_use = entry.stat().st_mtime_ns
+                    except OSError:
+                        continue
+                    size = entry_size(entry.path)
+                    total_size += size
+                    if entry.path != keep:
+                        entries.append((last_use, size, entry.path))
+        except OSError:
+            return
+
+        target_size = int(self.shard_max_size * SHARD_TRIM_RATIO)
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= target_size:
+                break
+            self.remove_entry(path)
+            total_size -= size
+        self.write_usage(shard_dir, total_size)
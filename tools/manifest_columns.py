@@ -0,0 +1,240 @@
+"""Bulk decoding of many binary manifests into columnar tables.
+
+decode_manifest_columns() turns a corpus of packed manifests into one table
+with a row per manifest and one table per repeated field (mem_map and
+start_ports) with a row per entry, keyed by the row of its manifest in the
+app table. The columns are the values of the tagged entries as laid out in
+manifest_schema.FIELDS:
+
+    apps:        uuid (16 bytes, in the order of the UUID string), app_name,
+                 then one column per single-valued field (min_heap,
+                 min_stack, mgmt_flags, ...), -1 if the field is absent.
+                 Flags are the packed bitfields.
+    mem_map:     app, id, addr, size, arch_mmu_flags
+    start_ports: app, flags, name
+
+With NumPy, the tables are structured arrays, and the fixed-width values of
+all manifests are decoded by a few vectorized gathers. Without NumPy, each
+table is a dict of column lists, which can be indexed by column name too.
+"""
+
+from manifest_defs import APP_NAME, UUID, swap_uuid_bytes
+from manifest_schema import FIELDS, ManifestDecodeError
+from manifest_unpacker import (
+    UUID_SIZE, byte_view, decode_app_name, decode_string, describe_field,
+    read_inline_string, skip_record, truncated
+)
+
+# Column of child tables holding the row of the manifest in the app table
+APP_COLUMN = "app"
+
+# Column of child tables holding the inline strings of the entries
+STRING_COLUMN = "name"
+
+# NumPy types of the struct format characters used by FIELDS
+NUMPY_TYPES = {"I": "<u4", "Q": "<u8"}
+
+# Value of absent single-valued fields in the app table
+ABSENT = -1
+
+
+def import_numpy():
+    """Returns the numpy module, or None if it is not installed"""
+    try:
+        import numpy  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return numpy
+
+
+class ManifestColumns(object):
+    """Columnar tables of a manifest corpus: apps, and records holding the
+    table of each repeated field by its manifest JSON key
+    """
+
+    def __init__(self, apps, records):
+        self.apps = apps
+        self.records = records
+
+
+class ScannedCorpus(object):
+    """Offsets of the tagged entries of a corpus of manifests, and their
+    decoded headers and inline strings. Offsets are relative to the
+    concatenation of all manifests.
+    """
+
+    def __init__(self):
+        self.datas = []
+        self.bases = []
+        self.uuids = []
+        self.app_names = []
+        # field key -> per manifest offset of the entry, or ABSENT
+        self.single = {field.key: [] for field in FIELDS
+                       if not field.repeated}
+        # field key -> (manifest index, offset) of each entry
+        self.repeated = {field.key: [] for field in FIELDS if field.repeated}
+        # field key -> inline string of each entry
+        self.strings = {field.key: [] for field in FIELDS if field.string}
+        # manifest of the last located offset
+        self.last_index = 0
+
+    def scan(self, packed_data):
+        index = len(self.datas)
+        base = self.bases[-1] + len(self.datas[-1]) if self.datas else 0
+        data = byte_view(packed_data)
+        self.datas.append(data)
+        self.bases.append(base)
+
+        if len(data) < UUID_SIZE:
+            raise truncated(0, UUID)
+        self.uuids.append(swap_uuid_bytes(bytes(data[:UUID_SIZE])))
+        app_name, offset = decode_app_name(data, UUID_SIZE)
+        self.app_names.append(app_name)
+
+        single = {}
+        while offset < len(data):
+            field, end = skip_record(data, offset)
+            if field.repeated:
+                self.repeated[field.key].append((index, base + offset))
+            elif field.key in single:
+                raise ManifestDecodeError(
+                    f"duplicate {describe_field(field)} at offset {offset}")
+            else:
+                single[field.key] = base + offset
+            if field.string:
+                string_offset, string_size, _ = read_inline_string(
+                    data, offset + field.codec.size, describe_field(field))
+                self.strings[field.key].append(decode_string(
+                    data, string_offset, string_size, offset,
+                    describe_field(field)))
+            offset = end
+
+        for key, offsets in self.single.items():
+            offsets.append(single.get(key, ABSENT))
+
+    def locate(self, offset):
+        """Returns the manifest data holding a corpus offset, and the offset in
+        that manifest
+        """
+        # entries are decoded in corpus order, so this is rarely a search
+        index = self.last_index if offset >= self.bases[self.last_index] \
+            else 0
+        while index + 1 < len(self.bases) and self.bases[index + 1] <= offset:
+            index += 1
+        self.last_index = index
+        return self.datas[index], offset - self.bases[index]
+
+
+def app_columns(field):
+    return [(column, NUMPY_TYPES[code])
+            for column, code in zip(field.columns, field.layout)]
+
+
+def record_columns(field):
+    columns = [(APP_COLUMN, "<i8")] + app_columns(field)
+    if field.string:
+        columns.append((STRING_COLUMN, "O"))
+    return columns
+
+
+def app_table_columns():
+    # "V16" rather than "S16", which would drop trailing zero bytes
+    return [(UUID, "V16"), (APP_NAME, "O")] + [
+        (field.key, "<i8") for field in FIELDS if not field.repeated]
+
+
+def decode_python(corpus):
+    """Decodes the scanned corpus into dicts of column lists"""
+    def unpack(field, offset):
+        data, offset = corpus.locate(offset)
+        return field.codec.unpack_from(data, offset)[1:]
+
+    apps = {UUID: corpus.uuids, APP_NAME: corpus.app_names}
+    records = {}
+    for field in FIELDS:
+        if not field.repeated:
+            apps[field.key] = [ABSENT if offset == ABSENT else
+                               unpack(field, offset)[0]
+                               for offset in corpus.single[field.key]]
+            continue
+
+        entries = corpus.repeated[field.key]
+        values = [unpack(field, offset) for _, offset in entries]
+        table = {APP_COLUMN: [index for index, _ in entries]}
+        for position, column in enumerate(field.columns):
+            table[column] = [entry[position] for entry in values]
+        if field.string:
+            table[STRING_COLUMN] = corpus.strings[field.key]
+        records[field.key] = table
+
+    return ManifestColumns(apps, records)
+
+
+def decode_numpy(corpus, numpy):
+    """Decodes the scanned corpus into NumPy structured arrays"""
+    buffer = numpy.frombuffer(b"".join(bytes(data) for data in corpus.datas),
+                              dtype=numpy.uint8)
+
+    def gather(field, offsets):
+        """Decodes the entries of field at the given corpus offsets"""
+        dtype = numpy.dtype([("tag", "<u4")] + app_columns(field))
+        assert dtype.itemsize == field.codec.size
+        offsets = numpy.asarray(offsets, dtype=numpy.intp)
+        entry_bytes = buffer[offsets[:, None] +
+                             numpy.arange(dtype.itemsize, dtype=numpy.intp)]
+        return entry_bytes.view(dtype).reshape(-1)
+
+    apps = numpy.zeros(len(corpus.datas), dtype=app_table_columns())
+    apps[UUID] = numpy.frombuffer(b"".join(corpus.uuids), dtype="V16")
+    apps[APP_NAME] = corpus.app_names
+    records = {}
+    for field in FIELDS:
+        if not field.repeated:
+            offsets = numpy.asarray(corpus.single[field.key],
+                                    dtype=numpy.intp)
+            present = offsets != ABSENT
+            column = numpy.full(len(offsets), ABSENT, dtype=numpy.int64)
+            column[present] = gather(field, offsets[present])[field.key]
+            apps[field.key] = column
+            continue
+
+        entries = corpus.repeated[field.key]
+        table = numpy.zeros(len(entries), dtype=record_columns(field))
+        table[APP_COLUMN] = [index for index, _ in entries]
+        values = gather(field, [offset for _, offset in entries])
+        for column in field.columns:
+            table[column] = values[column]
+        if field.string:
+            table[STRING_COLUMN] = corpus.strings[field.key]
+        records[field.key] = table
+
+    return ManifestColumns(apps, records)
+
+
+def decode_manifest_columns(manifests, use_numpy=None):
+    """Decodes packed manifests into columnar tables.
+
+    :param manifests: iterable of bytes-like packed manifests
+    :param use_numpy: True to require NumPy structured arrays, False for dicts
+                      of column lists, None to use NumPy if it is installed
+    :returns: ManifestColumns
+    :raises ManifestDecodeError: if a manifest is malformed, the message
+                                 names the index of the manifest
+    :raises ImportError: if use_numpy is True and NumPy is not installed
+    """
+    numpy = None
+    if use_numpy or use_numpy is None:
+        numpy = import_numpy()
+        if numpy is None and use_numpy:
+            raise ImportError("NumPy is required for use_numpy=True")
+
+    corpus = ScannedCorpus()
+    for index, packed_data in enumerate(manifests):
+        try:
+            corpus.scan(packed_data)
+        except ManifestDecodeError as ex:
+            raise ManifestDecodeError(f"manifest {index}: {ex}") from None
+
+    if numpy is None:
+        return decode_python(corpus)
+    return decode_numpy(corpus, numpy)
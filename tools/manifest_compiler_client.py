@@ -0,0 +1,85 @@
+#!/bin/sh
+""":" # Shell script (in docstring to appease pylint)
+# Find and invoke hermetic python3 interpreter
+. "`dirname $0`/../../../vendor/google/aosp/scripts/envsetup.sh"
+exec "$PY3" "$0" "$@"
+# Shell script end
+
+Drop-in replacement for manifest_compiler.py which forwards its arguments to a
+running manifest_compiler_server.py and reports the exit status and output of
+the server.
+
+The server socket is taken from the MANIFEST_COMPILER_SOCKET environment
+variable. If it is not set, or no server is listening, manifest_compiler.py is
+run directly instead, as are command lines the server declines. This script
+only imports a few small modules so that it starts quickly.
+"""
+
+import json
+import os
+import socket
+import sys
+
+SOCKET_ENV = "MANIFEST_COMPILER_SOCKET"
+
+# Environment variables read by the compiler, which the server applies to the
+# requests of the client. MAKEFLAGS is only read by the options the server
+# declines.
+FORWARDED_ENV = ("MANIFEST_COMPILER_CACHE_DIR",)
+COMPILER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "manifest_compiler.py")
+
+
+def run_locally(argv):
+    """Replaces this process with a manifest_compiler.py process"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, [sys.executable, COMPILER] + argv)
+
+
+def run_on_server(socket_path, argv):
+    """Sends the arguments to the server and returns its response, or None if
+    the server could not be reached or declined to run them.
+    """
+    request = json.dumps({
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": {name: os.environ.get(name) for name in FORWARDED_ENV},
+    }).encode()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall(request)
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    except OSError:
+        return None
+
+    try:
+        response = json.loads(b"".join(chunks).decode())
+    except ValueError:
+        return None
+    if "declined" in response:
+        return None
+    return response
+
+
+def main():
+    argv = sys.argv[1:]
+    socket_path = os.environ.get(SOCKET_ENV)
+    response = run_on_server(socket_path, argv) if socket_path else None
+    if response is None:
+        run_locally(argv)
+
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    return response["status"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+#!/bin/sh
+""":" # Shell script (in docstring to appease pylint)
+# Find and invoke hermetic python3 interpreter
+. "`dirname $0`/../../../vendor/google/aosp/scripts/envsetup.sh"
+exec "$PY3" "$0" "$@"
+# Shell script end
+
+Long-lived manifest compiler server.
+
+Starting a Python interpreter and parsing the same constants files again for
+every manifest and constants header rule dominates the time spent in
+gen_manifest.mk. This server keeps manifest_compiler loaded together with the
+parsed manifest and constants files, and runs the manifest_compiler command
+lines it receives on a local Unix socket. A cached file is parsed again when
+its (path, mtime, size) changes.
+
+Requests are run concurrently, each in the working directory and with the
+manifest_compiler environment variables of its client. Command lines using
+--batch or --decode are declined and run by the client itself, as they fork
+pools of worker processes and take job slots from the make jobserver of the
+client.
+
+USAGE:
+    manifest_compiler_server.py --socket <socket_path> \
+        [--idle-timeout <seconds>]
+
+    Point manifest_compiler_client.py at the server by setting
+    MANIFEST_COMPILER_SOCKET=<socket_path> in its environment. The client takes
+    the same arguments as manifest_compiler.py and runs the compiler itself if
+    no server is listening.
+
+PROTOCOL:
+    The client sends a single JSON object
+    {"argv": [...], "cwd": "...", "env": {"<name>": "<value>" or null, ...}}
+    holding the variables of FORWARDED_ENV, and shuts down its side of the
+    connection. The server replies with a single JSON object
+    {"status": <exit code>, "stdout": "...", "stderr": "..."}, or
+    {"declined": "<reason>"} if the client has to run the command line itself.
+"""
+
+import argparse
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+import manifest_compiler
+from manifest_compiler_client import FORWARDED_ENV
+
+
+class LocalOptionParser(argparse.ArgumentParser):
+    """Parser of the options only run by clients, which reports errors by
+    raising ValueError instead of exiting the program
+    """
+
+    def error(self, message):
+        raise ValueError(message)
+
+
+def declined_option(argv):
+    """Returns the option of argv which the client has to run itself, if any.
+    Invalid command lines are declined too, the client reports their errors.
+    """
+    parser = LocalOptionParser(add_help=False)
+    parser.add_argument("--batch")
+    parser.add_argument("--decode", nargs="+")
+    try:
+        args, _ = parser.parse_known_args(argv)
+    except ValueError as ex:
+        return str(ex)
+    if args.batch is not None:
+        return "--batch"
+    if args.decode is not None:
+        return "--decode"
+    return None
+
+
+def client_environ(env):
+    """Returns the environment of the server updated with the variables
+    forwarded by the client, None removing a variable
+    """
+    environ = dict(os.environ)
+    for name, value in env.items():
+        if value is None:
+            environ.pop(name, None)
+        else:
+            environ[name] = value
+    return environ
+
+
+class CompileRequestHandler(socketserver.StreamRequestHandler):
+    """Runs one manifest_compiler command line sent by a client"""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.read().decode())
+            argv = [str(arg) for arg in request["argv"]]
+            cwd = str(request["cwd"])
+            env = {name: request["env"][name] for name in FORWARDED_ENV}
+            for value in env.values():
+                if value is not None and not isinstance(value, str):
+                    raise TypeError(f"invalid environment value {value!r}")
+        except (ValueError, KeyError, TypeError) as ex:
+            response = {"status": 2, "stdout": "",
+                        "stderr": f"Error: invalid request: {ex}\n"}
+        else:
+            declined = declined_option(argv)
+            if declined:
+                response = {"declined": declined}
+            else:
+                response = self.server.run(argv, cwd, env)
+
+        self.wfile.write(json.dumps(response).encode())
+
+
+class CompileServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    """Unix socket server that runs manifest_compiler requests concurrently
+    against a shared CompilerCache
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, idle_timeout=None):
+        super().__init__(socket_path, CompileRequestHandler)
+        self.socket_path = socket_path
+        self.timeout = idle_timeout
+        self.idle = False
+        self.cache = manifest_compiler.CompilerCache()
+        # requests being handled by their threads
+        self.active_requests = 0
+        self.active_lock = threading.Lock()
+
+    def run(self, argv, cwd, env=None):
+        """Runs manifest_compiler.main with the given arguments, working
+        directory and forwarded environment variables, capturing its exit
+        status and output.
+        """
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        # headers may have been deleted since the last request
+        self.cache.forget_written_headers()
+        try:
+            status = manifest_compiler.main(argv, self.cache, cwd,
+                                            client_environ(env or {}),
+                                            stdout, stderr)
+        except SystemExit as ex:
+            status = ex.code
+        except OSError as ex:
+            stderr.write(f"Error: {ex}\n")
+            status = 1
+
+        if status is None:
+            status = 0
+        elif not isinstance(status, int):
+            stderr.write(f"{status}\n")
+            status = 1
+
+        return {"status": status, "stdout": stdout.getvalue(),
+                "stderr": stderr.getvalue()}
+
+    def process_request(self, request, client_address):
+        with self.active_lock:
+            self.active_requests += 1
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            with self.active_lock:
+                self.active_requests -= 1
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            with self.active_lock:
+                self.active_requests -= 1
+
+    def handle_timeout(self):
+        # a request still being compiled would lose its reply
+        with self.active_lock:
+            if not self.active_requests:
+                self.idle = True
+
+
+def remove_stale_socket(socket_path):
+    """Removes a socket left behind by a server that is no longer running.
+
+    :returns: False if another server is listening on socket_path
+    """
+    if not os.path.exists(socket_path):
+        return True
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+            return True
+
+    return False
+
+
+def serve(socket_path, idle_timeout=None):
+    """Serves compile requests until the server has been idle for
+    idle_timeout seconds, or forever if idle_timeout is None.
+    """
+    if not remove_stale_socket(socket_path):
+        sys.stderr.write(f"Error: a server is already listening on "
+                         f"{socket_path}\n")
+        return 1
+
+    with CompileServer(socket_path, idle_timeout) as server:
+        try:
+            while not server.idle:
+                server.handle_request()
+        finally:
+            os.unlink(socket_path)
+
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--socket",
+        dest="socket_path",
+        required=True,
+        type=str,
+        help="Path of the Unix socket to listen on"
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        dest="idle_timeout",
+        required=False,
+        type=float,
+        metavar="SECONDS",
+        help="Exit after not receiving any request for this long"
+    )
+    args = parser.parse_args()
+
+    try:
+        return serve(args.socket_path, args.idle_timeout)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Decoding of many binary manifests into JSON lines, for
+manifest_compiler.py --decode.
+
+The manifests are given as files, directories, which are searched for
+*.manifest files, or glob patterns. They are decoded by a pool of worker
+processes, and written to the output as one compact JSON object per line
+holding the path of the manifest file and its fields, in the order the
+files were found. Only a bounded number of manifests is in flight at a
+time, so that trees of any size can be piped into other tools.
+
+With a list of fields, only those fields of each manifest are decoded.
+"""
+
+import glob
+import json
+import os
+
+from manifest_build import batch_executor, run_batch_chunks
+from manifest_defs import APP_NAME, UUID
+from manifest_schema import FIELDS_BY_KEY, ManifestDecodeError
+from manifest_unpacker import ManifestView, unpack_binary_manifest_to_data
+
+# Suffix of the manifest files found in directories
+MANIFEST_SUFFIX = ".manifest"
+
+# Suffix of the manifest config files found in directories by --check and
+# --cross-check
+JSON_MANIFEST_SUFFIX = "manifest.json"
+
+# Key of the manifest file path in the JSON lines
+PATH = "path"
+
+# Fields which can be selected, besides the tagged fields
+HEADER_FIELDS = (UUID, APP_NAME)
+
+# Manifests decoded by one task of a worker process
+CHUNK_SIZE = 64
+
+
+def parse_fields(fields):
+    """Parses the comma separated --fields list.
+
+    :returns: tuple of field keys
+    :raises ValueError: if a field is unknown
+    """
+    keys = tuple(key.strip() for key in fields.split(",") if key.strip())
+    for key in keys:
+        if key not in HEADER_FIELDS and key not in FIELDS_BY_KEY:
+            raise ValueError(
+                f"unknown field {key!r}, expected one of " +
+                ", ".join(HEADER_FIELDS + tuple(FIELDS_BY_KEY)))
+    return keys
+
+
+def find_manifest_files(paths, log, suffixes=(MANIFEST_SUFFIX,)):
+    """Yields the manifest files named by paths: files as they are, the files
+    below directories whose names end with one of suffixes, *.manifest by
+    default, and the matches of glob patterns, in sorted order per path.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            matches = [path]
+        elif os.path.exists(path) or not glob.has_magic(path):
+            yield path
+            continue
+        else:
+            matches = sorted(glob.iglob(path, recursive=True))
+            if not matches:
+                log.error(f"{path}: no matching files")
+
+        for match in matches:
+            if not os.path.isdir(match):
+                yield match
+                continue
+            for dir_path, dir_names, file_names in os.walk(match):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if file_name.endswith(suffixes):
+                        yield os.path.join(dir_path, file_name)
+
+
+def decode_manifest(packed_data, fields=None):
+    """Returns the JSON data of a packed manifest. With fields, only those
+    fields are decoded, and fields missing from the manifest are left out as
+    they are without fields.
+    """
+    if fields is None:
+        return unpack_binary_manifest_to_data(packed_data)
+
+    manifest = {}
+    with ManifestView(packed_data) as view:
+        for key in fields:
+            if key in HEADER_FIELDS:
+                manifest[key] = getattr(view, key)
+            elif FIELDS_BY_KEY[key].tag in view.offsets:
+                manifest[key] = view.get(key)
+    return manifest
+
+
+def decode_manifest_file(path, fields=None):
+    """Decodes one manifest file into a JSON line.
+
+    :returns: tuple of the JSON line, or None on error, and the error
+    """
+    try:
+        with open(path, "rb") as manifest_file:
+            packed_data = manifest_file.read()
+        manifest = decode_manifest(packed_data, fields)
+    except (IOError, ManifestDecodeError) as ex:
+        return None, f"{path}: {ex}"
+
+    line = {PATH: path}
+    line.update(manifest)
+    return json.dumps(line, separators=(",", ":")) + "\n", None
+
+
+def decode_manifest_chunk(chunk, fields):
+    return [decode_manifest_file(path, fields) for path in chunk]
+
+
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def decode_results(paths, fields, jobs, jobserver=None):
+    """Yields the decode_manifest_file() results of paths, in order. With
+    jobs > 1, chunks of paths are decoded by the worker processes of
+    manifest_build.run_batch_chunks(), sharing the job slots of make with a
+    make_jobserver.Jobserver.
+    """
+    if jobs <= 1:
+        for path in paths:
+            yield decode_manifest_file(path, fields)
+        return
+
+    executor = batch_executor(jobs)
+    chunk_results = run_batch_chunks(executor, iter_chunks(paths, CHUNK_SIZE),
+                                     jobs, jobserver, decode_manifest_chunk,
+                                     (fields,))
+    try:
+        for chunk in chunk_results:
+            yield from chunk
+    finally:
+        chunk_results.close()
+        executor.shutdown()
+
+
+def decode_manifests(paths, out, log, fields=None, jobs=1, jobserver=None):
+    """Writes the JSON line of every manifest file found in paths to out.
+    Manifests which cannot be read or decoded are reported to log. With a
+    make_jobserver.Jobserver, workers beyond the first run on job slots of
+    make.
+
+    :returns: number of manifests written
+    """
+    count = 0
+    for line, error in decode_results(find_manifest_files(paths, log), fields,
+                                      jobs, jobserver):
+        if error:
+            log.error(error)
+        else:
+            out.write(line)
+            count += 1
+    return count
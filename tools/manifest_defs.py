@@ -0,0 +1,358 @@
+"""Definitions shared by the manifest compiler modules: the keys of manifest
+and constants config files, the tags and flags of binary manifests, the classes
+holding parsed manifests and constants, and the error Log.
+"""
+
+import sys
+
+# Manifest properties
+UUID = "uuid"
+MIN_HEAP = "min_heap"
+MIN_STACK = "min_stack"
+MIN_SHADOW_STACK = "min_shadow_stack"
+MEM_MAP = "mem_map"
+MEM_MAP_ID = "id"
+MEM_MAP_ADDR = "addr"
+MEM_MAP_SIZE = "size"
+MEM_MAP_TYPE = "type"
+MEM_MAP_TYPE_CACHED = "cached"
+MEM_MAP_TYPE_UNCACHED = "uncached"
+MEM_MAP_TYPE_UNCACHED_DEVICE = "uncached_device"
+MEM_MAP_NON_SECURE = "non_secure"
+MEM_MAP_COUNT = "count"
+MEM_MAP_STRIDE = "stride"
+MGMT_FLAGS = "mgmt_flags"
+MGMT_FLAG_RESTART_ON_EXIT = "restart_on_exit"
+MGMT_FLAG_DEFERRED_START = "deferred_start"
+MGMT_FLAG_NON_CRITICAL_APP = "non_critical_app"
+START_PORTS = "start_ports"
+START_PORT_FLAGS = "flags"
+START_PORT_NAME = "name"
+START_PORT_ALLOW_TA_CONNECT = "allow_ta_connect"
+START_PORT_ALLOW_NS_CONNECT = "allow_ns_connect"
+APP_NAME = "app_name"
+PINNED_CPU = "pinned_cpu"
+PRIORITY = "priority"
+VERSION = "version"
+APPLOADER_FLAGS = "apploader_flags"
+APPLOADER_FLAGS_REQUIRES_ENCRYPTION = "requires_encryption"
+# manifest config extended by a manifest config, see manifest_overlay
+BASE = "base"
+
+# constants configs
+CONSTANTS = "constants"
+HEADER = "header"
+CONST_NAME = "name"
+CONST_VALUE = "value"
+CONST_TYPE = "type"
+CONST_UNSIGNED = "unsigned"
+CONST_PORT = "port"
+CONST_UUID = "uuid"
+CONST_INT = "int"
+CONST_BOOL = "bool"
+
+# Architectures of the ELF objects written by --emit-object
+OBJECT_ARCHES = ("arm", "arm64", "x86_64")
+
+# CONFIG TAGS
+# These values need to be kept in sync with lib/app_manifest/app_manifest.h
+TRUSTY_APP_CONFIG_KEY_MIN_STACK_SIZE = 1
+TRUSTY_APP_CONFIG_KEY_MIN_HEAP_SIZE = 2
+TRUSTY_APP_CONFIG_KEY_MAP_MEM = 3
+TRUSTY_APP_CONFIG_KEY_MGMT_FLAGS = 4
+TRUSTY_APP_CONFIG_KEY_START_PORT = 5
+TRUSTY_APP_CONFIG_KEY_PINNED_CPU = 6
+TRUSTY_APP_CONFIG_KEY_VERSION = 7
+TRUSTY_APP_CONFIG_KEY_MIN_SHADOW_STACK_SIZE = 8
+TRUSTY_APP_CONFIG_KEY_APPLOADER_FLAGS = 9
+TRUSTY_APP_CONFIG_KEY_PRIORITY = 10
+
+# MEM_MAP ARCH_MMU_FLAGS
+# These values need to be kept in sync with external/lk/include/arch/mmu.h
+ARCH_MMU_FLAG_CACHED = 0 << 0
+ARCH_MMU_FLAG_UNCACHED = 1 << 0
+ARCH_MMU_FLAG_UNCACHED_DEVICE = 2 << 0
+ARCH_MMU_FLAG_CACHE_MASK = 3 << 0
+ARCH_MMU_FLAG_NS = 1 << 5
+
+# MGMT FLAGS
+# These values need to be kept in sync with lib/app_manifest/app_manifest.h
+TRUSTY_APP_MGMT_FLAGS_NONE = 0
+TRUSTY_APP_MGMT_FLAGS_RESTART_ON_EXIT = 1 << 0
+TRUSTY_APP_MGMT_FLAGS_DEFERRED_START = 1 << 1
+TRUSTY_APP_MGMT_FLAGS_NON_CRITICAL_APP = 1 << 2
+
+# APPLOADER FLAGS
+# These values need to be kept in sync with lib/app_manifest/app_manifest.h
+TRUSTY_APP_APPLOADER_FLAGS_NONE = 0
+TRUSTY_APP_APPLOADER_FLAGS_REQUIRES_ENCRYPTION = 1 << 0
+
+# START_PORT flags
+# These values need to be kept in sync with user/base/include/user/trusty_ipc.h
+IPC_PORT_ALLOW_TA_CONNECT = 0x1
+IPC_PORT_ALLOW_NS_CONNECT = 0x2
+
+IPC_PORT_PATH_MAX = 64
+
+
+class Record(object):
+    """Immutable record holding the values of the attributes named by the
+    __slots__ of its class, in that order. Records of the same class are equal
+    if their values are, and can be hashed if their values can, so that e.g.
+    parsed manifests can be deduplicated and used as cache keys. record_types
+    names the Record class of attributes holding a record or a tuple of
+    records, for from_dict().
+    """
+
+    __slots__ = ()
+    record_types = {}
+
+    def __init__(self, *values, **named_values):
+        slots = self.__slots__
+        if named_values or len(values) != len(slots):
+            names = slots[len(values):]
+            if len(values) > len(slots) or set(named_values) != set(names):
+                raise TypeError(f"{type(self).__name__} takes the values of " +
+                                ", ".join(slots))
+            values += tuple(named_values[name] for name in names)
+        setattr_ = object.__setattr__
+        for name, value in zip(slots, values):
+            setattr_(self, name, value)
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def replace(self, **changes):
+        """Returns a copy of the record with the given attributes changed"""
+        record = object.__new__(type(self))
+        for name in self.__slots__:
+            object.__setattr__(record, name,
+                               changes.pop(name, getattr(self, name)))
+        if changes:
+            raise TypeError(f"{type(self).__name__} has no attributes " +
+                            ", ".join(changes))
+        return record
+
+    def to_dict(self):
+        """Returns the attributes as a dict, with records as dicts and tuples
+        as lists
+        """
+        def convert(value):
+            if isinstance(value, Record):
+                return value.to_dict()
+            if isinstance(value, tuple):
+                return [convert(item) for item in value]
+            return value
+        return {name: convert(getattr(self, name)) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values):
+        """Creates a record from the attributes returned by to_dict()"""
+        record = object.__new__(cls)
+        for name in cls.__slots__:
+            value = values[name]
+            record_type = cls.record_types.get(name)
+            if record_type and isinstance(value, list):
+                value = tuple(record_type.from_dict(item) for item in value)
+            elif record_type and value is not None:
+                value = record_type.from_dict(value)
+            object.__setattr__(record, name, value)
+        return record
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __getstate__(self):
+        return self.values()
+
+    def __setstate__(self, values):
+        Record.__init__(self, *values)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __hash__(self):
+        return hash((type(self), self.values()))
+
+    def __repr__(self):
+        return f"{type(self).__name__}(" + ", ".join(
+            f"{name}={getattr(self, name)!r}" for name in self.__slots__) + ")"
+
+
+class Constant(Record):
+    __slots__ = ("name", "value", "type", "unsigned", "hex_num", "source")
+
+    def __init__(self, name, value, type_, unsigned=False, hex_num=False,
+                 source=None):
+        # source is the path of the constants config file defining this
+        # constant
+        super().__init__(name, value, type_, unsigned, hex_num, source)
+
+
+class ConfigConstants(Record):
+    __slots__ = ("constants", "header")
+    record_types = {"constants": Constant}
+
+    def __init__(self, constants, header):
+        super().__init__(tuple(constants), header)
+
+
+class StartPortFlags(Record):
+    __slots__ = ("allow_ta_connect", "allow_ns_connect")
+
+
+class StartPort(Record):
+    __slots__ = ("name", "name_size", "start_port_flags")
+    record_types = {"start_port_flags": StartPortFlags}
+
+
+class MemIOMap(Record):
+    __slots__ = ("id", "addr", "size", "type", "non_secure")
+
+    def __init__(self, id_, addr, size, type_, non_secure):
+        super().__init__(id_, addr, size, type_, non_secure)
+
+
+class MgmtFlags(Record):
+    __slots__ = ("restart_on_exit", "deferred_start", "non_critical_app")
+
+
+class ApploaderFlags(Record):
+    __slots__ = ("requires_encryption",)
+
+
+class FlagSet(object):
+    """Boolean attributes of a manifest JSON object which are packed as the
+    bits of one integer. flags is a tuple of the (key, bit) of each attribute,
+    and each key is also the name of the attribute of the record class, which
+    is constructed with one value per flag in the same order. name is the path
+    of the object used in diagnostics.
+    """
+
+    def __init__(self, name, flags, record):
+        self.name = name
+        self.flags = flags
+        self.record = record
+
+    def keys(self):
+        return frozenset(key for key, _ in self.flags)
+
+    def defaults(self):
+        return {key: False for key, _ in self.flags}
+
+    def pack(self, record):
+        bits = 0
+        for key, bit in self.flags:
+            if getattr(record, key):
+                bits |= bit
+        return bits
+
+    def unpack(self, bits):
+        return {key: bool(bits & bit) for key, bit in self.flags}
+
+
+MGMT_FLAG_SET = FlagSet(MGMT_FLAGS, (
+    (MGMT_FLAG_RESTART_ON_EXIT, TRUSTY_APP_MGMT_FLAGS_RESTART_ON_EXIT),
+    (MGMT_FLAG_DEFERRED_START, TRUSTY_APP_MGMT_FLAGS_DEFERRED_START),
+    (MGMT_FLAG_NON_CRITICAL_APP, TRUSTY_APP_MGMT_FLAGS_NON_CRITICAL_APP),
+), MgmtFlags)
+
+APPLOADER_FLAG_SET = FlagSet(APPLOADER_FLAGS, (
+    (APPLOADER_FLAGS_REQUIRES_ENCRYPTION,
+     TRUSTY_APP_APPLOADER_FLAGS_REQUIRES_ENCRYPTION),
+), ApploaderFlags)
+
+START_PORT_FLAG_SET = FlagSet(f"{START_PORTS}.{START_PORT_FLAGS}", (
+    (START_PORT_ALLOW_TA_CONNECT, IPC_PORT_ALLOW_TA_CONNECT),
+    (START_PORT_ALLOW_NS_CONNECT, IPC_PORT_ALLOW_NS_CONNECT),
+), StartPortFlags)
+
+
+class Manifest(Record):
+    """Holds Manifest data to be used for packing"""
+
+    __slots__ = (
+        "uuid",
+        "app_name",
+        "min_heap",
+        "min_stack",
+        "min_shadow_stack",
+        "mem_io_maps",
+        "mgmt_flags",
+        "start_ports",
+        "pinned_cpu",
+        "priority",
+        "version",
+        "apploader_flags",
+    )
+    record_types = {
+        "mem_io_maps": MemIOMap,
+        "mgmt_flags": MgmtFlags,
+        "start_ports": StartPort,
+        "apploader_flags": ApploaderFlags,
+    }
+
+    def __init__(
+            self,
+            uuid,
+            app_name,
+            min_heap,
+            min_stack,
+            min_shadow_stack,
+            mem_io_maps,
+            mgmt_flags,
+            start_ports,
+            pinned_cpu,
+            priority,
+            version,
+            apploader_flags,
+    ):
+        if mem_io_maps is not None:
+            mem_io_maps = tuple(mem_io_maps)
+        if start_ports is not None:
+            start_ports = tuple(start_ports)
+        super().__init__(uuid, app_name, min_heap, min_stack,
+                         min_shadow_stack, mem_io_maps, mgmt_flags,
+                         start_ports, pinned_cpu, priority, version,
+                         apploader_flags)
+
+
+class Log(object):
+    """Tracks errors during manifest compilation"""
+
+    def __init__(self, context=None, out=None):
+        self.error_count = 0
+        self.context = context
+        # stream the errors are written to, stderr if None
+        self.out = out
+        self.messages = []
+
+    def error(self, msg):
+        self.messages.append(msg)
+        if self.context:
+            msg = f"{self.context}: {msg}"
+        (self.out or sys.stderr).write(f"Error: {msg}\n")
+        self.error_count += 1
+
+    def error_occurred(self):
+        return self.error_count > 0
+
+
+def format_uuid(uuid):
+    """Returns the string form of a 16 byte UUID in big endian order"""
+    uuid = uuid.hex()
+    return f"{uuid[:8]}-{uuid[8:12]}-{uuid[12:16]}-{uuid[16:20]}-{uuid[20:]}"
+
+
+def swap_uuid_bytes(uuid):
+    """This script represents UUIDs in a purely big endian order.
+    Trusty stores the first three components of the UUID in little endian order.
+    Rearrange the byte order accordingly by doing inverse
+    on first three components of UUID
+    """
+    return uuid[3::-1] + uuid[5:3:-1] + uuid[7:5:-1] + uuid[8:]
@@ -0,0 +1,144 @@
+"""Relocatable ELF objects holding a packed manifest, for
+manifest_compiler.py --emit-object.
+
+The object holds the packed manifest in the .trusty_app.manifest section
+the app loader reads, aligned to 4 bytes like the section of manifests
+defined in C with TRUSTY_APP_MANIFEST_ATTRS, so it can be linked into the
+app like any other object. Besides the section header string table, it has
+a symbol table holding the section symbol and an empty .note.GNU-stack
+section, so that linkers do not assume an executable stack. The objects are
+written without any toolchain, for little-endian ARM, AArch64 and x86-64.
+"""
+
+import struct
+
+from manifest_defs import OBJECT_ARCHES
+
+# Section holding the manifest of an app
+MANIFEST_SECTION = ".trusty_app.manifest"
+MANIFEST_ALIGNMENT = 4
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+EV_CURRENT = 1
+ET_REL = 1
+
+EM_ARM = 40
+EM_X86_64 = 62
+EM_AARCH64 = 183
+
+# ARM EABI version 5, as set by current ARM toolchains
+EF_ARM_EABI_VER5 = 0x05000000
+
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHF_ALLOC = 0x2
+
+STB_LOCAL = 0
+STT_SECTION = 3
+
+# Indices of the sections of the written objects
+SHN_MANIFEST = 1
+SHN_GNU_STACK = 2
+SHN_SYMTAB = 3
+SHN_STRTAB = 4
+SHN_SHSTRTAB = 5
+
+
+class ElfFormat(object):
+    """Layout of the ELF objects of one architecture"""
+
+    def __init__(self, machine, elf_class, flags=0):
+        self.machine = machine
+        self.elf_class = elf_class
+        self.flags = flags
+        if elf_class == ELFCLASS64:
+            self.header = struct.Struct("<16sHHIQQQIHHHHHH")
+            self.section_header = struct.Struct("<IIQQQQIIQQ")
+            self.symbol = struct.Struct("<IBBHQQ")
+            self.word_size = 8
+        else:
+            self.header = struct.Struct("<16sHHIIIIIHHHHHH")
+            self.section_header = struct.Struct("<IIIIIIIIII")
+            self.symbol = struct.Struct("<IIIBBH")
+            self.word_size = 4
+
+    def pack_symbol(self, name, info, shndx):
+        if self.elf_class == ELFCLASS64:
+            return self.symbol.pack(name, info, 0, shndx, 0, 0)
+        return self.symbol.pack(name, 0, 0, info, 0, shndx)
+
+
+ELF_FORMATS = {
+    "arm": ElfFormat(EM_ARM, ELFCLASS32, EF_ARM_EABI_VER5),
+    "arm64": ElfFormat(EM_AARCH64, ELFCLASS64),
+    "x86_64": ElfFormat(EM_X86_64, ELFCLASS64),
+}
+
+assert tuple(ELF_FORMATS) == OBJECT_ARCHES
+
+
+def align(offset, alignment):
+    return (offset + alignment - 1) & -alignment
+
+
+def string_table(names):
+    """Returns an ELF string table holding names, and the offset of each"""
+    table = bytearray(b"\0")
+    offsets = []
+    for name in names:
+        offsets.append(len(table))
+        table += name.encode() + b"\0"
+    return bytes(table), offsets
+
+
+def pack_object(packed_data, arch):
+    """Returns a relocatable ELF object for arch, one of OBJECT_ARCHES,
+    holding packed_data in the manifest section
+    """
+    elf = ELF_FORMATS[arch]
+    shstrtab, (manifest_name, gnu_stack_name, symtab_name, strtab_name,
+               shstrtab_name) = string_table(
+                   (MANIFEST_SECTION, ".note.GNU-stack", ".symtab",
+                    ".strtab", ".shstrtab"))
+    strtab = b"\0"
+    # the null symbol and the section symbol of the manifest section
+    symtab = (elf.pack_symbol(0, 0, 0) +
+              elf.pack_symbol(0, (STB_LOCAL << 4) | STT_SECTION,
+                              SHN_MANIFEST))
+
+    # (name, type, flags, data, link, info, alignment, entry size)
+    sections = (
+        (manifest_name, SHT_PROGBITS, SHF_ALLOC, bytes(packed_data), 0, 0,
+         MANIFEST_ALIGNMENT, 0),
+        (gnu_stack_name, SHT_PROGBITS, 0, b"", 0, 0, 1, 0),
+        # info is the index of the first global symbol
+        (symtab_name, SHT_SYMTAB, 0, symtab, SHN_STRTAB, 2, elf.word_size,
+         elf.symbol.size),
+        (strtab_name, SHT_STRTAB, 0, strtab, 0, 0, 1, 0),
+        (shstrtab_name, SHT_STRTAB, 0, shstrtab, 0, 0, 1, 0),
+    )
+
+    contents = bytearray(elf.header.size)
+    section_headers = [bytes(elf.section_header.size)]
+    for name, type_, flags, data, link, info, alignment, entry_size in \
+            sections:
+        offset = align(len(contents), alignment)
+        contents += bytes(offset - len(contents)) + data
+        section_headers.append(elf.section_header.pack(
+            name, type_, flags, 0, offset, len(data), link, info, alignment,
+            entry_size))
+
+    section_header_offset = align(len(contents), elf.word_size)
+    contents += bytes(section_header_offset - len(contents))
+    contents += b"".join(section_headers)
+
+    ident = struct.pack("<4sBBBB8x", b"\x7fELF", elf.elf_class, ELFDATA2LSB,
+                        EV_CURRENT, 0)
+    elf.header.pack_into(
+        contents, 0, ident, ET_REL, elf.machine, EV_CURRENT, 0, 0,
+        section_header_offset, elf.flags, elf.header.size, 0, 0,
+        elf.section_header.size, len(section_headers), SHN_SHSTRTAB)
+    return bytes(contents)
@@ -0,0 +1,98 @@
+"""Generation of C headers defining the constants of constants config files,
+for manifest_compiler.py.
+"""
+
+import json
+import os
+
+from manifest_defs import CONST_BOOL, CONST_INT, CONST_PORT, CONST_UUID
+from manifest_outputs import write_file_if_changed
+from manifest_parser import extract_config_constants, read_config_constants
+
+
+def define_integer_const_entry(const):
+    text = hex(const.value) if const.hex_num else str(const.value)
+    if const.unsigned:
+        text += "U"
+
+    return f"#define {const.name} ({text})\n"
+
+
+def define_string_const_entry(const):
+    return f"#define {const.name} {json.dumps(const.value)}\n"
+
+
+def define_bool_const_entry(const):
+    return f"#define {const.name} ({json.dumps(const.value)})\n"
+
+
+def define_uuid_const_entry(const):
+    uuid = const.value.hex()
+
+    part = ", ".join(
+        ["0x" + uuid[index:index + 2] for index in range(16, len(uuid), 2)])
+
+    value = f"{{0x{uuid[:8]}, 0x{uuid[8:12]}, 0x{uuid[12:16]}, {{ {part} }}}}\n"
+
+    return f"#define {const.name} {value}"
+
+
+# Functions defining a constant in a header, by constant type
+HEADER_ENTRY_DEFINERS = {
+    CONST_PORT: define_string_const_entry,
+    CONST_UUID: define_uuid_const_entry,
+    CONST_INT: define_integer_const_entry,
+    CONST_BOOL: define_bool_const_entry,
+}
+
+
+def create_header_entry(constant):
+    define = HEADER_ENTRY_DEFINERS.get(constant.type)
+    if define is None:
+        raise Exception(f"Unknown tag: {constant.type}")
+    return define(constant)
+
+
+def write_consts_to_header_file(const_config, header_dir, log):
+    """Writes given constants to header file in given header directory. An
+    existing header with the same content is left untouched.
+    """
+    # Construct header file path
+    header_file = os.path.join(header_dir, const_config.header)
+    # Check whether the output directory of header file exist
+    # If it not exists create it.
+    dir_name = os.path.dirname(header_file)
+    if dir_name and not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+
+    header_entries = ["#pragma once\n", "#include <stdbool.h>\n\n"]
+    for const in const_config.constants:
+        header_entries.append(create_header_entry(const))
+
+    try:
+        write_file_if_changed(header_file,
+                              "".join(header_entries).encode("utf-8"))
+    except IOError as ex:
+        log.error(f"Unable to write to header file: {header_file}\n" + str(ex))
+
+
+def process_config_constants(const_config_files, header_dir, log):
+    """Parse JSON config constants and creates separate header files with
+    constants for each JSON config
+    """
+    if const_config_files is None:
+        return []
+
+    config_consts_list = read_config_constants(const_config_files, log)
+    if log.error_occurred():
+        return []
+
+    config_constants = extract_config_constants(config_consts_list, log)
+    if log.error_occurred():
+        return []
+
+    # generate header files
+    for const_config in config_constants:
+        write_consts_to_header_file(const_config, header_dir, log)
+
+    return config_constants
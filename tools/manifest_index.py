@@ -0,0 +1,230 @@
+"""Tree-wide index of manifests, for manifest_compiler.py --cross-check.
+
+Every compiler run only sees one app, so two apps with the same UUID or two
+apps claiming the same start port are only noticed by the device at boot.
+ManifestIndex maps each UUID and each start port name to the manifests
+using it, and reports every UUID or port used by more than one manifest.
+
+With mem_maps, the index also holds the mem_map regions of every manifest.
+mem_map_conflicts() sorts them by address and sweeps over them, keeping the
+regions which are still open in a heap by their end address. Every pair of
+overlapping regions is reported, naming conflicting cache types or
+security, in O(n log n + k) for k reported pairs. mem_map ids used twice by
+one manifest are reported as well.
+
+The manifests are given as files, directories, which are searched for
+manifest.json and *.manifest files, or glob patterns. JSON manifest configs
+are read with their constants and bases resolved like the compiler does,
+compiled *.manifest binaries are decoded. Only the UUID, the start ports and
+optionally the mem_map of each manifest are read.
+"""
+
+import heapq
+
+from manifest_decode import (
+    JSON_MANIFEST_SUFFIX, MANIFEST_SUFFIX, find_manifest_files
+)
+from manifest_defs import (
+    BASE, MEM_MAP_ADDR, MEM_MAP_ID, MEM_MAP_NON_SECURE, MEM_MAP_SIZE,
+    MEM_MAP_TYPE, START_PORTS, START_PORT_NAME, UUID, MemIOMap, Record,
+    format_uuid
+)
+from manifest_parser import (
+    coerce_to_dict, get_list, get_port, get_uuid, read_json_config_file
+)
+from manifest_overlay import ManifestResolver
+from manifest_schema import ManifestDecodeError, parse_mem_map_field
+from manifest_unpacker import ManifestView
+
+# Suffixes of the manifest files found in directories
+INDEX_SUFFIXES = (JSON_MANIFEST_SUFFIX, MANIFEST_SUFFIX)
+
+
+class MemMapRegion(Record):
+    """A mem_map entry of the manifest at path"""
+
+    __slots__ = ("path", "id", "addr", "size", "type", "non_secure")
+
+    @property
+    def end(self):
+        return self.addr + self.size
+
+    def __str__(self):
+        return (f"{self.path}: mem_map id {self.id} "
+                f"[{self.addr:#x}, {self.end:#x})")
+
+
+class ManifestIndex(object):
+    """Maps the UUIDs and the start port names of manifests to the paths of
+    the manifests using them, and holds the mem_map regions of the manifests
+    """
+
+    def __init__(self):
+        self.uuids = {}
+        self.ports = {}
+        self.mem_maps = []
+        self.duplicate_mem_map_ids = []
+        self.count = 0
+
+    def add(self, path, uuid, port_names, mem_maps=()):
+        """Adds a manifest with a UUID string, the names of its start ports and
+        its MemIOMaps
+        """
+        self.uuids.setdefault(uuid, []).append(path)
+        for name in port_names:
+            self.ports.setdefault(name, []).append(path)
+        ids = set()
+        for mem_map in mem_maps:
+            region = MemMapRegion(path, mem_map.id, mem_map.addr,
+                                  mem_map.size, mem_map.type,
+                                  bool(mem_map.non_secure))
+            if mem_map.id in ids:
+                self.duplicate_mem_map_ids.append(region)
+            ids.add(mem_map.id)
+            self.mem_maps.append(region)
+        self.count += 1
+
+    def collisions(self):
+        """Yields a message for each UUID and start port used by more than one
+        manifest, or more than once by one manifest
+        """
+        for what, index in (("UUID", self.uuids),
+                            ("start port", self.ports)):
+            for key, paths in index.items():
+                if len(paths) > 1:
+                    yield (f"{what} {key} is used by {len(paths)} "
+                           "manifests: " + ", ".join(paths))
+
+    def mem_map_conflicts(self):
+        """Yields a message for each mem_map id used twice by one manifest
+        and for each pair of overlapping mem_map regions
+        """
+        for region in self.duplicate_mem_map_ids:
+            yield f"{region.path}: duplicate mem_map id {region.id}"
+
+        regions = sorted((region for region in self.mem_maps if region.size),
+                         key=lambda region: (region.addr, region.end))
+        # (end, position, region) of the regions overlapping the address of
+        # the current one
+        open_regions = []
+        for position, region in enumerate(regions):
+            while open_regions and open_regions[0][0] <= region.addr:
+                heapq.heappop(open_regions)
+            for _, _, other in sorted(open_regions):
+                yield describe_overlap(other, region)
+            heapq.heappush(open_regions, (region.end, position, region))
+
+
+def describe_overlap(region, other):
+    conflicts = []
+    if region.type != other.type:
+        conflicts.append(f"cache types {region.type} and {other.type}")
+    if region.non_secure != other.non_secure:
+        conflicts.append(f"{MEM_MAP_NON_SECURE} {region.non_secure} and "
+                         f"{other.non_secure}")
+    if not conflicts:
+        return f"{region} overlaps {other}"
+    return (f"{region} overlaps {other} with conflicting " +
+            " and ".join(conflicts))
+
+
+def read_json_manifest(path, constants, log, mem_maps=False, resolver=None):
+    """Returns the UUID string, the start port names and, with mem_maps, the
+    MemIOMaps of a JSON manifest config, or None if they are invalid. The
+    bases of the manifest config are read through resolver if one is given.
+    """
+    manifest_dict = read_json_config_file(path, log)
+    if manifest_dict is None:
+        return None
+
+    # report errors in the manifest with its path
+    error_count = log.error_count
+    context, log.context = log.context, path
+    try:
+        manifest_dict = coerce_to_dict(manifest_dict, "manifest", log)
+        if manifest_dict is None:
+            return None
+        if BASE in manifest_dict:
+            resolved = (resolver or ManifestResolver()).resolve(
+                path, manifest_dict, log)
+            if resolved is None:
+                return None
+            manifest_dict, _ = resolved
+        uuid = get_uuid(manifest_dict, UUID, constants, log)
+        port_names = []
+        for port in get_list(manifest_dict, START_PORTS, log, optional=True,
+                             default=[]):
+            port = coerce_to_dict(port, START_PORTS, log)
+            if port is not None:
+                port_names.append(get_port(port, START_PORT_NAME, constants,
+                                           log))
+        mem_io_maps = ()
+        if mem_maps:
+            mem_io_maps = parse_mem_map_field(manifest_dict, constants, log)
+    finally:
+        log.context = context
+
+    if log.error_count > error_count:
+        return None
+    return format_uuid(uuid), port_names, mem_io_maps
+
+
+def read_binary_manifest(path, log, mem_maps=False):
+    """Returns the UUID string, the start port names and, with mem_maps, the
+    MemIOMaps of a compiled manifest, or None if it cannot be read
+    """
+    try:
+        with open(path, "rb") as manifest_file:
+            packed_data = manifest_file.read()
+        with ManifestView(packed_data) as view:
+            mem_io_maps = ()
+            if mem_maps:
+                mem_io_maps = [MemIOMap(mem_map[MEM_MAP_ID],
+                                        int(mem_map[MEM_MAP_ADDR], 16),
+                                        int(mem_map[MEM_MAP_SIZE], 16),
+                                        mem_map[MEM_MAP_TYPE],
+                                        mem_map[MEM_MAP_NON_SECURE])
+                               for mem_map in view.mem_map]
+            return view.uuid, [port[START_PORT_NAME]
+                               for port in view.start_ports], mem_io_maps
+    except (IOError, ManifestDecodeError) as ex:
+        log.error(f"{path}: {ex}")
+        return None
+
+
+def build_manifest_index(paths, constants, log, mem_maps=False):
+    """Indexes every manifest found in paths. Manifests which cannot be read
+    are reported to log and left out.
+
+    :param constants: constants by name, to resolve the constants used by
+                      JSON manifest configs
+    :param mem_maps: whether to index the mem_map regions of the manifests
+    :returns: ManifestIndex
+    """
+    index = ManifestIndex()
+    resolver = ManifestResolver()
+    for path in find_manifest_files(paths, log, INDEX_SUFFIXES):
+        if path.endswith(".json"):
+            entry = read_json_manifest(path, constants, log, mem_maps,
+                                       resolver)
+        else:
+            entry = read_binary_manifest(path, log, mem_maps)
+        if entry is not None:
+            index.add(path, *entry)
+    return index
+
+
+def cross_check_manifests(paths, constants, log, mem_maps=False):
+    """Reports every UUID and start port used by more than one of the
+    manifests found in paths to log, and with mem_maps every conflict of
+    their mem_map regions.
+
+    :returns: ManifestIndex of the manifests
+    """
+    index = build_manifest_index(paths, constants, log, mem_maps)
+    for message in index.collisions():
+        log.error(message)
+    if mem_maps:
+        for message in index.mem_map_conflicts():
+            log.error(message)
+    return index
@@ -0,0 +1,59 @@
+"""Writing of manifest compiler outputs"""
+
+import os
+
+
+def create_temp_file(path):
+    """Creates a new, empty file next to path with the permissions open()
+    would give path.
+
+    :returns: tuple of the open file descriptor and the path of the new file
+    """
+    attempt = 0
+    while True:
+        tmp_path = f"{path}.{os.getpid()}.{attempt}.tmp"
+        try:
+            return os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                           0o666), tmp_path
+        except FileExistsError:
+            # left behind by an earlier process with the same pid
+            attempt += 1
+
+
+def write_file_if_changed(path, data):
+    """Writes data to the file at path unless the file already holds exactly
+    data, so that its modification time only changes with its content. The
+    file is replaced atomically, readers never see partially written content.
+
+    :returns: True if the file was written
+    """
+    try:
+        with open(path, "rb") as old_file:
+            if old_file.read(len(data) + 1) == data:
+                return False
+    except IOError:
+        pass
+
+    fd, tmp_path = create_temp_file(path)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return True
+
+
+def write_stamp_file(stamp_file, log):
+    """Updates the modification time of a stamp file, creating it if needed.
+    Build rules whose outputs are only rewritten when they change use the stamp
+    file to record that they have run.
+    """
+    try:
+        with open(stamp_file, "ab"):
+            pass
+        os.utime(stamp_file)
+    except IOError as ex:
+        log.error(f"Unable to write to stamp file: {stamp_file}\n" + str(ex))
@@ -0,0 +1,224 @@
+"""Manifest configs extending a base manifest config, for manifest_compiler.py.
+
+A manifest config with a "base" attribute holds overlay attributes on top of
+the manifest config named by it, relative to the directory of the overlay.
+E.g. the scudo variant of an app only holds what it changes:
+
+    {
+        "base": "manifest.json",
+        "min_heap": 32768
+    }
+
+Bases can have bases of their own. The attributes of an overlay are merged
+into the attributes of its base:
+
+    mem_map:     entries replace the base entry with the same id, other
+                 entries are appended
+    start_ports: entries replace the base entry with the same name, other
+                 entries are appended
+    objects:     attributes are merged, e.g. the flags of mgmt_flags
+    others:      replace the base attribute
+
+ManifestResolver reads every base once and keeps it by the hash of its
+content, and keeps every resolved base by the hashes of its chain, so that
+the manifests of a batch or of a compile server sharing a base read, check
+and merge it once. The errors of a base are reported to every manifest
+using it.
+"""
+
+import hashlib
+import io
+import os
+
+from manifest_defs import (
+    BASE, Log, MEM_MAP, MEM_MAP_ID, Record, START_PORTS, START_PORT_NAME
+)
+from manifest_parser import coerce_to_dict, parse_json_config
+
+# Attribute identifying the entries of the list attributes merged by entry
+LIST_MERGE_KEYS = {
+    MEM_MAP: MEM_MAP_ID,
+    START_PORTS: START_PORT_NAME,
+}
+
+
+def merge_entries(base_entries, overlay_entries, key):
+    merged = list(base_entries)
+    positions = {}
+    for position, entry in enumerate(merged):
+        if isinstance(entry, dict) and key in entry:
+            positions[entry[key]] = position
+    for entry in overlay_entries:
+        position = None
+        if isinstance(entry, dict) and key in entry:
+            position = positions.get(entry[key])
+        if position is None:
+            merged.append(entry)
+        else:
+            merged[position] = entry
+    return merged
+
+
+def merge_manifest(base, overlay):
+    """Returns the attributes of the overlay manifest config merged into those
+    of its resolved base. Neither is modified, the result shares their values.
+    """
+    merged = dict(base)
+    for key, value in overlay.items():
+        if key == BASE:
+            continue
+        base_value = merged.get(key)
+        if (key in LIST_MERGE_KEYS and isinstance(value, list) and
+                isinstance(base_value, list)):
+            merged[key] = merge_entries(base_value, value,
+                                        LIST_MERGE_KEYS[key])
+        elif isinstance(value, dict) and isinstance(base_value, dict):
+            merged[key] = dict(base_value, **value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def base_path(path, manifest_dict, log):
+    """Returns the path of the base of a manifest config, None if it has no
+    base or its base is invalid
+    """
+    if BASE not in manifest_dict:
+        return None
+    base = manifest_dict[BASE]
+    if not isinstance(base, str) or not base:
+        log.error(f"{path}: Invalid value for {BASE} - \"{base}\", " +
+                  "path of a manifest config is expected")
+        return None
+    return os.path.normpath(os.path.join(os.path.dirname(path), base))
+
+
+class ResolvedManifest(Record):
+    """A manifest config merged with its bases.
+
+    manifest_dict: merged attributes, without the base attribute
+    bases: paths of the bases, starting with the base of the manifest
+    key: hashes of the content of the manifest config and its bases
+    """
+
+    __slots__ = ("manifest_dict", "bases", "key")
+
+
+class ManifestResolver(object):
+    """Resolves the bases of manifest configs. Bases are kept by content, so
+    a base changed on disk is read again while an unchanged one is reused.
+    """
+
+    def __init__(self):
+        # (path, content hash) -> (parsed JSON or None, error messages)
+        self.files = {}
+        # chain key -> ResolvedManifest
+        self.resolved = {}
+
+    def read_base(self, path, log):
+        """Returns the content hash and the parsed JSON of a base, or None
+        if it cannot be read
+        """
+        try:
+            with open(path, "rb") as base_file:
+                data = base_file.read()
+        except IOError as ex:
+            log.error(f"{path}: unable to open base manifest config: {ex}")
+            return None
+
+        file_key = (os.path.abspath(path), hashlib.sha256(data).digest())
+        entry = self.files.get(file_key)
+        if entry is None:
+            file_log = Log(out=io.StringIO())
+            manifest_dict = parse_json_config(data, path, file_log)
+            if manifest_dict is not None:
+                manifest_dict = coerce_to_dict(manifest_dict, path, file_log)
+            entry = (manifest_dict, file_log.messages)
+            self.files[file_key] = entry
+
+        for msg in entry[1]:
+            log.error(msg)
+        if entry[0] is None:
+            return None
+        return file_key[1], entry[0]
+
+    def resolve_base(self, path, log, overlays=()):
+        """Returns the ResolvedManifest of the base manifest config at path,
+        or None if it or one of its bases is invalid. overlays are the
+        absolute paths of the manifest configs extending it.
+        """
+        if os.path.abspath(path) in overlays:
+            log.error(f"{path}: {BASE} manifest configs form a cycle")
+            return None
+
+        base = self.read_base(path, log)
+        if base is None:
+            return None
+        digest, manifest_dict = base
+
+        if BASE not in manifest_dict:
+            return ResolvedManifest(manifest_dict, (), (digest,))
+
+        next_path = base_path(path, manifest_dict, log)
+        if next_path is None:
+            return None
+        resolved_next = self.resolve_base(next_path, log,
+                                          overlays + (os.path.abspath(path),))
+        if resolved_next is None:
+            return None
+
+        key = (digest,) + resolved_next.key
+        resolved = self.resolved.get(key)
+        if resolved is None:
+            resolved = ResolvedManifest(
+                merge_manifest(resolved_next.manifest_dict, manifest_dict),
+                (next_path,) + resolved_next.bases, key)
+            self.resolved[key] = resolved
+        return resolved
+
+    def resolve(self, path, manifest_dict, log):
+        """Merges the manifest config read from path into its bases.
+
+        :returns: tuple of the merged manifest config and the paths of its
+                  bases, or None if a base is invalid
+        """
+        if BASE not in manifest_dict:
+            return manifest_dict, ()
+
+        next_path = base_path(path, manifest_dict, log)
+        if next_path is None:
+            return None
+        base = self.resolve_base(next_path, log, (os.path.abspath(path),))
+        if base is None:
+            return None
+        return (merge_manifest(base.manifest_dict, manifest_dict),
+                (next_path,) + base.bases)
+
+
+def manifest_bases(path):
+    """Returns the paths of the bases of the manifest config at path, for
+    keys of cached outputs.
+
+    :raises IOError: if a manifest config cannot be read
+    :raises ValueError: if a manifest config is invalid
+    """
+    bases = []
+    seen = {os.path.abspath(path)}
+    while True:
+        with open(path, "rb") as manifest_file:
+            data = manifest_file.read()
+        if BASE.encode() not in data:
+            return bases
+        manifest_dict = parse_json_config(data, path, Log(out=io.StringIO()))
+        if not isinstance(manifest_dict, dict):
+            raise ValueError(f"{path}: invalid manifest config")
+        log = Log(out=io.StringIO())
+        path = base_path(path, manifest_dict, log)
+        if log.error_occurred():
+            raise ValueError(log.messages[0])
+        if path is None:
+            return bases
+        if os.path.abspath(path) in seen:
+            raise ValueError(f"{path}: {BASE} manifest configs form a cycle")
+        seen.add(os.path.abspath(path))
+        bases.append(path)
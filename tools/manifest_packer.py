@@ -0,0 +1,159 @@
+"""Packing of parsed manifests into the binary format read by
+lib/app_manifest, for manifest_compiler.py. The entries of the tagged fields
+are packed as described by manifest_schema.FIELDS.
+
+pack_manifest_data() returns the packed manifest as bytes.
+pack_manifest_into() writes it into a caller-provided writable buffer
+instead, e.g. a bytearray or an mmap, sized with packed_size(), so that many
+manifests can be packed back to back into one buffer.
+"""
+
+import struct
+
+from manifest_defs import (
+    APPLOADER_FLAG_SET, MGMT_FLAG_SET, START_PORT_FLAG_SET, swap_uuid_bytes
+)
+from manifest_outputs import write_file_if_changed
+from manifest_schema import FIELDS, UINT32, encode_mem_map
+
+UUID_SIZE = 16
+UUID_CODEC = struct.Struct(f"{UUID_SIZE}s")
+
+# structs of inline strings by their padded size
+INLINE_STRING_CODECS = {}
+
+
+def pack_mem_map_arch_mmu_flags(mem_map):
+    return encode_mem_map(mem_map)[-1]
+
+
+def pack_mgmt_flags(mgmt_flags):
+    return MGMT_FLAG_SET.pack(mgmt_flags)
+
+
+def pack_apploader_flags(apploader_flags):
+    return APPLOADER_FLAG_SET.pack(apploader_flags)
+
+
+def pack_start_port_flags(flags):
+    return START_PORT_FLAG_SET.pack(flags)
+
+
+def pack_inline_string(value):
+    """Pack a given string with null padding to make its size
+    multiple of 4.
+    packed data includes length + string + null + padding
+    """
+    encoded = value.encode()
+    size = len(encoded) + 1
+    pad_len = 3 - (size + 3) % 4
+    packed = UINT32.pack(size) + encoded + b"\0" + pad_len * b"\0"
+    assert len(packed) % 4 == 0
+    return packed
+
+
+def inline_string_size(value):
+    """Returns the size of the packed inline string of value"""
+    return UINT32.size + (len(value.encode()) + 4) // 4 * 4
+
+
+def inline_string_codec(padded_size):
+    """Returns the struct packing the size and the padded string of inline
+    strings of padded_size bytes
+    """
+    codec = INLINE_STRING_CODECS.get(padded_size)
+    if codec is None:
+        # the "s" format pads the string with the null terminator and padding
+        codec = struct.Struct(f"<I{padded_size}s")
+        INLINE_STRING_CODECS[padded_size] = codec
+    return codec
+
+
+def pack_inline_string_into(buffer, offset, value):
+    """Writes the packed inline string of value into buffer at offset.
+
+    :returns: the offset following the string
+    """
+    encoded = value.encode()
+    codec = inline_string_codec((len(encoded) + 4) // 4 * 4)
+    codec.pack_into(buffer, offset, len(encoded) + 1, encoded)
+    return offset + codec.size
+
+
+def pack_manifest_data(manifest):
+    """Creates Packed data from extracted manifest data.
+    Writes the packed data to binary file
+    """
+    # PACK {
+    #        uuid, app_name_size, app_name,
+    #        for each field of FIELDS with a value:
+    #            tag, values of the field layout[, inline string]
+    #      }
+    out = [swap_uuid_bytes(manifest.uuid),
+           pack_inline_string(manifest.app_name)]
+
+    for field in FIELDS:
+        value = getattr(manifest, field.attribute)
+        if value is None:
+            continue
+        # locals for the loop over the items of repeated fields
+        pack, tag, encode, string = (field.codec.pack, field.tag,
+                                     field.encode, field.string)
+        for item in value if field.repeated else (value,):
+            out.append(pack(tag, *encode(item)))
+            if string:
+                out.append(pack_inline_string(string(item)))
+
+    return b"".join(out)
+
+
+def packed_size(manifest):
+    """Returns the size of the packed data of a manifest"""
+    size = UUID_SIZE + inline_string_size(manifest.app_name)
+    for field in FIELDS:
+        value = getattr(manifest, field.attribute)
+        if value is None:
+            continue
+        items = value if field.repeated else (value,)
+        size += field.codec.size * len(items)
+        if field.string:
+            for item in items:
+                size += inline_string_size(field.string(item))
+    return size
+
+
+def pack_manifest_into(buffer, offset, manifest):
+    """Writes the packed data of a manifest into a writable buffer, e.g. a
+    bytearray or an mmap, at offset. The packed data takes
+    packed_size(manifest) bytes.
+
+    :returns: the offset following the packed data
+    :raises struct.error: if the packed data does not fit into buffer
+    """
+    UUID_CODEC.pack_into(buffer, offset, swap_uuid_bytes(manifest.uuid))
+    offset = pack_inline_string_into(buffer, offset + UUID_SIZE,
+                                     manifest.app_name)
+
+    for field in FIELDS:
+        value = getattr(manifest, field.attribute)
+        if value is None:
+            continue
+        # locals for the loop over the items of repeated fields
+        pack_into, tag, encode, string, size = (
+            field.codec.pack_into, field.tag, field.encode, field.string,
+            field.codec.size)
+        for item in value if field.repeated else (value,):
+            pack_into(buffer, offset, tag, *encode(item))
+            offset += size
+            if string:
+                offset = pack_inline_string_into(buffer, offset, string(item))
+
+    return offset
+
+
+def write_packed_data_to_bin_file(packed_data, output_file, log):
+    """Write packed data to binary file, unless it already holds packed_data"""
+    try:
+        write_file_if_changed(output_file, packed_data)
+    except IOError as ex:
+        log.error(f"Unable to write to output file: {output_file}\n" + str(ex))
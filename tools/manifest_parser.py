@@ -0,0 +1,570 @@
+"""Parsing and validation of manifest and constants config JSON files for
+manifest_compiler.py. Whole manifests are parsed by manifest_schema, field by
+field with the functions of this module.
+"""
+
+import json
+
+from manifest_defs import (
+    APPLOADER_FLAG_SET, CONSTANTS, CONST_BOOL, CONST_INT, CONST_NAME,
+    CONST_PORT, CONST_TYPE, CONST_UNSIGNED, CONST_UUID, CONST_VALUE,
+    ConfigConstants, Constant, HEADER, IPC_PORT_PATH_MAX, MEM_MAP_ADDR,
+    MEM_MAP_COUNT, MEM_MAP_ID, MEM_MAP_NON_SECURE, MEM_MAP_SIZE,
+    MEM_MAP_STRIDE, MEM_MAP_TYPE,
+    MEM_MAP_TYPE_CACHED, MEM_MAP_TYPE_UNCACHED, MEM_MAP_TYPE_UNCACHED_DEVICE,
+    MGMT_FLAG_SET, MIN_SHADOW_STACK, MemIOMap, START_PORT_FLAGS,
+    START_PORT_FLAG_SET, START_PORT_NAME, StartPort, UUID
+)
+
+# Attributes of the JSON objects of manifest and constants configs
+MEM_MAP_KEYS = frozenset((MEM_MAP_ID, MEM_MAP_ADDR, MEM_MAP_SIZE, MEM_MAP_TYPE,
+                          MEM_MAP_NON_SECURE, MEM_MAP_COUNT, MEM_MAP_STRIDE))
+START_PORT_KEYS = frozenset((START_PORT_NAME, START_PORT_FLAGS))
+CONSTANTS_CONFIG_KEYS = frozenset((HEADER, CONSTANTS))
+ALL_CONSTANT_KEYS = frozenset((CONST_TYPE, CONST_NAME, CONST_VALUE,
+                               CONST_UNSIGNED))
+# Attributes of each type of constant
+CONSTANT_KEYS = {
+    CONST_PORT: ALL_CONSTANT_KEYS - {CONST_UNSIGNED},
+    CONST_UUID: ALL_CONSTANT_KEYS - {CONST_UNSIGNED},
+    CONST_INT: ALL_CONSTANT_KEYS,
+    CONST_BOOL: ALL_CONSTANT_KEYS - {CONST_UNSIGNED},
+}
+
+# Largest count of a mem_map entry, and bounds of the packed ids and addresses
+MEM_MAP_MAX_COUNT = 4096
+MEM_MAP_ID_MAX = 0xffffffff
+MEM_MAP_ADDR_END = 1 << 64
+
+
+def get_string_sub_type(field):
+    """For the given manifest JSON field it returns its literal value type
+    mapped.
+    """
+    if field == UUID:
+        return CONST_UUID
+    if field == START_PORT_NAME:
+        return CONST_PORT
+    # field with string value but doesn't support a constant
+    return None
+
+
+def get_constant(constants, key, type_, log):
+    const = constants.get(key)
+    if const is None:
+        return None
+
+    if const.type != type_:
+        log.error(f"{key} constant type mismatch, expected type is {type_}")
+        return None
+
+    return const.value
+
+
+def unknown_attributes(dictionary, keys):
+    """Returns the entries of a JSON object whose keys are not in keys.
+
+    The getters below only read from the JSON objects they are given, so that
+    a parsed manifest config can be parsed again, e.g. once per variant of the
+    app. Attributes which are not read by any of them are found with this.
+    """
+    return {key: value for key, value in dictionary.items()
+            if key not in keys}
+
+
+def get_string(manifest_dict, key, constants, log, optional=False,
+               default=None):
+    """Determines whether the value for the given key in dictionary is of type
+    string and if it is a string then returns the value.
+    """
+    if key not in manifest_dict:
+        if not optional:
+            log.error(f"Manifest is missing required attribute - {key}")
+        return default
+
+    value = manifest_dict[key]
+
+    # try to check is this field holding a constant
+    type_ = get_string_sub_type(key)
+    if type_:
+        const_value = get_constant(constants, value, type_, log)
+        if const_value is not None:
+            return const_value
+
+    return coerce_to_string(value, key, log)
+
+
+def coerce_to_string(value, key, log):
+    if not isinstance(value, str):
+        log.error(
+            "Invalid value for" +
+            f" {key} - \"{value}\", Valid string value is expected")
+        return None
+
+    return value
+
+
+def get_int(manifest_dict, key, constants, log, optional=False,
+            default=None):
+    """Determines whether the value for the given key in dictionary is of type
+    integer and if it is int then returns the value
+    """
+    if key not in manifest_dict:
+        if not optional:
+            log.error(f"Manifest is missing required attribute - {key}")
+        return default
+
+    value = manifest_dict[key]
+    const_value = get_constant(constants, value, CONST_INT, log)
+    if const_value is not None:
+        return const_value
+
+    return coerce_to_int(value, key, log)
+
+
+def coerce_to_int(value, key, log):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value, 0)
+        except ValueError:
+            log.error(f"Invalid value for {key} - \"{value}\", " +
+                      "valid integer or hex string is expected")
+            return None
+    else:
+        log.error("Invalid value for" +
+                  f" {key} - \"{value}\", valid integer value is expected")
+        return None
+
+
+def get_list(manifest_dict, key, log, optional=False, default=None):
+    """Determines whether the value for the given key in dictionary is of type
+    List and if it is List then returns the value
+    """
+    if key not in manifest_dict:
+        if not optional:
+            log.error(f"Manifest is missing required attribute - {key}")
+        return default
+
+    return coerce_to_list(manifest_dict[key], key, log)
+
+
+def coerce_to_list(value, key, log):
+    if not isinstance(value, list):
+        log.error("Invalid value for" +
+                  f" {key} - \"{value}\", valid list is expected")
+        return None
+
+    return value
+
+
+def get_dict(manifest_dict, key, log, optional=False, default=None):
+    """Determines whether the value for the given key in dictionary is of type
+    Dictionary and if it is Dictionary then returns the value
+    """
+    if key not in manifest_dict:
+        if not optional:
+            log.error(f"Manifest is missing required attribute - {key}")
+        return default
+
+    return coerce_to_dict(manifest_dict[key], key, log)
+
+
+def coerce_to_dict(value, key, log):
+    if not isinstance(value, dict):
+        log.error("Invalid value for" +
+                  f" {key} - \"{value}\", valid dict is expected")
+        return None
+
+    return value
+
+
+def get_boolean(manifest_dict, key, constants, log, optional=False,
+                default=None):
+    """Determines whether the value for the given key in dictionary is of type
+    boolean and if it is boolean then returns the value
+    """
+    if key not in manifest_dict:
+        if not optional:
+            log.error(f"Manifest is missing required attribute - {key}")
+        return default
+
+    value = manifest_dict[key]
+    const_value = get_constant(constants, value, CONST_BOOL, log)
+    if const_value is not None:
+        return const_value
+
+    return coerce_to_boolean(value, key, log)
+
+
+def coerce_to_boolean(value, key, log):
+    if not isinstance(value, bool):
+        log.error(
+            "Invalid value for" +
+            f" {key} - \"{value}\", Valid boolean value is expected")
+        return None
+
+    return value
+
+
+def get_uuid(manifest_dict, key, constants, log, optional=False, default=None):
+    if key not in manifest_dict:
+        if not optional:
+            log.error(f"Manifest is missing required attribute - {key}")
+        return default
+
+    uuid = get_string(manifest_dict, key, {}, log, optional, default)
+    const_value = get_constant(constants, uuid, CONST_UUID, log)
+    if const_value is not None:
+        return const_value
+
+    return parse_uuid(uuid, log)
+
+
+def get_port(port, key, constants, log, optional=False, default=None):
+    return get_string(port, key, constants, log, optional, default)
+
+
+def parse_uuid(uuid, log):
+    """Validate and arrange UUID byte order. If it is valid UUID then return 16
+    byte UUID
+    """
+    if uuid is None:
+        return None
+
+    # Example UUID: "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf"
+    if len(uuid) != 36:
+        log.error(f"Invalid UUID {uuid}. UUID should be 16 bytes long")
+        return None
+
+    uuid_data = uuid.split("-")
+    if len(uuid_data) != 5:
+        log.error(
+            f"Invalid UUID {uuid}. UUID should be 16 hexadecimal numbers"
+            " divided into 5 groups by hyphens (-)"
+        )
+        return None
+
+    try:
+        uuid_data = [bytearray.fromhex(part) for part in uuid_data]
+    except ValueError:
+        log.error(
+            f"Invalid UUID {uuid}. UUID should only contain hexadecimal"
+            " numbers (separated by hyphens)"
+        )
+        return None
+
+    if len(uuid_data[0]) != 4 or \
+            len(uuid_data[1]) != 2 or \
+            len(uuid_data[2]) != 2 or \
+            len(uuid_data[3]) != 2 or \
+            len(uuid_data[4]) != 6:
+        log.error(f"Wrong grouping of UUID {uuid}")
+        return None
+
+    return b"".join(uuid_data)
+
+
+def parse_memory_size(memory_size, memory_kind, log, zero_is_ok=True):
+    """Validate memory size value. If valid, return memory size value else
+    return None
+    """
+    if memory_size is None:
+        return None
+
+    if memory_size == 0 and not zero_is_ok:
+        log.error(f"{memory_kind}: Minimum memory size cannot be zero.")
+        return None
+    if memory_size < 0 or memory_size % 4096 != 0:
+        log.error(f"{memory_kind}: {memory_size}, Minimum memory size should " +
+                  "be a non-negative multiple of 4096")
+        return None
+
+    return memory_size
+
+
+def parse_shadow_stack_size(stack_size, log):
+    """Validate the shadow stack size
+
+    :returns: validated shadow stack size or None
+    """
+    if stack_size is None:
+        return None
+
+    # shadow call stack is only supported on arm64 where pointers are 8 bytes
+    ptr_size = 8
+    if stack_size < 0 or stack_size % ptr_size != 0:
+        log.error(f"{MIN_SHADOW_STACK}: {stack_size}, Minimum shadow stack " +
+                  "size should be a non-negative multiple of the native " +
+                  "pointer size")
+        return None
+
+    return stack_size
+
+
+def parse_mem_map_type(mem_map_type, log):
+    if mem_map_type not in {MEM_MAP_TYPE_CACHED,
+                            MEM_MAP_TYPE_UNCACHED,
+                            MEM_MAP_TYPE_UNCACHED_DEVICE}:
+        log.error(f"Unknown mem_map.type entry in manifest: {mem_map_type}")
+
+    return mem_map_type
+
+
+def parse_mem_map(mem_maps, key, constants, log):
+    if mem_maps is None:
+        return None
+
+    mem_io_maps = []
+    for mem_map_entry in mem_maps:
+        mem_map_entry = coerce_to_dict(mem_map_entry, key, log)
+        if mem_map_entry is None:
+            continue
+        mem_map = MemIOMap(
+            get_int(mem_map_entry, MEM_MAP_ID, constants, log),
+            get_int(mem_map_entry, MEM_MAP_ADDR, constants, log),
+            get_int(mem_map_entry, MEM_MAP_SIZE, constants, log),
+            parse_mem_map_type(
+                get_string(mem_map_entry, MEM_MAP_TYPE, constants, log,
+                           optional=True,
+                           default=MEM_MAP_TYPE_UNCACHED_DEVICE), log),
+            get_boolean(mem_map_entry, MEM_MAP_NON_SECURE, constants, log,
+                        optional=True)
+        )
+        unknown = unknown_attributes(mem_map_entry, MEM_MAP_KEYS)
+        if unknown:
+            log.error("Unknown attributes in mem_map entries in "
+                      f"manifest: {unknown}")
+        if MEM_MAP_COUNT in mem_map_entry:
+            mem_io_maps.extend(parse_mem_map_range(mem_map, mem_map_entry,
+                                                   constants, log))
+        else:
+            if MEM_MAP_STRIDE in mem_map_entry:
+                log.error(f"mem_map entries with a {MEM_MAP_STRIDE} " +
+                          f"require a {MEM_MAP_COUNT}")
+            mem_io_maps.append(mem_map)
+
+    return mem_io_maps
+
+
+def parse_mem_map_range(mem_map, mem_map_entry, constants, log):
+    """Expands a mem_map entry with a count into count MemIOMaps of the size
+    and type of mem_map, with consecutive ids starting at the id of mem_map
+    and addresses stride bytes apart, the size by default.
+    """
+    count = get_int(mem_map_entry, MEM_MAP_COUNT, constants, log)
+    stride = get_int(mem_map_entry, MEM_MAP_STRIDE, constants, log,
+                     optional=True, default=mem_map.size)
+    if count is not None and not 0 < count <= MEM_MAP_MAX_COUNT:
+        log.error(f"Invalid value for {MEM_MAP_COUNT} - \"{count}\", " +
+                  f"integer from 1 to {MEM_MAP_MAX_COUNT} is expected")
+        return []
+    if stride is not None and stride < 0:
+        log.error(f"Invalid value for {MEM_MAP_STRIDE} - \"{stride}\", " +
+                  "non-negative integer is expected")
+        return []
+    if None in (count, stride, mem_map.id, mem_map.addr):
+        return []
+
+    id_, addr, size = mem_map.id, mem_map.addr, mem_map.size
+    type_, non_secure = mem_map.type, mem_map.non_secure
+    if id_ + count - 1 > MEM_MAP_ID_MAX:
+        log.error(f"mem_map entry with {MEM_MAP_ID} {id_} and " +
+                  f"{MEM_MAP_COUNT} {count} has ids above {MEM_MAP_ID_MAX}")
+        return []
+    if addr + (count - 1) * stride + (size or 0) > MEM_MAP_ADDR_END:
+        log.error(f"mem_map entry with {MEM_MAP_ADDR} {hex(addr)} and " +
+                  f"{MEM_MAP_COUNT} {count} ends beyond the 64-bit " +
+                  "address space")
+        return []
+    return [MemIOMap(id_ + index, addr + index * stride, size, type_,
+                     non_secure)
+            for index in range(count)]
+
+
+def parse_flag_values(flags, flag_set, constants, log, optional=True):
+    """Reads the attributes of flag_set from the flags dictionary.
+
+    :returns: a flag_set.record holding their values
+    """
+    return flag_set.record(*(
+        get_boolean(flags, key, constants, log, optional=optional)
+        for key, _ in flag_set.flags))
+
+
+def parse_flags(flags, flag_set, constants, log):
+    if flags is None:
+        return None
+
+    record = parse_flag_values(flags, flag_set, constants, log)
+
+    unknown = unknown_attributes(flags, flag_set.keys())
+    if unknown:
+        log.error(f"Unknown attributes in {flag_set.name} entries in " +
+                  f"manifest: {unknown}")
+
+    return record
+
+
+def parse_mgmt_flags(flags, constants, log):
+    return parse_flags(flags, MGMT_FLAG_SET, constants, log)
+
+
+def parse_apploader_flags(flags, constants, log):
+    return parse_flags(flags, APPLOADER_FLAG_SET, constants, log)
+
+
+def parse_app_start_ports(start_port_list, key, constants, log):
+    start_ports = []
+
+    for port_entry in start_port_list:
+        port_entry = coerce_to_dict(port_entry, key, log)
+        if port_entry is None:
+            continue
+
+        name = get_port(port_entry, START_PORT_NAME, constants, log)
+        if len(name) >= IPC_PORT_PATH_MAX:
+            log.error("Length of start port name should be less than " +
+                      str(IPC_PORT_PATH_MAX))
+
+        flags = get_dict(port_entry, START_PORT_FLAGS, log)
+        start_ports_flag = None
+        unknown_flags = None
+        if flags:
+            start_ports_flag = parse_flag_values(flags, START_PORT_FLAG_SET,
+                                                 constants, log,
+                                                 optional=False)
+            unknown_flags = unknown_attributes(flags,
+                                               START_PORT_FLAG_SET.keys())
+
+        unknown = unknown_attributes(port_entry, START_PORT_KEYS)
+        if unknown:
+            log.error("Unknown attributes in start_ports entries" +
+                      f" in manifest: {unknown}")
+        if unknown_flags:
+            log.error(f"Unknown attributes in {START_PORT_FLAG_SET.name} " +
+                      f"entries in manifest: {unknown_flags}")
+
+        start_ports.append(StartPort(name, len(name), start_ports_flag))
+
+    return start_ports
+
+
+def parse_app_name(app_name, log):
+    if app_name is None:
+        return None
+
+    if not app_name:
+        log.error("empty app-name is not allowed in manifest")
+        return None
+
+    return app_name.strip()
+
+
+def read_json_config_file(input_file, log):
+    try:
+        with open(input_file, "rb") as read_file:
+            data = read_file.read()
+    except IOError as ex:
+        log.error(f"{input_file}: unable to open input file: {ex}")
+        return None
+    return parse_json_config(data, input_file, log)
+
+
+def parse_json_config(data, input_file, log):
+    """Parses the UTF-8 encoded content of the JSON config file input_file"""
+    try:
+        return json.loads(data.decode("utf-8"))
+    except json.JSONDecodeError as jde:
+        location = f"{input_file}:{jde.lineno}:{jde.colno}"
+        log.error(f"{location}: Unable to parse config JSON: {jde.msg}")
+        return None
+    except ValueError as ex:
+        log.error(f"{input_file}: Unexpected error: {ex}")
+        return None
+
+
+def read_config_constants(const_config_files, log):
+    const_configs_list = []
+    for const_file in const_config_files:
+        const_configs_list.append(read_json_config_file(const_file, log))
+
+    return const_configs_list
+
+
+def parse_constant(constant, log, source=None):
+    """Parse a give JSON constant data structure. source is the path of the
+    constants config file.
+    """
+    const_type = get_string(constant, CONST_TYPE, {}, log)
+    if const_type is None:
+        return None
+
+    name = get_string(constant, CONST_NAME, {}, log)
+    if const_type == CONST_PORT:
+        value = get_string(constant, CONST_VALUE, {}, log)
+        return Constant(name, value, const_type, source=source)
+    if const_type == CONST_UUID:
+        value = get_string(constant, CONST_VALUE, {}, log)
+        return Constant(name, parse_uuid(value, log), const_type,
+                        source=source)
+    if const_type == CONST_INT:
+        unsigned = get_boolean(constant, CONST_UNSIGNED, {}, log)
+        text_value = constant.get(CONST_VALUE)
+        hex_num = isinstance(text_value, str) and text_value.startswith("0x")
+        value = get_int(constant, CONST_VALUE, {}, log)
+        return Constant(name, value, const_type, unsigned, hex_num,
+                        source)
+    if const_type == CONST_BOOL:
+        value = get_boolean(constant, CONST_VALUE, {}, log)
+        return Constant(name, value, const_type, source=source)
+
+    log.error(f"Unknown constant type: {const_type}")
+    return None
+
+
+def parse_config_constant(const_config, log, source=None):
+    """Parse a given JSON constant-config data structure containing a header and
+    list of constants. source is the path of the constants config file.
+    """
+    header_file = get_string(const_config, HEADER, {}, log)
+
+    const_list = get_list(const_config, CONSTANTS, log, optional=False,
+                          default=[])
+
+    constants = []
+    for item in const_list:
+        item = coerce_to_dict(item, CONSTANTS, log)
+        if item is None:
+            continue
+        constants.append(parse_constant(item, log, source))
+        unknown = unknown_attributes(
+            item, CONSTANT_KEYS.get(item.get(CONST_TYPE), ALL_CONSTANT_KEYS))
+        if unknown:
+            log.error(f"Unknown attributes in constant: {unknown}")
+
+    unknown = unknown_attributes(const_config, CONSTANTS_CONFIG_KEYS)
+    if unknown:
+        log.error(f"Unknown attributes in constants config: {unknown}")
+
+    return ConfigConstants(constants, header_file)
+
+
+def extract_config_constants(config_consts_list, log):
+    """Collects ConfigConstant(s) from list of JSON config constants data"""
+    config_constants = []
+
+    for config_const in config_consts_list:
+        config_constants.append(parse_config_constant(config_const, log))
+
+    return config_constants
+
+
+def index_constants(config_constants):
+    constants = {}
+    for const_config in config_constants:
+        for const in const_config.constants:
+            constants[const.name] = const
+
+    return constants
@@ -0,0 +1,227 @@
+"""Registry of the tagged fields of binary manifests, for manifest_compiler.py.
+
+Every TRUSTY_APP_CONFIG_KEY_* tag is described once by a Field in FIELDS: its
+manifest JSON key, how it is parsed, the struct layout of its entry and how
+parsed values map to and from the packed values. The parser, the packer and
+the unpacker all loop over FIELDS, so a new tag only needs a new Field.
+
+A packed manifest is the UUID and the inline app name followed by one entry
+per value of each field in the order of FIELDS. An entry is the tag and the
+values of the field's layout, all little-endian, optionally followed by an
+inline string.
+"""
+
+import struct
+
+from manifest_defs import (
+    APPLOADER_FLAG_SET, APP_NAME, ARCH_MMU_FLAG_CACHED,
+    ARCH_MMU_FLAG_CACHE_MASK, ARCH_MMU_FLAG_NS, ARCH_MMU_FLAG_UNCACHED,
+    ARCH_MMU_FLAG_UNCACHED_DEVICE, MEM_MAP, MEM_MAP_ADDR, MEM_MAP_ID,
+    MEM_MAP_NON_SECURE, MEM_MAP_SIZE, MEM_MAP_TYPE, MEM_MAP_TYPE_CACHED,
+    MEM_MAP_TYPE_UNCACHED, MEM_MAP_TYPE_UNCACHED_DEVICE, MGMT_FLAG_SET,
+    MIN_HEAP, MIN_SHADOW_STACK, MIN_STACK, Manifest, PINNED_CPU, PRIORITY,
+    START_PORTS, START_PORT_FLAGS, START_PORT_FLAG_SET, START_PORT_NAME,
+    TRUSTY_APP_CONFIG_KEY_APPLOADER_FLAGS, TRUSTY_APP_CONFIG_KEY_MAP_MEM,
+    TRUSTY_APP_CONFIG_KEY_MGMT_FLAGS, TRUSTY_APP_CONFIG_KEY_MIN_HEAP_SIZE,
+    TRUSTY_APP_CONFIG_KEY_MIN_SHADOW_STACK_SIZE,
+    TRUSTY_APP_CONFIG_KEY_MIN_STACK_SIZE, TRUSTY_APP_CONFIG_KEY_PINNED_CPU,
+    TRUSTY_APP_CONFIG_KEY_PRIORITY, TRUSTY_APP_CONFIG_KEY_START_PORT,
+    TRUSTY_APP_CONFIG_KEY_VERSION, UUID, VERSION
+)
+from manifest_parser import (
+    get_dict, get_int, get_list, get_string, get_uuid, parse_app_name,
+    parse_app_start_ports, parse_flags, parse_mem_map, parse_memory_size,
+    parse_shadow_stack_size, unknown_attributes
+)
+
+# Tags and the sizes of inline strings
+UINT32 = struct.Struct("<I")
+
+
+class ManifestDecodeError(ValueError):
+    """A binary manifest is truncated or malformed"""
+
+
+# arch_mmu_flags of each mem_map type
+MEM_MAP_TYPE_MMU_FLAGS = {
+    MEM_MAP_TYPE_CACHED: ARCH_MMU_FLAG_CACHED,
+    MEM_MAP_TYPE_UNCACHED: ARCH_MMU_FLAG_UNCACHED,
+    MEM_MAP_TYPE_UNCACHED_DEVICE: ARCH_MMU_FLAG_UNCACHED_DEVICE,
+}
+MMU_FLAGS_MEM_MAP_TYPE = {
+    mmu_flags: type_ for type_, mmu_flags in MEM_MAP_TYPE_MMU_FLAGS.items()
+}
+
+
+class Field(object):
+    """A tagged entry of binary manifests.
+
+    tag: TRUSTY_APP_CONFIG_KEY_* value of the entry
+    key: key of the field in manifest JSON, and in unpacked manifests
+    attribute: Manifest attribute holding the parsed value
+    layout: struct format of the values following the tag
+    columns: names of the values of the layout, one per format character
+    parse: function(manifest_dict, constants, log) reading the field from the
+           manifest JSON and returning its parsed value, or None if absent
+    encode: function returning the tuple of values to pack for a parsed value
+    decode: function(values, string) returning the unpacked JSON value of an
+            entry, string is its inline string or None. Raises
+            ManifestDecodeError for values that cannot be unpacked.
+    repeated: whether the parsed value is a list with one entry per item
+    string: function returning the inline string following the entry of a
+            parsed value, None if entries have no inline string
+    """
+
+    def __init__(self, tag, key, layout, parse, encode, decode,
+                 attribute=None, repeated=False, string=None, columns=None):
+        self.tag = tag
+        self.key = key
+        self.attribute = attribute or key
+        self.layout = layout
+        self.columns = columns or (key,)
+        assert len(self.columns) == len(layout)
+        self.parse = parse
+        self.encode = encode
+        self.decode = decode
+        self.repeated = repeated
+        self.string = string
+        # the tag and the values of the entry
+        self.codec = struct.Struct("<I" + layout)
+
+
+def optional_int(key):
+    def parse(manifest_dict, constants, log):
+        return get_int(manifest_dict, key, constants, log, optional=True)
+    return parse
+
+
+def int_field(tag, key, parse=None):
+    return Field(tag, key, "I", parse or optional_int(key),
+                 encode=lambda value: (value,),
+                 decode=lambda values, _: values[0])
+
+
+def flags_field(tag, flag_set):
+    def parse(manifest_dict, constants, log):
+        return parse_flags(
+            get_dict(manifest_dict, flag_set.name, log, optional=True,
+                     default=flag_set.defaults()),
+            flag_set, constants, log)
+    return Field(tag, flag_set.name, "I", parse,
+                 encode=lambda value: (flag_set.pack(value),),
+                 decode=lambda values, _: flag_set.unpack(values[0]))
+
+
+def parse_min_heap(manifest_dict, constants, log):
+    return parse_memory_size(get_int(manifest_dict, MIN_HEAP, constants, log),
+                             MIN_HEAP, log)
+
+
+def parse_min_stack(manifest_dict, constants, log):
+    return parse_memory_size(get_int(manifest_dict, MIN_STACK, constants, log),
+                             MIN_STACK, log, False)
+
+
+def parse_min_shadow_stack(manifest_dict, constants, log):
+    return parse_shadow_stack_size(get_int(manifest_dict, MIN_SHADOW_STACK,
+                                           constants, log, optional=True), log)
+
+
+def parse_mem_map_field(manifest_dict, constants, log):
+    return parse_mem_map(
+        get_list(manifest_dict, MEM_MAP, log, optional=True, default=[]),
+        MEM_MAP, constants, log)
+
+
+def encode_mem_map(mem_map):
+    arch_mmu_flags = MEM_MAP_TYPE_MMU_FLAGS.get(mem_map.type,
+                                                ARCH_MMU_FLAG_CACHED)
+    if mem_map.non_secure:
+        arch_mmu_flags |= ARCH_MMU_FLAG_NS
+    return (mem_map.id, mem_map.addr, mem_map.size, arch_mmu_flags)
+
+
+def decode_mem_map(values, _):
+    id_, addr, size, arch_mmu_flags = values
+    type_ = MMU_FLAGS_MEM_MAP_TYPE.get(arch_mmu_flags &
+                                       ARCH_MMU_FLAG_CACHE_MASK)
+    if type_ is None:
+        raise ManifestDecodeError(
+            f"unknown cache type in arch_mmu_flags {arch_mmu_flags:#x}")
+    return {
+        MEM_MAP_ID: id_,
+        MEM_MAP_ADDR: hex(addr),
+        MEM_MAP_SIZE: hex(size),
+        MEM_MAP_TYPE: type_,
+        MEM_MAP_NON_SECURE: bool(arch_mmu_flags & ARCH_MMU_FLAG_NS),
+    }
+
+
+def parse_start_ports_field(manifest_dict, constants, log):
+    return parse_app_start_ports(
+        get_list(manifest_dict, START_PORTS, log, optional=True, default=[]),
+        START_PORTS, constants, log)
+
+
+def decode_start_port(values, name):
+    return {
+        START_PORT_NAME: name,
+        START_PORT_FLAGS: START_PORT_FLAG_SET.unpack(values[0]),
+    }
+
+
+# The tagged fields in the order of their entries in packed manifests
+FIELDS = (
+    int_field(TRUSTY_APP_CONFIG_KEY_MIN_HEAP_SIZE, MIN_HEAP, parse_min_heap),
+    int_field(TRUSTY_APP_CONFIG_KEY_MIN_STACK_SIZE, MIN_STACK,
+              parse_min_stack),
+    Field(TRUSTY_APP_CONFIG_KEY_MAP_MEM, MEM_MAP, "IQQI", parse_mem_map_field,
+          encode_mem_map, decode_mem_map, attribute="mem_io_maps",
+          repeated=True,
+          columns=(MEM_MAP_ID, MEM_MAP_ADDR, MEM_MAP_SIZE, "arch_mmu_flags")),
+    flags_field(TRUSTY_APP_CONFIG_KEY_MGMT_FLAGS, MGMT_FLAG_SET),
+    Field(TRUSTY_APP_CONFIG_KEY_START_PORT, START_PORTS, "I",
+          parse_start_ports_field,
+          lambda port: (START_PORT_FLAG_SET.pack(port.start_port_flags),),
+          decode_start_port, repeated=True, string=lambda port: port.name,
+          columns=(START_PORT_FLAGS,)),
+    int_field(TRUSTY_APP_CONFIG_KEY_PINNED_CPU, PINNED_CPU),
+    int_field(TRUSTY_APP_CONFIG_KEY_PRIORITY, PRIORITY),
+    int_field(TRUSTY_APP_CONFIG_KEY_VERSION, VERSION),
+    int_field(TRUSTY_APP_CONFIG_KEY_MIN_SHADOW_STACK_SIZE, MIN_SHADOW_STACK,
+              parse_min_shadow_stack),
+    flags_field(TRUSTY_APP_CONFIG_KEY_APPLOADER_FLAGS, APPLOADER_FLAG_SET),
+)
+
+FIELDS_BY_TAG = {field.tag: field for field in FIELDS}
+FIELDS_BY_KEY = {field.key: field for field in FIELDS}
+
+assert len(FIELDS_BY_TAG) == len(FIELDS), "duplicate tag in FIELDS"
+
+# Attributes of manifest configs
+MANIFEST_KEYS = frozenset((UUID, APP_NAME) + tuple(FIELDS_BY_KEY))
+
+
+def parse_manifest_config(manifest_dict, constants, default_app_name, log):
+    """validate the manifest config and extract key, values. manifest_dict is
+    left as it is, so it can be parsed again with other defaults.
+    """
+    uuid = get_uuid(manifest_dict, UUID, constants, log)
+
+    app_name = parse_app_name(
+        get_string(manifest_dict, APP_NAME, constants, log,
+                   optional=True, default=default_app_name), log)
+
+    values = {}
+    for field in FIELDS:
+        values[field.attribute] = field.parse(manifest_dict, constants, log)
+
+    # look for any extra attributes
+    unknown = unknown_attributes(manifest_dict, MANIFEST_KEYS)
+    if unknown:
+        log.error(f"Unknown attributes in manifest: {unknown} ")
+
+    if log.error_occurred():
+        return None
+
+    return Manifest(uuid=uuid, app_name=app_name, **values)
@@ -0,0 +1,447 @@
+"""Unpacking of binary manifests into JSON-like data, the inverse of
+manifest_packer.
+
+The decoder walks a memoryview of the packed manifest with an offset cursor
+and reads every entry in place with struct.unpack_from, so the manifest is
+never copied. Every read is bounds-checked, and truncated or malformed
+manifests raise ManifestDecodeError naming the offset and tag of the entry.
+ManifestStreamDecoder decodes manifests which arrive in chunks, e.g. from a
+pipe, buffering only the last partial record. ManifestView only decodes the
+fields which are actually accessed.
+"""
+
+import json
+
+from manifest_defs import APP_NAME, UUID, format_uuid, swap_uuid_bytes
+from manifest_schema import (
+    FIELDS_BY_KEY, FIELDS_BY_TAG, UINT32, ManifestDecodeError
+)
+
+UUID_SIZE = 16
+
+# Largest inline string size accepted by ManifestStreamDecoder, which buffers
+# a whole record before decoding it
+STRING_MAX_SIZE = 0x10000
+
+
+def unpack_binary_manifest_to_json(packed_data):
+    """Creates manifest JSON string from packed manifest data"""
+    return manifest_data_to_json(unpack_binary_manifest_to_data(packed_data))
+
+
+def manifest_data_to_json(manifest):
+    return json.dumps(manifest, sort_keys=True, indent=4)
+
+
+def describe_field(field):
+    return f"tag {field.tag} ({field.key})"
+
+
+def truncated(offset, what):
+    return ManifestDecodeError(f"truncated at offset {offset} in {what}")
+
+
+def padded_size(size):
+    """Returns the size of an inline string of the given size with padding"""
+    return (size + 3) // 4 * 4
+
+
+def byte_view(packed_data):
+    """Returns a memoryview of the bytes of a bytes-like object"""
+    return memoryview(packed_data).cast("B")
+
+
+def read_inline_string(data, offset, what, base=0):
+    """Bounds-checks a string packed by manifest_packer.pack_inline_string.
+    data starts at offset base of the manifest, for error messages.
+
+    :returns: tuple of the offset and the size of the string without its null
+              terminator, and the offset following its padding
+    """
+    if offset + UINT32.size > len(data):
+        raise truncated(base + offset, what)
+    (size,) = UINT32.unpack_from(data, offset)
+    if size == 0:
+        raise ManifestDecodeError(
+            f"invalid string size 0 at offset {base + offset} in {what}")
+
+    string_offset = offset + UINT32.size
+    # the size includes the null terminator, the padding aligns to 4 bytes
+    end = string_offset + padded_size(size)
+    if end > len(data):
+        raise truncated(base + offset, what)
+    if data[string_offset + size - 1] != 0:
+        raise ManifestDecodeError(f"string at offset {base + offset} in "
+                                  f"{what} is not null-terminated")
+    return string_offset, size - 1, end
+
+
+def decode_string(data, offset, size, error_offset, what):
+    try:
+        return bytes(data[offset:offset + size]).decode()
+    except UnicodeDecodeError:
+        raise ManifestDecodeError(
+            f"invalid UTF-8 string at offset {error_offset} in {what}"
+        ) from None
+
+
+class ManifestRecord(object):
+    """A tagged entry of a binary manifest, size bytes long including its
+    inline string and starting at offset with the tag. values are the unpacked
+    values of the layout of its field. The inline string is only decoded when
+    string is first accessed.
+    """
+
+    def __init__(self, field, offset, size, values, data=None,
+                 string_offset=None, string_size=0):
+        self.field = field
+        self.offset = offset
+        self.size = size
+        self.values = values
+        self.data = data
+        self.string_offset = string_offset
+        self.string_size = string_size
+        self.decoded_string = None
+
+    @property
+    def tag(self):
+        return self.field.tag
+
+    @property
+    def string(self):
+        if self.decoded_string is None and self.string_offset is not None:
+            self.decoded_string = decode_string(self.data, self.string_offset,
+                                                self.string_size, self.offset,
+                                                describe_field(self.field))
+        return self.decoded_string
+
+    def value(self):
+        """Returns the JSON value of the entry"""
+        string = self.string
+        try:
+            return self.field.decode(self.values, string)
+        except ManifestDecodeError as ex:
+            raise ManifestDecodeError(
+                f"{ex} at offset {self.offset} in "
+                f"{describe_field(self.field)}") from None
+
+
+def decode_uuid(data, offset):
+    return format_uuid(
+        swap_uuid_bytes(bytes(data[offset:offset + UUID_SIZE])))
+
+
+def decode_app_name(data, offset, base=0):
+    """Decodes the app name at offset.
+
+    :returns: tuple of the app name and the offset following it
+    """
+    name_offset, name_size, end = read_inline_string(data, offset, APP_NAME,
+                                                     base)
+    return decode_string(data, name_offset, name_size, base + offset,
+                         APP_NAME), end
+
+
+def decode_manifest_header(data):
+    """Decodes the UUID and app name at the start of a binary manifest.
+
+    :returns: tuple of the UUID, the app name and the offset of the first
+              tagged entry
+    """
+    if len(data) < UUID_SIZE:
+        raise truncated(0, UUID)
+    app_name, offset = decode_app_name(data, UUID_SIZE)
+    return decode_uuid(data, 0), app_name, offset
+
+
+def decode_record(data, offset, base=0):
+    """Decodes the tagged entry at offset. data starts at offset base of the
+    manifest.
+    """
+    if offset + UINT32.size > len(data):
+        raise truncated(base + offset, "tag")
+    (tag,) = UINT32.unpack_from(data, offset)
+    field = FIELDS_BY_TAG.get(tag)
+    if field is None:
+        raise ManifestDecodeError(
+            f"unknown tag {tag} at offset {base + offset}")
+
+    end = offset + field.codec.size
+    if end > len(data):
+        raise truncated(base + offset, describe_field(field))
+    values = field.codec.unpack_from(data, offset)[1:]
+
+    if not field.string:
+        return ManifestRecord(field, base + offset, end - offset, values)
+    string_offset, string_size, end = read_inline_string(
+        data, end, describe_field(field), base)
+    return ManifestRecord(field, base + offset, end - offset, values, data,
+                          string_offset, string_size)
+
+
+def skip_record(data, offset):
+    """Bounds-checks the tagged entry at offset, only reading its tag and the
+    size of its inline string.
+
+    :returns: tuple of the field of the entry and the offset following it
+    """
+    if offset + UINT32.size > len(data):
+        raise truncated(offset, "tag")
+    (tag,) = UINT32.unpack_from(data, offset)
+    field = FIELDS_BY_TAG.get(tag)
+    if field is None:
+        raise ManifestDecodeError(f"unknown tag {tag} at offset {offset}")
+
+    end = offset + field.codec.size
+    if field.string:
+        if end + UINT32.size > len(data):
+            raise truncated(offset, describe_field(field))
+        (string_size,) = UINT32.unpack_from(data, end)
+        end += UINT32.size + padded_size(string_size)
+    if end > len(data):
+        raise truncated(offset, describe_field(field))
+    return field, end
+
+
+def iter_manifest_records(data, offset):
+    """Yields a ManifestRecord for each tagged entry of a binary manifest,
+    starting with the entry at offset.
+    """
+    while offset < len(data):
+        record = decode_record(data, offset)
+        yield record
+        offset += record.size
+
+
+def check_duplicate(record, keys):
+    """Rejects a second record of a field which is not repeated. keys holds
+    the keys of the fields seen so far.
+    """
+    field = record.field
+    if field.repeated:
+        return
+    if field.key in keys:
+        raise ManifestDecodeError(
+            f"duplicate {describe_field(field)} at offset {record.offset}")
+    keys.add(field.key)
+
+
+def unpack_binary_manifest_to_data(packed_data):
+    """This method can be used for extracting manifest data from packed binary.
+    UUID should be present in packed data.
+
+    :raises ManifestDecodeError: if packed_data is not a valid manifest
+    """
+    data = byte_view(packed_data)
+    manifest = {}
+    manifest[UUID], manifest[APP_NAME], offset = decode_manifest_header(data)
+
+    keys = set()
+    for record in iter_manifest_records(data, offset):
+        check_duplicate(record, keys)
+        if record.field.repeated:
+            manifest.setdefault(record.field.key, []).append(record.value())
+        else:
+            manifest[record.field.key] = record.value()
+
+    return manifest
+
+
+class ManifestStreamDecoder(object):
+    """Incremental decoder of one binary manifest arriving in chunks.
+
+    feed() returns the records completed by each chunk as (offset, key, value)
+    tuples: first the UUID and the app name, then the JSON value of each tagged
+    entry with the key of its field. Only the bytes of the last, incomplete
+    record are buffered, and records with an inline string larger than
+    STRING_MAX_SIZE are rejected. close() checks that the manifest ended with
+    a complete record. Once feed() raised, later calls raise the same error.
+    Packed manifests do not record their own size, so each manifest of a
+    concatenated blob needs its own decoder.
+    """
+
+    # The next record to decode
+    EXPECT_UUID = 0
+    EXPECT_APP_NAME = 1
+    EXPECT_ENTRY = 2
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # offset of the start of buffer in the manifest
+        self.offset = 0
+        self.expect = self.EXPECT_UUID
+        self.keys = set()
+        # message of the error raised by feed(), the state is invalid after it
+        self.error = None
+
+    def next_record_size(self, data, offset):
+        """Returns the size of the record at offset, or None if data does not
+        hold enough of it to tell
+        """
+        if self.expect == self.EXPECT_UUID:
+            return UUID_SIZE
+        if offset + UINT32.size > len(data):
+            return None
+        (word,) = UINT32.unpack_from(data, offset)
+        if self.expect == self.EXPECT_APP_NAME:
+            self.check_string_size(word, offset, APP_NAME)
+            return UINT32.size + padded_size(word)
+
+        field = FIELDS_BY_TAG.get(word)
+        if field is None:
+            raise ManifestDecodeError(
+                f"unknown tag {word} at offset {self.offset + offset}")
+        size = field.codec.size
+        if not field.string:
+            return size
+        if offset + size + UINT32.size > len(data):
+            return None
+        (string_size,) = UINT32.unpack_from(data, offset + size)
+        self.check_string_size(string_size, offset, describe_field(field))
+        return size + UINT32.size + padded_size(string_size)
+
+    def check_string_size(self, size, offset, what):
+        if size > STRING_MAX_SIZE:
+            raise ManifestDecodeError(
+                f"string size {size} at offset {self.offset + offset} in "
+                f"{what} is larger than {STRING_MAX_SIZE}")
+
+    def decode_next(self, data, offset):
+        """Decodes the complete record at offset"""
+        base = self.offset
+        if self.expect == self.EXPECT_UUID:
+            self.expect = self.EXPECT_APP_NAME
+            return (base + offset, UUID, decode_uuid(data, offset))
+        if self.expect == self.EXPECT_APP_NAME:
+            app_name, _ = decode_app_name(data, offset, base)
+            self.expect = self.EXPECT_ENTRY
+            return (base + offset, APP_NAME, app_name)
+
+        record = decode_record(data, offset, base)
+        check_duplicate(record, self.keys)
+        return (record.offset, record.field.key, record.value())
+
+    def feed(self, chunk):
+        """Decodes the next chunk of the manifest.
+
+        :returns: list of the (offset, key, value) of the completed records
+        :raises ManifestDecodeError: if the manifest is malformed
+        """
+        self.check_failed()
+        self.buffer += chunk
+        records = []
+        offset = 0
+        try:
+            with memoryview(self.buffer) as data:
+                while True:
+                    size = self.next_record_size(data, offset)
+                    if size is None or offset + size > len(data):
+                        break
+                    records.append(self.decode_next(data, offset))
+                    offset += size
+        except ManifestDecodeError as ex:
+            self.error = str(ex)
+            raise
+        del self.buffer[:offset]
+        self.offset += offset
+        return records
+
+    def close(self):
+        """Ends the manifest.
+
+        :raises ManifestDecodeError: if the manifest ended within a record
+        """
+        self.check_failed()
+        if self.expect == self.EXPECT_UUID:
+            raise truncated(self.offset, UUID)
+        if self.expect == self.EXPECT_APP_NAME:
+            raise truncated(self.offset, APP_NAME)
+        if self.buffer:
+            what = "tag"
+            if len(self.buffer) >= UINT32.size:
+                (tag,) = UINT32.unpack_from(self.buffer, 0)
+                field = FIELDS_BY_TAG.get(tag)
+                what = f"unknown tag {tag}" if field is None \
+                    else describe_field(field)
+            raise truncated(self.offset, what)
+
+    def check_failed(self):
+        if self.error is not None:
+            raise ManifestDecodeError(self.error)
+
+
+class ManifestView(object):
+    """Read-only view of a packed manifest held by a bytes-like object, e.g.
+    bytes, an mmap or a memoryview, which is not copied.
+
+    The constructor only indexes the offsets of the tagged entries. The UUID,
+    the app name and the fields, which are attributes named by their manifest
+    JSON keys (view.version, view.mem_map, ...), are decoded on first access
+    and cached. Missing fields are None, or empty lists for repeated fields.
+    release() gives up the buffer, e.g. before closing an mmap.
+    """
+
+    def __init__(self, buffer):
+        self.data = byte_view(buffer)
+        try:
+            if len(self.data) < UUID_SIZE:
+                raise truncated(0, UUID)
+            _, _, offset = read_inline_string(self.data, UUID_SIZE, APP_NAME)
+
+            # offsets of the entries of each tag
+            self.offsets = {}
+            while offset < len(self.data):
+                field, end = skip_record(self.data, offset)
+                offsets = self.offsets.setdefault(field.tag, [])
+                if offsets and not field.repeated:
+                    raise ManifestDecodeError(
+                        f"duplicate {describe_field(field)} at offset "
+                        f"{offset}")
+                offsets.append(offset)
+                offset = end
+        except BaseException:
+            # the caller gets no view to release, e.g. before closing an mmap
+            self.data.release()
+            raise
+
+        self.cache = {}
+
+    def release(self):
+        self.cache.clear()
+        self.data.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    @property
+    def uuid(self):
+        if UUID not in self.cache:
+            self.cache[UUID] = decode_uuid(self.data, 0)
+        return self.cache[UUID]
+
+    @property
+    def app_name(self):
+        if APP_NAME not in self.cache:
+            self.cache[APP_NAME], _ = decode_app_name(self.data, UUID_SIZE)
+        return self.cache[APP_NAME]
+
+    def get(self, key):
+        """Returns the JSON value of the field with the given key"""
+        if key not in self.cache:
+            field = FIELDS_BY_KEY[key]
+            values = [decode_record(self.data, offset).value()
+                      for offset in self.offsets.get(field.tag, ())]
+            if field.repeated:
+                self.cache[key] = values
+            else:
+                self.cache[key] = values[0] if values else None
+        return self.cache[key]
+
+    def __getattr__(self, name):
+        if name in FIELDS_BY_KEY:
+            return self.get(name)
+        raise AttributeError(
+            f"{type(self).__name__!r} object has no attribute {name!r}")
@@ -9,9 +9,41 @@ Command to run tests:
   python3 -m unittest -v test_manifest_compiler
 """
 
+import argparse
+import contextlib
+import copy
+import fcntl
+import io
+import json
+import mmap
+import os
+import pickle
+import select
+import shutil
+import socket
+import subprocess
+import struct
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
+import constants_db
+import make_jobserver
+import manifest_build
+import manifest_cache
 import manifest_compiler
+import manifest_compiler_client
+import manifest_compiler_server
+import manifest_defs
+import manifest_headers
+import manifest_columns
+import manifest_decode
+import manifest_overlay
+import manifest_schema
+import manifest_unpacker
 
 TEST_UUID = "SAMPLE_UUID"
 TEST_PORT = "SAMPLE_PORT"
@@ -25,7 +57,7 @@ class TestManifest(unittest.TestCase):
         log = manifest_compiler.Log()
         config_data = {"data": 1234}
         data = manifest_compiler.get_string(config_data, "data", constants, log)
-        self.assertEqual(len(config_data), 0)
+        self.assertEqual(len(config_data), 1)
         self.assertTrue(log.error_occurred())
         self.assertIsNone(data)
 
@@ -36,7 +68,7 @@ class TestManifest(unittest.TestCase):
         uuid = "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf"
         config_data = {"data": uuid}
         data = manifest_compiler.get_string(config_data, "data", constants, log)
-        self.assertEqual(len(config_data), 0)
+        self.assertEqual(len(config_data), 1)
         self.assertFalse(log.error_occurred())
         self.assertEqual(data, uuid)
 
@@ -46,7 +78,7 @@ class TestManifest(unittest.TestCase):
         log = manifest_compiler.Log()
         config_data = {"data": ""}
         data = manifest_compiler.get_string(config_data, "data", constants, log)
-        self.assertEqual(len(config_data), 0)
+        self.assertEqual(len(config_data), 1)
         self.assertFalse(log.error_occurred())
         self.assertEqual(data, "")
 
@@ -95,7 +127,7 @@ class TestManifest(unittest.TestCase):
                 config_data = {"data": int_value}
                 data = manifest_compiler.get_int(config_data, "data", constants,
                                                  log)
-                self.assertEqual(len(config_data), 0)
+                self.assertEqual(len(config_data), 1)
                 self.assertFalse(log.error_occurred())
                 self.assertEqual(data, expected_value)
 
@@ -115,7 +147,7 @@ class TestManifest(unittest.TestCase):
                 config_data = {"data": int_value}
                 data = manifest_compiler.get_int(config_data, "data", constants,
                                                  log)
-                self.assertEqual(len(config_data), 0)
+                self.assertEqual(len(config_data), 1)
                 self.assertTrue(log.error_occurred())
                 self.assertIsNone(data)
 
@@ -521,6 +553,90 @@ class TestManifest(unittest.TestCase):
             manifest_compiler.MEM_MAP, constants, log)
         self.assertTrue(log.error_occurred())
 
+    def test_validate_mem_map_range(self):
+        """Test that mem_map entries with a count expand like listed entries"""
+        constants = {"MMIO_COUNT": manifest_compiler.Constant(
+            "MMIO_COUNT", 3, "int")}
+        mem_map_json_data = [
+            {"id": 1, "addr": "0x70000000", "size": "0x1000"},
+            {"id": 10, "addr": "0x80000000", "size": "0x100",
+             "count": "MMIO_COUNT", "type": "cached", "non_secure": True},
+            {"id": 20, "addr": "0x90000000", "size": "0x100", "count": 2,
+             "stride": "0x10000"},
+        ]
+        listed_json_data = [
+            {"id": 1, "addr": "0x70000000", "size": "0x1000"},
+            {"id": 10, "addr": "0x80000000", "size": "0x100",
+             "type": "cached", "non_secure": True},
+            {"id": 11, "addr": "0x80000100", "size": "0x100",
+             "type": "cached", "non_secure": True},
+            {"id": 12, "addr": "0x80000200", "size": "0x100",
+             "type": "cached", "non_secure": True},
+            {"id": 20, "addr": "0x90000000", "size": "0x100"},
+            {"id": 21, "addr": "0x90010000", "size": "0x100"},
+        ]
+
+        log = manifest_compiler.Log()
+        mem_io_maps = manifest_compiler.parse_mem_map(
+            mem_map_json_data, manifest_compiler.MEM_MAP, constants, log)
+        listed_mem_io_maps = manifest_compiler.parse_mem_map(
+            listed_json_data, manifest_compiler.MEM_MAP, constants, log)
+        self.assertFalse(log.error_occurred())
+        self.assertEqual(mem_io_maps, listed_mem_io_maps)
+
+        packed = []
+        for mem_map_data in (mem_map_json_data, listed_json_data):
+            manifest = manifest_compiler.parse_manifest_config(
+                {"uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+                 "min_heap": 4096, "min_stack": 4096,
+                 "mem_map": mem_map_data}, constants, "test", log)
+            packed.append(manifest_compiler.pack_manifest_data(manifest))
+        self.assertFalse(log.error_occurred())
+        self.assertEqual(packed[0], packed[1])
+
+    def test_validate_mem_map_range_invalid(self):
+        """Test mem_map entries with invalid counts and strides"""
+        cases = [
+            ("zero count", {"count": 0}),
+            ("negative count", {"count": -1}),
+            ("string count", {"count": "many"}),
+            ("negative stride", {"count": 2, "stride": -4096}),
+            ("count too large", {"count": 4097}),
+            ("id overflow", {"id": 4294967295, "count": 2}),
+            ("addr overflow", {"addr": "0xffffffff00000000",
+                               "stride": "0x100000000", "count": 2}),
+            ("stride without count", {"stride": "0x1000"}),
+        ]
+        for msg, range_data in cases:
+            with self.subTest(msg):
+                log = manifest_compiler.Log(out=io.StringIO())
+                manifest_compiler.parse_mem_map(
+                    [dict({"id": 1, "addr": "0x70000000", "size": "0x1000"},
+                          **range_data)],
+                    manifest_compiler.MEM_MAP, {}, log)
+                self.assertTrue(log.error_occurred())
+
+    def test_mem_map_range_overflow(self):
+        """Test that expanded mem_map entries out of range are not packed"""
+        log = manifest_compiler.Log(out=io.StringIO())
+        manifest = manifest_compiler.parse_manifest_config(
+            {"uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+             "app_name": "test", "min_heap": 4096, "min_stack": 4096,
+             "mem_map": [{"id": 4294967295, "addr": "0xffffffff00000000",
+                          "size": "0x1000", "count": 4}]},
+            {}, "test", log)
+        self.assertTrue(log.error_occurred())
+        self.assertIn("ids above", log.messages[0])
+        self.assertIsNone(manifest)
+
+        log = manifest_compiler.Log(out=io.StringIO())
+        mem_io_maps = manifest_compiler.parse_mem_map(
+            [{"id": 1, "addr": "0xffffffffffffe000", "size": "0x1000",
+              "count": 2}],
+            manifest_compiler.MEM_MAP, {}, log)
+        self.assertFalse(log.error_occurred())
+        self.assertEqual(mem_io_maps[1].addr, 0xfffffffffffff000)
+
     def test_validate_mgmt_flags_1(self):
         """Test with a valid management flags"""
         constants = {}
@@ -884,7 +1000,7 @@ class TestManifest(unittest.TestCase):
                                                            constants,
                                                            default_app_name,
                                                            log)
-        self.assertEqual(len(config_data), 0)
+        self.assertEqual(len(config_data), 4)
         self.assertTrue(log.error_occurred())
         self.assertIsNone(manifest)
 
@@ -944,7 +1060,7 @@ class TestManifest(unittest.TestCase):
             config_data, manifest_compiler.UUID, constants, log)
         data_port = manifest_compiler.get_string(
             config_data, manifest_compiler.START_PORT_NAME, constants, log)
-        self.assertEqual(len(config_data), 0)
+        self.assertEqual(len(config_data), 2)
         self.assertFalse(log.error_occurred())
         self.assertEqual(data_uuid.hex(), uuid.replace("-", ""))
         self.assertEqual(data_port, port)
@@ -1671,22 +1787,2303 @@ class TestManifest(unittest.TestCase):
         )
         self.assertTrue(log.error_occurred())
         self.assertIsNone(manifest)
+    def test_manifest_valid_pack_start_port_flags(self):
+        """Test packing and unpacking every combination of start port flags
+        """
+        constants = {}
+        log = manifest_compiler.Log()
+
+        start_ports = [{
+            manifest_compiler.START_PORT_NAME: f"com.android.trusty.port{i}",
+            manifest_compiler.START_PORT_FLAGS: {
+                manifest_compiler.START_PORT_ALLOW_TA_CONNECT: bool(i & 1),
+                manifest_compiler.START_PORT_ALLOW_NS_CONNECT: bool(i & 2)
+            }
+        } for i in range(4)]
+
+        # Reference JSON manifest data structure
+        ref_config_data = {
+            manifest_compiler.UUID: "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+            manifest_compiler.APP_NAME: "test",
+            manifest_compiler.MIN_HEAP: 4096,
+            manifest_compiler.MIN_STACK: 4096,
+            manifest_compiler.START_PORTS: start_ports,
+            manifest_compiler.MGMT_FLAGS: {
+                manifest_compiler.MGMT_FLAG_RESTART_ON_EXIT: False,
+                manifest_compiler.MGMT_FLAG_DEFERRED_START: False,
+                manifest_compiler.MGMT_FLAG_NON_CRITICAL_APP: False
+            },
+            manifest_compiler.APPLOADER_FLAGS: {
+                manifest_compiler.APPLOADER_FLAGS_REQUIRES_ENCRYPTION: False,
+            }
+        }
+
+        # JSON manifest data structure
+        config_data = {
+            manifest_compiler.UUID: "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+            manifest_compiler.MIN_HEAP: 4096,
+            manifest_compiler.MIN_STACK: 4096,
+            manifest_compiler.START_PORTS: copy.deepcopy(start_ports)
+        }
+
+        self.assertEqual(
+            manifest_compiler.manifest_data_to_json(ref_config_data),
+            manifest_compiler.unpack_binary_manifest_to_json(
+                pack_manifest_config_data(
+                    self, config_data, log, constants)))
+
+    def test_schema_covers_config_keys(self):
+        """Test that every config key tag is packed by a manifest field"""
+        tags = {value for name, value in vars(manifest_defs).items()
+                if name.startswith("TRUSTY_APP_CONFIG_KEY_")}
+        self.assertEqual(set(manifest_compiler.FIELDS_BY_TAG), tags)
+
 
 def pack_manifest_config_data(self, config_data, log, constants):
     # parse manifest JSON data
     default_app_name = "test"
+    original_config_data = copy.deepcopy(config_data)
     manifest = manifest_compiler.parse_manifest_config(config_data, constants,
                                                        default_app_name, log)
     self.assertFalse(log.error_occurred())
 
     # pack manifest config data
     packed_data = manifest_compiler.pack_manifest_data(manifest)
-    self.assertEqual(len(config_data), 0)
+    self.assertEqual(config_data, original_config_data)
     self.assertFalse(log.error_occurred())
     self.assertIsNotNone(packed_data)
 
     return packed_data
 
 
+def write_json_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as json_file:
+        json.dump(data, json_file)
+
+
+class TestPackInto(unittest.TestCase):
+    """Test packing manifests into caller-provided buffers"""
+
+    def setUp(self):
+        self.manifests = []
+        for extra in ({}, {"app_name": "abc", "version": 1},
+                      {"mem_map": [{"id": 1, "addr": "0x70000000",
+                                    "size": "0x1000"}],
+                       "start_ports": [
+                           {"name": "com.android.trusty." + "x" * i,
+                            "flags": {"allow_ta_connect": True,
+                                      "allow_ns_connect": False}}
+                           for i in range(4)],
+                       "min_shadow_stack": 8192}):
+            log = manifest_compiler.Log()
+            self.manifests.append(manifest_compiler.parse_manifest_config(
+                dict({"uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+                      "min_heap": 4096, "min_stack": 4096}, **extra),
+                {}, "test", log))
+            self.assertFalse(log.error_occurred())
+
+    def test_back_to_back(self):
+        expected = [manifest_compiler.pack_manifest_data(manifest)
+                    for manifest in self.manifests]
+        self.assertEqual([manifest_compiler.packed_size(manifest)
+                          for manifest in self.manifests],
+                         [len(packed_data) for packed_data in expected])
+
+        # stale bytes in the buffer are overwritten
+        buffer = bytearray(b"\xff" * (sum(map(len, expected)) + 8))
+        offset = 4
+        for manifest in self.manifests:
+            offset = manifest_compiler.pack_manifest_into(buffer, offset,
+                                                          manifest)
+        self.assertEqual(offset, len(buffer) - 4)
+        self.assertEqual(bytes(buffer[4:offset]), b"".join(expected))
+
+    def test_mmap(self):
+        packed_data = manifest_compiler.pack_manifest_data(self.manifests[2])
+        with mmap.mmap(-1, len(packed_data)) as buffer:
+            self.assertEqual(manifest_compiler.pack_manifest_into(
+                buffer, 0, self.manifests[2]), len(packed_data))
+            self.assertEqual(buffer[:], packed_data)
+
+    def test_too_small(self):
+        for manifest in self.manifests:
+            buffer = bytearray(manifest_compiler.packed_size(manifest) - 1)
+            with self.assertRaises(struct.error):
+                manifest_compiler.pack_manifest_into(buffer, 0, manifest)
+            self.assertEqual(len(buffer),
+                             manifest_compiler.packed_size(manifest) - 1)
+
+
+class TestRecords(unittest.TestCase):
+    """Test the immutable records holding parsed manifests"""
+
+    def parse(self):
+        log = manifest_compiler.Log()
+        manifest = manifest_compiler.parse_manifest_config({
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+            "min_heap": 4096,
+            "min_stack": 4096,
+            "mem_map": [{"id": 1, "addr": "0x70000000", "size": "0x1000"}],
+            "mgmt_flags": {"restart_on_exit": True},
+            "start_ports": [{"name": "com.android.trusty.test",
+                             "flags": {"allow_ta_connect": True,
+                                       "allow_ns_connect": False}}]
+        }, {}, "test", log)
+        self.assertFalse(log.error_occurred())
+        return manifest
+
+    def test_equality(self):
+        manifest = self.parse()
+        self.assertEqual(manifest, self.parse())
+        self.assertEqual(hash(manifest), hash(self.parse()))
+        self.assertEqual(len({manifest, self.parse()}), 1)
+
+        changed = manifest.replace(version=2)
+        self.assertNotEqual(changed, manifest)
+        self.assertEqual(changed.version, 2)
+        self.assertIsNone(manifest.version)
+        self.assertNotEqual(manifest_defs.StartPortFlags(True, False),
+                            (True, False))
+        with self.assertRaises(TypeError):
+            manifest.replace(versions=2)
+
+    def test_immutable(self):
+        manifest = self.parse()
+        with self.assertRaises(AttributeError):
+            manifest.version = 2
+        with self.assertRaises(AttributeError):
+            manifest.mem_io_maps[0].size = 0
+        with self.assertRaises(AttributeError):
+            manifest.extra = 0
+        self.assertFalse(hasattr(manifest, "__dict__"))
+
+    def test_dict(self):
+        manifest = self.parse()
+        values = manifest.to_dict()
+        self.assertEqual(values["mem_io_maps"][0]["addr"], 0x70000000)
+        self.assertEqual(values["start_ports"][0]["start_port_flags"],
+                         {"allow_ta_connect": True, "allow_ns_connect": False})
+        self.assertEqual(manifest_defs.Manifest.from_dict(values), manifest)
+
+    def test_pickle(self):
+        manifest = self.parse()
+        self.assertEqual(pickle.loads(pickle.dumps(manifest)), manifest)
+        self.assertEqual(copy.deepcopy(manifest), manifest)
+
+
+class TestUnpack(unittest.TestCase):
+    """Test decoding binary manifests"""
+
+    def setUp(self):
+        log = manifest_compiler.Log()
+        manifest = manifest_compiler.parse_manifest_config({
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+            "min_heap": 4096,
+            "min_stack": 4096,
+            "mem_map": [{"id": 1, "addr": "0x70000000", "size": "0x1000"}],
+            "start_ports": [{"name": "com.android.trusty.test",
+                             "flags": {"allow_ta_connect": True,
+                                       "allow_ns_connect": False}}]
+        }, {}, "test", log)
+        self.assertFalse(log.error_occurred())
+        self.packed_data = manifest_compiler.pack_manifest_data(manifest)
+        self.records = self.decode_records(self.packed_data)
+
+    def decode_records(self, packed_data):
+        data = manifest_compiler.byte_view(packed_data)
+        _, _, offset = manifest_compiler.decode_manifest_header(data)
+        return list(manifest_compiler.iter_manifest_records(data, offset))
+
+    def find_record(self, tag):
+        return [record for record in self.records if record.tag == tag][0]
+
+    def test_record_offsets(self):
+        offset = self.records[0].offset
+        for record in self.records:
+            self.assertEqual(record.offset, offset)
+            self.assertEqual(self.packed_data[offset:offset + 4],
+                             record.tag.to_bytes(4, "little"))
+            offset += record.size
+        self.assertEqual(offset, len(self.packed_data))
+
+        port = self.find_record(
+            manifest_compiler.TRUSTY_APP_CONFIG_KEY_START_PORT)
+        self.assertEqual(port.string, "com.android.trusty.test")
+
+    def test_truncated(self):
+        """Test that every truncated manifest is rejected"""
+        boundaries = {record.offset for record in self.records}
+        for size in range(len(self.packed_data)):
+            if size in boundaries:
+                # a valid manifest with fewer entries
+                continue
+            with self.assertRaises(manifest_compiler.ManifestDecodeError):
+                manifest_compiler.unpack_binary_manifest_to_data(
+                    self.packed_data[:size])
+
+        mem_map = self.find_record(
+            manifest_compiler.TRUSTY_APP_CONFIG_KEY_MAP_MEM)
+        with self.assertRaisesRegex(
+                manifest_compiler.ManifestDecodeError,
+                f"^truncated at offset {mem_map.offset} in tag 3 "
+                r"\(mem_map\)$"):
+            manifest_compiler.unpack_binary_manifest_to_data(
+                self.packed_data[:mem_map.offset + 8])
+
+    def test_malformed(self):
+        min_heap = self.find_record(
+            manifest_compiler.TRUSTY_APP_CONFIG_KEY_MIN_HEAP_SIZE)
+        min_heap_entry = self.packed_data[
+            min_heap.offset:min_heap.offset + min_heap.size]
+        mem_map = self.find_record(
+            manifest_compiler.TRUSTY_APP_CONFIG_KEY_MAP_MEM)
+        mmu_flags_offset = mem_map.offset + mem_map.size - 4
+        port = self.find_record(
+            manifest_compiler.TRUSTY_APP_CONFIG_KEY_START_PORT)
+        string_end = port.string_offset + port.string_size
+
+        for packed_data, message in (
+                (self.packed_data + (99).to_bytes(4, "little"),
+                 f"^unknown tag 99 at offset {len(self.packed_data)}$"),
+                (self.packed_data + min_heap_entry,
+                 f"^duplicate tag 2 \\(min_heap\\) at offset "
+                 f"{len(self.packed_data)}$"),
+                (self.packed_data[:mmu_flags_offset] + b"\3\0\0\0" +
+                 self.packed_data[mmu_flags_offset + 4:],
+                 "^unknown cache type in arch_mmu_flags 0x3 at offset "
+                 f"{mem_map.offset} in tag 3 \\(mem_map\\)$"),
+                (self.packed_data[:string_end] + b"x" +
+                 self.packed_data[string_end + 1:],
+                 "not null-terminated"),
+                (self.packed_data[:port.string_offset] + b"\xff" +
+                 self.packed_data[port.string_offset + 1:],
+                 "invalid UTF-8")):
+            with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                        message):
+                manifest_compiler.unpack_binary_manifest_to_data(packed_data)
+
+
+class TestStreamDecoder(unittest.TestCase):
+    """Test decoding binary manifests arriving in chunks"""
+
+    def setUp(self):
+        log = manifest_compiler.Log()
+        manifest = manifest_compiler.parse_manifest_config({
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+            "app_name": "stream-test",
+            "min_heap": 8192,
+            "min_stack": 4096,
+            "mem_map": [{"id": i, "addr": hex(0x70000000 + i * 0x1000),
+                         "size": "0x1000"} for i in range(2)],
+            "start_ports": [{"name": f"com.android.trusty.port{i}",
+                             "flags": {"allow_ta_connect": True,
+                                       "allow_ns_connect": bool(i)}}
+                            for i in range(2)],
+            "version": 3
+        }, {}, "test", log)
+        self.assertFalse(log.error_occurred())
+        self.packed_data = manifest_compiler.pack_manifest_data(manifest)
+        self.repeated = {field.key for field in manifest_compiler.FIELDS
+                         if field.repeated}
+
+    def decode(self, chunks):
+        decoder = manifest_compiler.ManifestStreamDecoder()
+        records = []
+        for chunk in chunks:
+            records += decoder.feed(chunk)
+        decoder.close()
+
+        manifest = {}
+        for _, key, value in records:
+            if key in self.repeated:
+                manifest.setdefault(key, []).append(value)
+            else:
+                manifest[key] = value
+        return manifest, [offset for offset, _, _ in records]
+
+    def test_split_at_every_byte(self):
+        expected = manifest_compiler.unpack_binary_manifest_to_data(
+            self.packed_data)
+        data = manifest_compiler.byte_view(self.packed_data)
+        _, _, offset = manifest_compiler.decode_manifest_header(data)
+        expected_offsets = [0, 16] + [
+            record.offset for record in
+            manifest_compiler.iter_manifest_records(data, offset)]
+
+        for split in range(len(self.packed_data) + 1):
+            self.assertEqual(self.decode([self.packed_data[:split],
+                                          self.packed_data[split:]]),
+                             (expected, expected_offsets))
+        self.assertEqual(
+            self.decode([bytes([byte]) for byte in self.packed_data]),
+            (expected, expected_offsets))
+
+    def test_records_emitted_when_complete(self):
+        decoder = manifest_compiler.ManifestStreamDecoder()
+        self.assertEqual(decoder.feed(self.packed_data[:15]), [])
+        self.assertEqual(decoder.feed(self.packed_data[15:17]),
+                         [(0, manifest_compiler.UUID,
+                           "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf")])
+        # only the partial app name is buffered
+        self.assertEqual(len(decoder.buffer), 1)
+
+    def test_truncated(self):
+        data = manifest_compiler.byte_view(self.packed_data)
+        _, _, offset = manifest_compiler.decode_manifest_header(data)
+        boundaries = {record.offset for record in
+                      manifest_compiler.iter_manifest_records(data, offset)}
+        for size in range(len(self.packed_data)):
+            decoder = manifest_compiler.ManifestStreamDecoder()
+            decoder.feed(self.packed_data[:size])
+            if size in boundaries:
+                # a valid manifest with fewer entries
+                decoder.close()
+                continue
+            with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                        "^truncated at offset"):
+                decoder.close()
+
+    def test_unknown_tag(self):
+        decoder = manifest_compiler.ManifestStreamDecoder()
+        with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                    "^unknown tag 99 at offset"):
+            decoder.feed(self.packed_data + (99).to_bytes(4, "little"))
+
+    def test_failed_decoder(self):
+        """Test that a decoder keeps failing after an error"""
+        decoder = manifest_compiler.ManifestStreamDecoder()
+        with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                    "^unknown tag 99 at offset"):
+            decoder.feed(self.packed_data + (99).to_bytes(4, "little"))
+        with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                    "^unknown tag 99 at offset"):
+            decoder.feed(b"")
+        with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                    "^unknown tag 99 at offset"):
+            decoder.close()
+
+    def test_string_size_limit(self):
+        """Test that a huge string size fails instead of being buffered"""
+        huge_size = (manifest_compiler.STRING_MAX_SIZE + 1).to_bytes(
+            4, "little")
+        decoder = manifest_compiler.ManifestStreamDecoder()
+        with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                    "^string size 65537 at offset 16 in "
+                                    "app_name is larger than 65536$"):
+            decoder.feed(self.packed_data[:16] + huge_size)
+
+        field = manifest_compiler.FIELDS_BY_KEY["start_ports"]
+        record = (field.tag.to_bytes(4, "little") +
+                  bytes(field.codec.size - 4) + huge_size)
+        decoder = manifest_compiler.ManifestStreamDecoder()
+        with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                    f"in tag {field.tag} \\(start_ports\\) "
+                                    "is larger than 65536$"):
+            decoder.feed(self.packed_data + record)
+
+    def test_close_unknown_tag(self):
+        """Test that close() describes a trailing record with an unknown tag"""
+        decoder = manifest_compiler.ManifestStreamDecoder()
+        decoder.feed(self.packed_data)
+        decoder.buffer += (99).to_bytes(4, "little")
+        with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                    "in unknown tag 99$"):
+            decoder.close()
+
+
+class TestManifestView(unittest.TestCase):
+    """Test decoding single fields of binary manifests"""
+
+    def setUp(self):
+        log = manifest_compiler.Log()
+        manifest = manifest_compiler.parse_manifest_config({
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+            "app_name": "view-test",
+            "min_heap": 8192,
+            "min_stack": 4096,
+            "mem_map": [{"id": i, "addr": hex(0x70000000 + i * 0x1000),
+                         "size": "0x1000"} for i in range(3)],
+            "start_ports": [{"name": "com.android.trusty.view",
+                             "flags": {"allow_ta_connect": True,
+                                       "allow_ns_connect": False}}],
+            "version": 3
+        }, {}, "test", log)
+        self.assertFalse(log.error_occurred())
+        self.packed_data = manifest_compiler.pack_manifest_data(manifest)
+        self.expected = manifest_compiler.unpack_binary_manifest_to_data(
+            self.packed_data)
+
+    def check_view(self, view):
+        for key, value in self.expected.items():
+            self.assertEqual(getattr(view, key), value)
+        self.assertIsNone(view.pinned_cpu)
+        with self.assertRaises(AttributeError):
+            view.no_such_field  # pylint: disable=pointless-statement
+
+    def test_buffers(self):
+        self.check_view(manifest_compiler.ManifestView(self.packed_data))
+        self.check_view(manifest_compiler.ManifestView(
+            memoryview(bytearray(self.packed_data))))
+
+        with tempfile.TemporaryFile() as manifest_file:
+            manifest_file.write(self.packed_data)
+            manifest_file.flush()
+            with mmap.mmap(manifest_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as data:
+                with manifest_compiler.ManifestView(data) as view:
+                    self.check_view(view)
+
+    def test_decodes_accessed_fields_once(self):
+        view = manifest_compiler.ManifestView(self.packed_data)
+        with mock.patch.object(manifest_unpacker, "decode_record",
+                               wraps=manifest_unpacker.decode_record) as \
+                decode_record:
+            self.assertEqual(view.version, 3)
+            self.assertEqual(view.version, 3)
+            self.assertEqual(decode_record.call_count, 1)
+            self.assertEqual(len(view.mem_map), 3)
+            self.assertEqual(decode_record.call_count, 4)
+            self.assertEqual(view.start_ports, self.expected["start_ports"])
+            self.assertEqual(decode_record.call_count, 5)
+
+    def test_malformed(self):
+        with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                    "^truncated at offset"):
+            manifest_compiler.ManifestView(self.packed_data[:-1])
+        with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                    "^duplicate tag 7 \\(version\\)"):
+            manifest_compiler.ManifestView(
+                self.packed_data + (7).to_bytes(4, "little") +
+                (4).to_bytes(4, "little"))
+
+    def test_malformed_releases_buffer(self):
+        """Test that a failed constructor does not keep the buffer exported"""
+        data = bytearray(self.packed_data[:-1])
+        error = None
+        try:
+            manifest_compiler.ManifestView(data)
+        except manifest_compiler.ManifestDecodeError as ex:
+            # the traceback keeps the frame of the constructor alive
+            error = ex
+        self.assertIsNotNone(error.__traceback__)
+        # resizing fails while the buffer is exported
+        data.extend(b"\0")
+
+
+class TestManifestColumns(unittest.TestCase):
+    """Test decoding manifest corpora into columnar tables"""
+
+    def setUp(self):
+        self.manifests = []
+        for i, extra in enumerate((
+                {"mem_map": [{"id": 1, "addr": "0x70000000",
+                              "size": "0x1000"},
+                             {"id": 2, "addr": "0x100000000",
+                              "size": "0x4", "type": "uncached_device",
+                              "non_secure": True}],
+                 "start_ports": [{"name": "com.android.trusty.a",
+                                  "flags": {"allow_ta_connect": True,
+                                            "allow_ns_connect": True}}],
+                 "mgmt_flags": {"restart_on_exit": True},
+                 "version": 2},
+                {},
+                {"start_ports": [{"name": "com.android.trusty.c" + str(j),
+                                  "flags": {"allow_ta_connect": True,
+                                            "allow_ns_connect": False}}
+                                 for j in range(2)],
+                 "pinned_cpu": 1, "priority": 5})):
+            log = manifest_compiler.Log()
+            manifest = manifest_compiler.parse_manifest_config(dict({
+                # ends with a zero byte, which must be kept
+                "uuid": f"5f902ace-5e5c-4cd8-ae54-87b88c22d{i}00",
+                "app_name": f"app{i}",
+                "min_heap": 4096 * (i + 1),
+                "min_stack": 4096,
+            }, **extra), {}, "test", log)
+            self.assertFalse(log.error_occurred())
+            self.manifests.append(
+                manifest_compiler.pack_manifest_data(manifest))
+
+    def check_columns(self, columns):
+        """Checks the tables against the unpacked manifests"""
+        apps = columns.apps
+        mem_maps = columns.records["mem_map"]
+        start_ports = columns.records["start_ports"]
+        mem_map_apps = list(mem_maps["app"])
+        start_port_apps = list(start_ports["app"])
+        for index, packed_data in enumerate(self.manifests):
+            expected = manifest_compiler.unpack_binary_manifest_to_data(
+                packed_data)
+            self.assertEqual(bytes(apps["uuid"][index]).hex(),
+                             expected["uuid"].replace("-", ""))
+            self.assertEqual(apps["app_name"][index], expected["app_name"])
+            for key in ("min_heap", "min_stack", "pinned_cpu", "priority",
+                        "version", "min_shadow_stack"):
+                self.assertEqual(apps[key][index], expected.get(key, -1))
+            self.assertEqual(
+                apps["mgmt_flags"][index],
+                manifest_defs.MGMT_FLAG_SET.pack(manifest_defs.MgmtFlags(
+                    **expected["mgmt_flags"])))
+
+            rows = [row for row, app in enumerate(mem_map_apps)
+                    if app == index]
+            self.assertEqual(
+                [{"id": mem_maps["id"][row],
+                  "addr": hex(mem_maps["addr"][row]),
+                  "size": hex(mem_maps["size"][row])} for row in rows],
+                [{key: mem_map[key] for key in ("id", "addr", "size")}
+                 for mem_map in expected.get("mem_map", [])])
+            rows = [row for row, app in enumerate(start_port_apps)
+                    if app == index]
+            self.assertEqual(
+                [start_ports["name"][row] for row in rows],
+                [port["name"] for port in expected.get("start_ports", [])])
+
+        self.assertEqual(mem_maps["arch_mmu_flags"][1] & 0x3,
+                         manifest_defs.ARCH_MMU_FLAG_UNCACHED_DEVICE)
+        self.assertEqual(list(start_ports["flags"]), [3, 1, 1])
+
+    def test_python(self):
+        columns = manifest_compiler.decode_manifest_columns(self.manifests,
+                                                            use_numpy=False)
+        self.check_columns(columns)
+        self.assertEqual(columns.apps["pinned_cpu"], [-1, -1, 1])
+        self.assertEqual(columns.records["start_ports"]["app"], [0, 2, 2])
+
+    @unittest.skipUnless(manifest_columns.import_numpy(),
+                         "NumPy is not installed")
+    def test_numpy(self):
+        columns = manifest_compiler.decode_manifest_columns(self.manifests,
+                                                            use_numpy=True)
+        self.check_columns(columns)
+        fallback = manifest_compiler.decode_manifest_columns(self.manifests,
+                                                             use_numpy=False)
+        self.assertEqual([bytes(uuid) for uuid in columns.apps["uuid"]],
+                         fallback.apps["uuid"])
+        for name in columns.apps.dtype.names[1:]:
+            self.assertEqual(list(columns.apps[name]),
+                             list(fallback.apps[name]))
+        for key, table in columns.records.items():
+            for name in table.dtype.names:
+                self.assertEqual(list(table[name]),
+                                 list(fallback.records[key][name]))
+
+    @unittest.skipIf(manifest_columns.import_numpy(), "NumPy is installed")
+    def test_numpy_required(self):
+        with self.assertRaises(ImportError):
+            manifest_compiler.decode_manifest_columns(self.manifests,
+                                                      use_numpy=True)
+        columns = manifest_compiler.decode_manifest_columns(self.manifests)
+        self.assertIsInstance(columns.apps, dict)
+
+    def test_empty(self):
+        columns = manifest_compiler.decode_manifest_columns([])
+        self.assertEqual(len(columns.apps["uuid"]), 0)
+        self.assertEqual(len(columns.records["mem_map"]["app"]), 0)
+
+    def test_malformed(self):
+        with self.assertRaisesRegex(manifest_compiler.ManifestDecodeError,
+                                    "^manifest 1: truncated at offset"):
+            manifest_compiler.decode_manifest_columns(
+                [self.manifests[0], self.manifests[1][:-1]],
+                use_numpy=False)
+
+
+class TestDecode(unittest.TestCase):
+    """Test decoding binary manifest files into JSON lines"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.root = self.temp_dir.name
+        self.expected = {}
+        for i, app_dir in enumerate(("a", "b", os.path.join("b", "c"))):
+            log = manifest_compiler.Log()
+            manifest = manifest_compiler.parse_manifest_config({
+                "uuid": f"5f902ace-5e5c-4cd8-ae54-87b88c22dda{i}",
+                "app_name": f"app{i}",
+                "min_heap": 4096,
+                "min_stack": 4096,
+                "start_ports": [{"name": f"com.android.trusty.app{i}",
+                                 "flags": {"allow_ta_connect": True,
+                                           "allow_ns_connect": False}}],
+                "version": i
+            }, {}, "test", log)
+            self.assertFalse(log.error_occurred())
+            os.makedirs(os.path.join(self.root, app_dir), exist_ok=True)
+            path = os.path.join(self.root, app_dir, f"app{i}.manifest")
+            packed_data = manifest_compiler.pack_manifest_data(manifest)
+            with open(path, "wb") as manifest_file:
+                manifest_file.write(packed_data)
+            self.expected[path] = \
+                manifest_compiler.unpack_binary_manifest_to_data(packed_data)
+        with open(os.path.join(self.root, "a", "notes.txt"), "w",
+                  encoding="utf-8") as other_file:
+            other_file.write("not a manifest")
+
+    def decode(self, *argv):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(stderr):
+            ret = manifest_compiler.main(["--decode"] + list(argv))
+        self.assertTrue(stdout.getvalue().endswith("\n") or
+                        not stdout.getvalue())
+        lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        return ret, lines, stderr.getvalue()
+
+    def test_directory(self):
+        ret, lines, _ = self.decode(self.root, "-j", "1")
+        self.assertEqual(ret, 0)
+        self.assertEqual([line.pop("path") for line in lines],
+                         sorted(self.expected))
+        self.assertEqual(lines, [self.expected[path]
+                                 for path in sorted(self.expected)])
+
+    def test_jobs(self):
+        self.assertEqual(self.decode(self.root, "-j", "1"),
+                         self.decode(self.root, "-j", "2"))
+
+    def test_jobserver(self):
+        """Test that --decode shares the job slots of make like --batch"""
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        os.write(write_fd, b"ab")
+        with mock.patch.dict(os.environ, {
+                "MAKEFLAGS": f"-j3 --jobserver-auth={read_fd},{write_fd}"}), \
+                mock.patch.object(manifest_decode, "CHUNK_SIZE", 1):
+            self.assertEqual(self.decode(self.root, "-j", "3"),
+                             self.decode(self.root, "-j", "1"))
+        self.assertEqual(sorted(os.read(read_fd, 16)), sorted(b"ab"))
+
+        # without a jobserver, make runs the decode on a single slot
+        with mock.patch.dict(os.environ, {"MAKEFLAGS": "k"}), \
+                mock.patch.object(manifest_decode, "batch_executor") as \
+                batch_executor:
+            ret, lines, _ = self.decode(self.root)
+        self.assertEqual(ret, 0)
+        self.assertEqual(len(lines), len(self.expected))
+        batch_executor.assert_not_called()
+
+    def test_glob(self):
+        ret, lines, _ = self.decode(os.path.join(self.root, "b", "**",
+                                                 "*.manifest"))
+        self.assertEqual(ret, 0)
+        self.assertEqual([line["path"] for line in lines],
+                         sorted(path for path in self.expected
+                                if os.sep + "b" + os.sep in path))
+
+        ret, lines, stderr = self.decode(os.path.join(self.root, "*.none"))
+        self.assertEqual(ret, 1)
+        self.assertEqual(lines, [])
+        self.assertIn("no matching files", stderr)
+
+    def test_fields(self):
+        path = sorted(self.expected)[0]
+        with mock.patch.object(manifest_unpacker, "decode_record",
+                               wraps=manifest_unpacker.decode_record) as \
+                decode_record:
+            ret, lines, _ = self.decode(path, "--fields",
+                                        "uuid,version,pinned_cpu")
+        self.assertEqual(ret, 0)
+        self.assertEqual(lines, [{"path": path,
+                                  "uuid": self.expected[path]["uuid"],
+                                  "version": 0}])
+        self.assertEqual(decode_record.call_count, 1)
+
+        with self.assertRaises(SystemExit), \
+                contextlib.redirect_stderr(io.StringIO()):
+            manifest_compiler.main(["--decode", path, "--fields", "versions"])
+
+    def test_malformed(self):
+        bad = os.path.join(self.root, "a", "bad.manifest")
+        with open(bad, "wb") as manifest_file:
+            manifest_file.write(b"\0" * 12)
+        ret, lines, stderr = self.decode(
+            self.root, os.path.join(self.root, "missing.manifest"))
+        self.assertEqual(ret, 1)
+        self.assertEqual(len(lines), len(self.expected))
+        self.assertIn(f"Error: {bad}: truncated at offset", stderr)
+        self.assertIn("missing.manifest", stderr)
+
+
+class TestCheck(unittest.TestCase):
+    """Test validating manifest configs without compiling them"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.root = self.temp_dir.name
+        self.consts = os.path.join(self.root, "consts.json")
+        with open(self.consts, "w", encoding="utf-8") as consts_file:
+            json.dump({"header": "consts.h", "constants": [
+                {"name": "HEAP_SIZE", "type": "int", "value": 8192,
+                 "unsigned": True}]}, consts_file)
+
+    def write_manifest(self, name, **manifest_dict):
+        path = os.path.join(self.root, "apps", name, "manifest.json")
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w", encoding="utf-8") as manifest_file:
+            json.dump(dict({"uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+                            "min_heap": "HEAP_SIZE", "min_stack": 4096},
+                           **manifest_dict), manifest_file)
+        return path
+
+    def check(self, *argv):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            ret = manifest_compiler.main(["--check"] + list(argv))
+        return ret, stderr.getvalue()
+
+    def list_files(self):
+        return sorted(os.path.join(dir_path, file_name)
+                      for dir_path, _, file_names in os.walk(self.root)
+                      for file_name in file_names)
+
+    def test_valid(self):
+        self.write_manifest("app0")
+        self.write_manifest("app1", min_shadow_stack=4096)
+        files = self.list_files()
+        with mock.patch.object(manifest_build, "read_json_config_file",
+                               wraps=manifest_build.read_json_config_file) \
+                as read_json_config_file:
+            self.assertEqual(self.check(os.path.join(self.root, "apps"),
+                                        "-c", self.consts), (0, ""))
+        # the constants file is read once for all manifests
+        self.assertEqual(read_json_config_file.call_count, 3)
+        self.assertEqual(self.list_files(), files)
+
+    def test_invalid(self):
+        self.write_manifest("app0")
+        app1 = self.write_manifest("app1", min_stack=100)
+        app2 = self.write_manifest("app2", min_shadow_stack=3)
+
+        ret, stderr = self.check(os.path.join(self.root, "apps", "*", "*"),
+                                 "-c", self.consts,
+                                 "--enable-shadow-call-stack")
+        self.assertEqual(ret, 1)
+        self.assertEqual(stderr.splitlines(), [
+            f"Error: {app1}: min_stack: 100, Minimum memory size should be a "
+            "non-negative multiple of 4096",
+            f"Error: {app2}: min_shadow_stack: 3, Minimum shadow stack size "
+            "should be a non-negative multiple of the native pointer size",
+            "Error: 2 of 3 manifests are invalid"])
+
+        # HEAP_SIZE is not defined without the constants file
+        ret, stderr = self.check(os.path.join(self.root, "apps", "app0"))
+        self.assertEqual(ret, 1)
+        self.assertIn("Error: 1 of 1 manifests are invalid", stderr)
+
+    def test_options(self):
+        for argv in (["-o", "out.manifest"], ["--header-dir", self.root],
+                     ["--cross-check", self.root]):
+            with self.assertRaises(SystemExit), \
+                    contextlib.redirect_stderr(io.StringIO()):
+                manifest_compiler.main(["--check", self.root] + argv)
+
+
+class TestCrossCheck(unittest.TestCase):
+    """Test finding UUIDs and start ports used by more than one manifest"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.root = self.temp_dir.name
+        self.consts = os.path.join(self.root, "consts.json")
+        with open(self.consts, "w", encoding="utf-8") as consts_file:
+            json.dump({"header": "consts.h", "constants": [
+                {"name": "APP0_UUID", "type": "uuid",
+                 "value": "5f902ace-5e5c-4cd8-ae54-87b88c22dda0"},
+                {"name": "SHARED_PORT", "type": "port",
+                 "value": "com.android.trusty.shared"}]}, consts_file)
+
+    def write_manifest(self, name, manifest_dict, compile_it=False):
+        path = os.path.join(self.root, name, "manifest.json")
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w", encoding="utf-8") as manifest_file:
+            json.dump(dict({"min_heap": 4096, "min_stack": 4096},
+                           **manifest_dict), manifest_file)
+        if compile_it:
+            output = os.path.join(self.root, name, name + ".manifest")
+            self.assertEqual(manifest_compiler.main(
+                ["-i", path, "-o", output, "-c", self.consts]), 0)
+            os.remove(path)
+            return output
+        return path
+
+    def port(self, name):
+        return {"name": name, "flags": {"allow_ta_connect": True,
+                                        "allow_ns_connect": False}}
+
+    def cross_check(self, *argv):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            ret = manifest_compiler.main(["--cross-check"] + list(argv))
+        return ret, stderr.getvalue()
+
+    def test_no_collisions(self):
+        self.write_manifest("app0", {"uuid": "APP0_UUID",
+                                     "start_ports": [self.port("SHARED_PORT")]})
+        self.write_manifest("app1", {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22dda1",
+            "start_ports": [self.port("com.android.trusty.app1")]})
+        self.assertEqual(self.cross_check(self.root, "-c", self.consts),
+                         (0, ""))
+
+    def test_collisions(self):
+        # the UUID and port constants of app0 collide with the literal values
+        # of app1, which is compiled
+        app0 = self.write_manifest("app0", {
+            "uuid": "APP0_UUID", "start_ports": [self.port("SHARED_PORT")]})
+        app1 = self.write_manifest("app1", {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22dda0",
+            "start_ports": [self.port("com.android.trusty.shared")]},
+                                   compile_it=True)
+        app2 = self.write_manifest("app2", {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22dda2",
+            "start_ports": [self.port("SHARED_PORT"),
+                            self.port("com.android.trusty.app2")]})
+
+        ret, stderr = self.cross_check(self.root, "-c", self.consts)
+        self.assertEqual(ret, 1)
+        self.assertEqual(stderr.splitlines(), [
+            "Error: UUID 5f902ace-5e5c-4cd8-ae54-87b88c22dda0 is used by 2 "
+            f"manifests: {app0}, {app1}",
+            "Error: start port com.android.trusty.shared is used by 3 "
+            f"manifests: {app0}, {app1}, {app2}"])
+
+    def test_invalid_manifests(self):
+        app0 = self.write_manifest("app0", {"uuid": "APP0_UUID"})
+        self.write_manifest("app1", {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22dda1"})
+        bad = os.path.join(self.root, "bad.manifest")
+        with open(bad, "wb") as manifest_file:
+            manifest_file.write(b"\0" * 8)
+
+        # without the constants file, APP0_UUID is not a valid UUID
+        ret, stderr = self.cross_check(self.root)
+        self.assertEqual(ret, 1)
+        self.assertIn(f"Error: {app0}: Invalid UUID APP0_UUID", stderr)
+        self.assertIn(f"Error: {bad}: truncated at offset 0", stderr)
+
+    def test_mem_maps(self):
+        def mem_map(id_, addr, size, **attributes):
+            return dict({"id": id_, "addr": hex(addr), "size": hex(size)},
+                        **attributes)
+
+        app0 = self.write_manifest("app0", {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22dda0",
+            "mem_map": [mem_map(1, 0x70000000, 0x1000, type="cached"),
+                        mem_map(2, 0x70001000, 0x1000),
+                        mem_map(2, 0x70010000, 0x100)]})
+        app1 = self.write_manifest("app1", {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22dda1",
+            "mem_map": [mem_map(1, 0x70000800, 0x1000,
+                                type="uncached_device"),
+                        mem_map(2, 0x70010080, 0x10, non_secure=True),
+                        mem_map(3, 0x80000000, 0x1000)]}, compile_it=True)
+        app2 = self.write_manifest("app2", {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22dda2",
+            "mem_map": [mem_map(1, 0x80000000, 0x1000)]})
+
+        self.assertEqual(self.cross_check(self.root), (0, ""))
+        ret, stderr = self.cross_check(self.root, "--mem-maps")
+        self.assertEqual(ret, 1)
+        self.assertEqual(stderr.splitlines(), [
+            f"Error: {app0}: duplicate mem_map id 2",
+            f"Error: {app0}: mem_map id 1 [0x70000000, 0x70001000) overlaps "
+            f"{app1}: mem_map id 1 [0x70000800, 0x70001800) with "
+            "conflicting cache types cached and uncached_device",
+            f"Error: {app1}: mem_map id 1 [0x70000800, 0x70001800) overlaps "
+            f"{app0}: mem_map id 2 [0x70001000, 0x70002000)",
+            f"Error: {app0}: mem_map id 2 [0x70010000, 0x70010100) overlaps "
+            f"{app1}: mem_map id 2 [0x70010080, 0x70010090) with "
+            "conflicting non_secure False and True",
+            f"Error: {app1}: mem_map id 3 [0x80000000, 0x80001000) overlaps "
+            f"{app2}: mem_map id 1 [0x80000000, 0x80001000)"])
+
+    def test_options(self):
+        with self.assertRaises(SystemExit), \
+                contextlib.redirect_stderr(io.StringIO()):
+            manifest_compiler.main(["--cross-check", self.root,
+                                    "-o", "out.manifest"])
+
+
+class TestOverlay(unittest.TestCase):
+    """Test manifest configs extending base manifest configs"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.base = self.path("common", "manifest.json")
+        write_json_file(self.base, {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+            "min_heap": 4096,
+            "min_stack": 4096,
+            "mem_map": [{"id": 1, "addr": "0x70000000", "size": "0x1000"},
+                        {"id": 2, "addr": "0x70010000", "size": "0x100"}],
+            "mgmt_flags": {"restart_on_exit": True},
+        })
+
+    def path(self, *parts):
+        return os.path.join(self.temp_dir.name, *parts)
+
+    def compile(self, manifest, *extra_args):
+        output = self.path("app.manifest")
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            ret = manifest_compiler.main(["-i", manifest, "-o", output] +
+                                         list(extra_args))
+        if ret:
+            return None, stderr.getvalue()
+        with open(output, "rb") as output_file:
+            return manifest_compiler.unpack_binary_manifest_to_data(
+                output_file.read()), stderr.getvalue()
+
+    def test_merge_manifest(self):
+        base = {"uuid": "APP_UUID", "min_heap": 4096,
+                "mem_map": [{"id": 1, "addr": "0x1000", "size": "0x1000"},
+                            {"id": 2, "addr": "0x2000", "size": "0x1000"}],
+                "start_ports": [{"name": "a", "flags": {}},
+                                {"name": "b", "flags": {}}],
+                "mgmt_flags": {"restart_on_exit": True}}
+        overlay = {"base": "manifest.json", "min_heap": 8192,
+                   "mem_map": [{"id": 2, "addr": "0x3000", "size": "0x10"},
+                               {"id": 3, "addr": "0x4000", "size": "0x10"}],
+                   "start_ports": [{"name": "c", "flags": {}}],
+                   "mgmt_flags": {"deferred_start": True}}
+        original = copy.deepcopy((base, overlay))
+
+        merged = manifest_overlay.merge_manifest(base, overlay)
+        self.assertEqual(merged, {
+            "uuid": "APP_UUID", "min_heap": 8192,
+            "mem_map": [{"id": 1, "addr": "0x1000", "size": "0x1000"},
+                        {"id": 2, "addr": "0x3000", "size": "0x10"},
+                        {"id": 3, "addr": "0x4000", "size": "0x10"}],
+            "start_ports": [{"name": "a", "flags": {}},
+                            {"name": "b", "flags": {}},
+                            {"name": "c", "flags": {}}],
+            "mgmt_flags": {"restart_on_exit": True, "deferred_start": True}})
+        self.assertEqual((base, overlay), original)
+
+    def test_compile_chain(self):
+        """Test compiling an overlay of an overlay, and its dependency file"""
+        variant = self.path("common", "manifest-scudo.json")
+        write_json_file(variant, {"base": "manifest.json", "min_heap": 16384})
+        manifest = self.path("app", "manifest.json")
+        write_json_file(manifest, {
+            "base": "../common/manifest-scudo.json",
+            "app_name": "app",
+            "mem_map": [{"id": 2, "addr": "0x70020000", "size": "0x1000",
+                         "type": "cached"}],
+            "mgmt_flags": {"non_critical_app": True},
+        })
+
+        unpacked, errors = self.compile(manifest, "-MD")
+        self.assertEqual(errors, "")
+        self.assertEqual(unpacked["min_heap"], 16384)
+        self.assertEqual(unpacked["app_name"], "app")
+        self.assertEqual([(mem_map["id"], mem_map["addr"], mem_map["type"])
+                          for mem_map in unpacked["mem_map"]],
+                         [(1, "0x70000000", "uncached_device"),
+                          (2, "0x70020000", "cached")])
+        self.assertEqual(unpacked["mgmt_flags"],
+                         {"restart_on_exit": True, "deferred_start": False,
+                          "non_critical_app": True})
+
+        with open(self.path("app.manifest.d"), "r",
+                  encoding="utf-8") as depfile:
+            self.assertEqual(depfile.read(),
+                             f"{self.path('app.manifest')}: {manifest} \\\n"
+                             f"  {variant} \\\n"
+                             f"  {self.base}\n"
+                             f"\n{variant}:\n"
+                             f"\n{self.base}:\n")
+
+    def test_invalid_bases(self):
+        manifest = self.path("app", "manifest.json")
+        cases = [
+            ("missing base", {"base": "missing.json"},
+             "unable to open base manifest config"),
+            ("invalid base", {"base": 1}, "Invalid value for base"),
+            ("cycle", {"base": "manifest-scudo.json"}, "form a cycle"),
+        ]
+        write_json_file(self.path("app", "manifest-scudo.json"),
+                        {"base": "manifest.json"})
+        for msg, manifest_dict, error in cases:
+            with self.subTest(msg):
+                write_json_file(manifest, manifest_dict)
+                unpacked, errors = self.compile(manifest)
+                self.assertIsNone(unpacked)
+                self.assertIn(error, errors)
+
+    def test_unknown_attributes_in_base(self):
+        write_json_file(self.base, {"uuid": TEST_UUID, "min_heap": 4096,
+                                    "min_stack": 4096, "unknown": 1})
+        manifest = self.path("app", "manifest.json")
+        write_json_file(manifest, {"base": "../common/manifest.json"})
+        _, errors = self.compile(manifest)
+        self.assertIn("Unknown attributes in manifest: {'unknown': 1}", errors)
+
+    def test_bases_are_shared(self):
+        """Test that a base is read once by the manifests of one cache, and
+        again once its content changes
+        """
+        manifests = []
+        for name in ("app0", "app1", "app2"):
+            manifests.append(self.path(name, "manifest.json"))
+            write_json_file(manifests[-1], {"base": "../common/manifest.json",
+                                            "app_name": name})
+        cache = manifest_compiler.CompilerCache()
+        log = manifest_compiler.Log()
+
+        def parse_all():
+            return [manifest_build.parse_manifest_file(
+                manifest, {}, False, 0, log, cache) for manifest in manifests]
+
+        with mock.patch.object(manifest_overlay, "parse_json_config",
+                               wraps=manifest_overlay.parse_json_config) \
+                as parse_json_config:
+            parsed = parse_all()
+            self.assertEqual(parse_json_config.call_count, 1)
+            self.assertEqual([manifest.app_name for manifest in parsed],
+                             ["app0", "app1", "app2"])
+
+            # rewriting the same content does not read the base again
+            with open(self.base, "rb") as base_file:
+                content = base_file.read()
+            with open(self.base, "wb") as base_file:
+                base_file.write(content)
+            parse_all()
+            self.assertEqual(parse_json_config.call_count, 1)
+
+            write_json_file(self.base, {
+                "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+                "min_heap": 8192, "min_stack": 4096})
+            parsed = parse_all()
+            self.assertEqual(parse_json_config.call_count, 2)
+            self.assertEqual([manifest.min_heap for manifest in parsed],
+                             [8192] * 3)
+        self.assertFalse(log.error_occurred())
+
+    def test_output_cache_key_includes_bases(self):
+        manifest = self.path("app", "manifest.json")
+        write_json_file(manifest, {"base": "../common/manifest.json"})
+        cache_args = ["--cache-dir", self.path("cache")]
+        unpacked, _ = self.compile(manifest, *cache_args)
+        self.assertEqual(unpacked["min_heap"], 4096)
+
+        write_json_file(self.base, {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+            "min_heap": 8192, "min_stack": 4096})
+        unpacked, _ = self.compile(manifest, *cache_args)
+        self.assertEqual(unpacked["min_heap"], 8192)
+
+    def test_cross_check_resolves_bases(self):
+        write_json_file(self.path("app", "manifest.json"),
+                        {"base": "../common/manifest.json"})
+        log = manifest_compiler.Log(out=io.StringIO())
+        index = manifest_compiler.cross_check_manifests(
+            [self.temp_dir.name], {}, log)
+        self.assertTrue(log.error_occurred())
+        self.assertEqual(list(index.uuids),
+                         ["5f902ace-5e5c-4cd8-ae54-87b88c22ddaf"])
+        self.assertEqual(index.count, 2)
+
+
+def read_elf_sections(data):
+    """Returns the (type, flags, alignment, content) of the sections of a
+    little-endian ELF file by name, and its class and machine
+    """
+    elf_class = data[4]
+    if elf_class == 2:
+        header, section_header = "<16sHHIQQQIHHHHHH", "<IIQQQQIIQQ"
+    else:
+        header, section_header = "<16sHHIIIIIHHHHHH", "<IIIIIIIIII"
+    (_, _, machine, _, _, _, section_offset, _, _, _, _, section_size,
+     section_count, names_index) = struct.unpack_from(header, data)
+    sections = [struct.unpack_from(section_header, data,
+                                   section_offset + index * section_size)
+                for index in range(section_count)]
+    names = sections[names_index]
+    sections_by_name = {}
+    for name, type_, flags, _, offset, size, _, _, alignment, _ in sections:
+        name_offset = names[4] + name
+        name = data[name_offset:data.index(b"\0", name_offset)].decode()
+        sections_by_name[name] = (type_, flags, alignment,
+                                  data[offset:offset + size])
+    return elf_class, machine, sections_by_name
+
+
+class TestEmitObject(unittest.TestCase):
+    """Test writing manifests as relocatable ELF objects"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.manifest = self.path("app", "manifest.json")
+        write_json_file(self.manifest, {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+            "min_heap": 4096, "min_stack": 4096,
+            "start_ports": [{"name": "com.android.trusty.port",
+                             "flags": {"allow_ta_connect": True,
+                                       "allow_ns_connect": False}}]})
+
+    def path(self, *parts):
+        return os.path.join(self.temp_dir.name, *parts)
+
+    def compile(self, *extra_args):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            ret = manifest_compiler.main(
+                ["-i", self.manifest, "-o", self.path("app.manifest")] +
+                list(extra_args))
+        return ret, stderr.getvalue()
+
+    def read(self, name):
+        with open(self.path(name), "rb") as read_file:
+            return read_file.read()
+
+    def test_objects(self):
+        machines = {"arm": (1, 40), "arm64": (2, 183), "x86_64": (2, 62)}
+        for arch in manifest_compiler.OBJECT_ARCHES:
+            with self.subTest(arch):
+                object_file = f"app-{arch}.o"
+                self.assertEqual(self.compile(
+                    "--emit-object", self.path(object_file), "--object-arch",
+                    arch), (0, ""))
+                data = self.read(object_file)
+                self.assertEqual(data[:4], b"\x7fELF")
+                elf_class, machine, sections = read_elf_sections(data)
+                self.assertEqual((elf_class, machine), machines[arch])
+                self.assertEqual(struct.unpack_from("<H", data, 16)[0], 1)
+
+                type_, flags, alignment, content = \
+                    sections[".trusty_app.manifest"]
+                self.assertEqual((type_, flags, alignment), (1, 0x2, 4))
+                self.assertEqual(content, self.read("app.manifest"))
+                self.assertIn(".note.GNU-stack", sections)
+
+    @unittest.skipIf(shutil.which("readelf") is None, "readelf not found")
+    def test_readelf(self):
+        for arch in manifest_compiler.OBJECT_ARCHES:
+            with self.subTest(arch):
+                object_file = self.path(f"app-{arch}.o")
+                self.assertEqual(self.compile(
+                    "--emit-object", object_file, "--object-arch", arch)[0],
+                                 0)
+                result = subprocess.run(
+                    ["readelf", "--wide", "--file-header", "--sections",
+                     "--symbols", "--hex-dump=.trusty_app.manifest",
+                     object_file],
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    check=True, universal_newlines=True)
+                self.assertEqual(result.stderr, "")
+                self.assertIn("REL (Relocatable file)", result.stdout)
+                section = [line for line in result.stdout.splitlines()
+                           if " .trusty_app.manifest " in line]
+                self.assertEqual(len(section), 1)
+                self.assertEqual(section[0].split()[-4:], ["A", "0", "0", "4"])
+                self.assertRegex(result.stdout,
+                                 r"SECTION +LOCAL +DEFAULT +1 ")
+                # the hex dump starts with the UUID in Trusty byte order
+                self.assertIn("ce2a905f 5c5ed84c ae5487b8 8c22ddaf",
+                              result.stdout)
+
+    def test_object_from_output_cache(self):
+        """Test that cache hits write the object too"""
+        cache_args = ["--cache-dir", self.path("cache"), "--emit-object",
+                      self.path("app.o"), "--object-arch", "arm64"]
+        self.assertEqual(self.compile(*cache_args), (0, ""))
+        compiled = self.read("app.o")
+        os.unlink(self.path("app.o"))
+        with mock.patch.object(manifest_schema, "parse_manifest_config",
+                               side_effect=AssertionError):
+            self.assertEqual(self.compile(*cache_args), (0, ""))
+        self.assertEqual(self.read("app.o"), compiled)
+
+    def test_invalid_options(self):
+        cases = [
+            ("missing arch", ["--emit-object", "app.o"]),
+            ("missing object", ["--object-arch", "arm64"]),
+            ("unknown arch", ["--emit-object", "app.o", "--object-arch",
+                              "riscv64"]),
+        ]
+        for msg, args in cases:
+            with self.subTest(msg), \
+                    contextlib.redirect_stderr(io.StringIO()), \
+                    self.assertRaises(SystemExit):
+                manifest_compiler.main(["-i", self.manifest, "-o",
+                                        self.path("app.manifest")] + args)
+        with contextlib.redirect_stderr(io.StringIO()), \
+                self.assertRaises(SystemExit):
+            manifest_compiler.main(["-i", self.manifest, "--emit-object",
+                                    "app.o", "--object-arch", "arm64"])
+
+
+class TestBatch(unittest.TestCase):
+    """Test compiling several manifests with --batch"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.consts = self.path("consts.json")
+        write_json_file(self.consts, {
+            "header": "test_consts.h",
+            "constants": [{"name": TEST_UUID,
+                           "value": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+                           "type": "uuid"}]
+        })
+        for app in ("app1", "app2"):
+            write_json_file(self.path(app, "manifest.json"), {
+                "uuid": TEST_UUID,
+                "min_heap": 4096,
+                "min_stack": 4096
+            })
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir.name, *parts)
+
+    def read_output(self, name):
+        with open(self.path(name), "rb") as output_file:
+            return output_file.read()
+
+    def write_batch_file(self, lines):
+        batch_file = self.path("manifests.rsp")
+        with open(batch_file, "w", encoding="utf-8") as out_file:
+            out_file.write("\n".join(lines) + "\n")
+        return batch_file
+
+    def test_batch_matches_single_compiles(self):
+        """Test that a batch produces the same binaries as separate runs"""
+        batch_file = self.write_batch_file([
+            "# comment lines and blank lines are ignored",
+            "",
+            f"-i {self.path('app1', 'manifest.json')} -o {self.path('b1')}",
+            f"-i {self.path('app2', 'manifest.json')} -o {self.path('b2')} "
+            "--enable-shadow-call-stack",
+        ])
+        ret = manifest_compiler.main(["--batch", batch_file,
+                                      "-c", self.consts,
+                                      "--header-dir", self.path("include")])
+        self.assertEqual(ret, 0)
+
+        for app, output, extra_args in (
+                ("app1", "s1", []),
+                ("app2", "s2", ["--enable-shadow-call-stack"])):
+            ret = manifest_compiler.main(
+                ["-i", self.path(app, "manifest.json"), "-o", self.path(output),
+                 "-c", self.consts, "--header-dir", self.path("include")] +
+                extra_args)
+            self.assertEqual(ret, 0)
+
+        self.assertEqual(self.read_output("b1"), self.read_output("s1"))
+        self.assertEqual(self.read_output("b2"), self.read_output("s2"))
+        self.assertNotEqual(self.read_output("b1"), self.read_output("b2"))
+        self.assertTrue(os.path.exists(self.path("include", "test_consts.h")))
+
+    def test_batch_reads_constants_once(self):
+        """Test that constants files are shared between batch entries"""
+        batch_file = self.write_batch_file([
+            f"-i {self.path('app1', 'manifest.json')} -o {self.path('b1')} "
+            f"-c {self.consts} --header-dir {self.path('include')}",
+            f"-i {self.path('app2', 'manifest.json')} -o {self.path('b2')} "
+            f"-c {self.consts} --header-dir {self.path('include')}",
+        ])
+        with mock.patch.object(manifest_build, "read_json_config_file",
+                               wraps=manifest_build.read_json_config_file
+                               ) as read_json:
+            ret = manifest_compiler.main(["--batch", batch_file])
+        self.assertEqual(ret, 0)
+        read_files = [call.args[0] for call in read_json.call_args_list]
+        self.assertEqual(read_files.count(self.consts), 1)
+
+    def test_batch_reports_failures_per_entry(self):
+        """Test that a failing entry does not stop the other entries"""
+        batch_file = self.write_batch_file([
+            f"-i {self.path('missing', 'manifest.json')} -o {self.path('b1')}",
+            f"-o {self.path('b3')}",
+            f"-i {self.path('app2', 'manifest.json')} -o {self.path('b2')}",
+        ])
+        failures = manifest_compiler.compile_batch(
+            batch_file, argparse.Namespace(
+                constants=[self.consts], header_dir=self.path("include")))
+        self.assertEqual(failures, 2)
+        self.assertFalse(os.path.exists(self.path("b1")))
+        self.assertFalse(os.path.exists(self.path("b3")))
+        self.assertTrue(os.path.exists(self.path("b2")))
+
+    def test_batch_reports_invalid_quoting_per_entry(self):
+        """Test that a line with invalid quoting only fails its own entry"""
+        batch_file = self.write_batch_file([
+            f"-i {self.path('app1', 'manifest.json')} -o {self.path('b1')}",
+            f"-i '{self.path('app2', 'manifest.json')} -o {self.path('b3')}",
+            f"-i {self.path('app2', 'manifest.json')} -o {self.path('b2')}",
+        ])
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            failures = manifest_compiler.compile_batch(
+                batch_file, argparse.Namespace(
+                    constants=[self.consts], header_dir=self.path("include")))
+        self.assertEqual(failures, 1)
+        self.assertIn(f"{batch_file}:2: No closing quotation",
+                      stderr.getvalue())
+        self.assertIn("1 of 3 entries failed", stderr.getvalue())
+        self.assertTrue(os.path.exists(self.path("b1")))
+        self.assertFalse(os.path.exists(self.path("b3")))
+        self.assertTrue(os.path.exists(self.path("b2")))
+
+    def test_parallel_batch_matches_serial_batch(self):
+        """Test that worker processes produce the same binaries"""
+        for jobs, prefix in ((1, "s"), (2, "p")):
+            batch_file = self.write_batch_file([
+                f"-i {self.path(app, 'manifest.json')} "
+                f"-o {self.path(prefix + str(i))}"
+                for i, app in enumerate(("app1", "app2") * 4)
+            ])
+            ret = manifest_compiler.main(["--batch", batch_file, "-j",
+                                          str(jobs), "-c", self.consts,
+                                          "--header-dir", self.path("include")])
+            self.assertEqual(ret, 0)
+
+        for i in range(8):
+            self.assertEqual(self.read_output(f"s{i}"),
+                             self.read_output(f"p{i}"))
+
+    def test_parallel_batch_reports_errors_in_order(self):
+        """Test that diagnostics of workers are printed in batch file order"""
+        batch_file = self.write_batch_file([
+            f"-i {self.path('missing' + str(i), 'manifest.json')} "
+            f"-o {self.path('b' + str(i))}"
+            if i % 3 == 0 else
+            f"-i {self.path('app1', 'manifest.json')} "
+            f"-o {self.path('b' + str(i))}"
+            for i in range(12)
+        ])
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            failures = manifest_compiler.compile_batch(
+                batch_file, argparse.Namespace(constants=[self.consts],
+                                               header_dir=None), jobs=3)
+        self.assertEqual(failures, 4)
+        missing = [line.split("missing")[1][0]
+                   for line in stderr.getvalue().splitlines()
+                   if "missing" in line]
+        self.assertEqual(missing, ["0", "3", "6", "9"])
+
+
+class TestCompilerCache(unittest.TestCase):
+    """Test reusing parsed files between compiles"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.consts = os.path.join(self.tmp_dir.name, "consts.json")
+
+    def write_consts(self, value):
+        write_json_file(self.consts, {
+            "header": "test_consts.h",
+            "constants": [{"name": TEST_SIZE, "value": value, "type": "int",
+                           "unsigned": True}]
+        })
+
+    def test_cache_reparses_modified_files(self):
+        """Test that a changed file is parsed again"""
+        cache = manifest_compiler.CompilerCache()
+        log = manifest_compiler.Log()
+        self.write_consts(4096)
+        first = cache.get_config_constants(self.consts, log)
+        self.assertIs(cache.get_config_constants(self.consts, log), first)
+        self.write_consts(8192000)
+        second = cache.get_config_constants(self.consts, log)
+        self.assertFalse(log.error_occurred())
+        self.assertIsNot(second, first)
+        self.assertEqual(second.constants[0].value, 8192000)
+
+    def test_cache_manifest_variants(self):
+        """Test compiling one cached manifest into several variants"""
+        cache = manifest_compiler.CompilerCache()
+        log = manifest_compiler.Log()
+        manifest_file = os.path.join(self.tmp_dir.name, "manifest.json")
+        config_data = {"uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+                       "min_heap": 4096, "min_stack": 4096,
+                       "mem_map": [{"id": 1, "addr": "0x70000000",
+                                    "size": "0x1000"}],
+                       "start_ports": [{"name": "com.android.trusty.port",
+                                        "flags": {"allow_ta_connect": True,
+                                                  "allow_ns_connect": False}}]}
+        write_json_file(manifest_file, config_data)
+
+        manifests = [
+            manifest_build.parse_manifest_file(manifest_file, {},
+                                               shadow_call_stack, size, log,
+                                               cache)
+            for shadow_call_stack, size in ((True, 4096), (True, 8192),
+                                            (False, 4096))]
+        self.assertFalse(log.error_occurred())
+        self.assertEqual([manifest.min_shadow_stack for manifest in manifests],
+                         [4096, 8192, 0])
+        self.assertEqual(manifests[0].mem_io_maps, manifests[2].mem_io_maps)
+        self.assertEqual(manifests[0].start_ports, manifests[2].start_ports)
+
+        # the parsed JSON is shared and left as it was read
+        manifest_dict = cache.read_manifest(manifest_file, log)
+        self.assertIs(cache.read_manifest(manifest_file, log), manifest_dict)
+        self.assertEqual(manifest_dict, config_data)
+
+
+class TestServer(unittest.TestCase):
+    """Test compiling manifests through manifest_compiler_server.py"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.socket_path = os.path.join(self.tmp_dir.name, "compiler.sock")
+        self.server = manifest_compiler_server.CompileServer(self.socket_path)
+        self.server.timeout = 0.05
+        self.stop = False
+        thread = threading.Thread(target=self.serve)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(setattr, self, "stop", True)
+
+        self.manifest = os.path.join(self.tmp_dir.name, "app", "manifest.json")
+        write_json_file(self.manifest, {"uuid": TEST_UUID, "min_heap": 4096,
+                                        "min_stack": 4096})
+        self.consts = os.path.join(self.tmp_dir.name, "consts.json")
+
+    def serve(self):
+        with self.server:
+            while not self.stop:
+                self.server.handle_request()
+
+    def write_consts(self, uuid):
+        write_json_file(self.consts, {
+            "header": "test_consts.h",
+            "constants": [{"name": TEST_UUID, "value": uuid, "type": "uuid"}]
+        })
+
+    def compile(self, output):
+        return manifest_compiler_client.run_on_server(
+            self.socket_path,
+            ["-i", self.manifest, "-o", output, "-c", self.consts,
+             "--header-dir", os.path.join(self.tmp_dir.name, "include")])
+
+    def test_server_matches_local_compile(self):
+        """Test that the server output matches a local compile and that
+        modified constants are picked up
+        """
+        server_output = os.path.join(self.tmp_dir.name, "server.manifest")
+        local_output = os.path.join(self.tmp_dir.name, "local.manifest")
+        for uuid in ("5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+                     "01234567-89ab-cdef-0123-456789abcdef"):
+            self.write_consts(uuid)
+            # make sure that the modification time changes
+            time.sleep(0.01)
+            response = self.compile(server_output)
+            self.assertEqual(response["status"], 0, response["stderr"])
+            self.assertEqual(manifest_compiler.main(
+                ["-i", self.manifest, "-o", local_output, "-c", self.consts,
+                 "--header-dir", os.path.join(self.tmp_dir.name, "include")]),
+                0)
+            with open(server_output, "rb") as server_file, \
+                    open(local_output, "rb") as local_file:
+                self.assertEqual(server_file.read(), local_file.read())
+
+    def test_server_reports_errors(self):
+        """Test that errors and exit codes are forwarded"""
+        response = manifest_compiler_client.run_on_server(
+            self.socket_path, ["-i", self.manifest])
+        self.assertEqual(response["status"], 2)
+        self.assertIn("no manifest output file", response["stderr"])
+
+        self.write_consts("5f902ace-5e5c-4cd8-ae54-87b88c22ddaf")
+        write_json_file(self.manifest, {"min_heap": 4096, "min_stack": 4096})
+        response = self.compile(os.path.join(self.tmp_dir.name, "x.manifest"))
+        self.assertEqual(response["status"], 1)
+        self.assertIn("missing required attribute - uuid", response["stderr"])
+
+    def send_request(self, request):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(request).encode())
+            sock.shutdown(socket.SHUT_WR)
+            with sock.makefile("rb") as response:
+                return json.loads(response.read().decode())
+
+    def test_server_uses_client_environment(self):
+        """Test that requests use the environment of the client instead of
+        the environment of the server
+        """
+        self.write_consts("5f902ace-5e5c-4cd8-ae54-87b88c22ddaf")
+        cache_dirs = [os.path.join(self.tmp_dir.name, name)
+                      for name in ("client_cache", "server_cache")]
+        argv = ["-i", self.manifest, "-o",
+                os.path.join(self.tmp_dir.name, "app.manifest"), "-c",
+                self.consts, "--header-dir",
+                os.path.join(self.tmp_dir.name, "include")]
+        self.assertIn(manifest_compiler.CACHE_DIR_ENV,
+                      manifest_compiler_client.FORWARDED_ENV)
+        with mock.patch.dict(os.environ, {
+                manifest_compiler.CACHE_DIR_ENV: cache_dirs[1]}):
+            for env in ({manifest_compiler.CACHE_DIR_ENV: cache_dirs[0]},
+                        {manifest_compiler.CACHE_DIR_ENV: None}):
+                response = self.send_request(
+                    {"argv": argv, "cwd": self.tmp_dir.name, "env": env})
+                self.assertEqual(response["status"], 0, response["stderr"])
+                self.assertEqual(os.environ[manifest_compiler.CACHE_DIR_ENV],
+                                 cache_dirs[1])
+        self.assertTrue(os.path.isdir(cache_dirs[0]))
+        self.assertFalse(os.path.exists(cache_dirs[1]))
+
+        response = self.send_request({"argv": argv,
+                                      "cwd": self.tmp_dir.name})
+        self.assertEqual(response["status"], 2)
+        self.assertIn("invalid request", response["stderr"])
+
+    def test_server_uses_client_directory(self):
+        """Test that relative paths are relative to the working directory of
+        the client, without changing the one of the server
+        """
+        self.write_consts("5f902ace-5e5c-4cd8-ae54-87b88c22ddaf")
+        cwd = os.getcwd()
+        response = self.send_request(
+            {"argv": ["-i", "app/manifest.json", "-o", "app.manifest",
+                      "-c", "consts.json", "--header-dir", "include",
+                      "--stamp", "app.stamp", "-MD"],
+             "cwd": self.tmp_dir.name,
+             "env": {manifest_compiler.CACHE_DIR_ENV: None}})
+        self.assertEqual(response["status"], 0, response["stderr"])
+        self.assertEqual(os.getcwd(), cwd)
+        for name in ("app.manifest", "app.stamp", "include/test_consts.h"):
+            self.assertTrue(
+                os.path.exists(os.path.join(self.tmp_dir.name, name)), name)
+        with open(os.path.join(self.tmp_dir.name, "app.stamp.d"), "r",
+                  encoding="utf-8") as depfile:
+            self.assertEqual(depfile.read(),
+                             "app.stamp: app/manifest.json \\\n"
+                             "  consts.json\n\nconsts.json:\n")
+
+    def test_server_runs_requests_concurrently(self):
+        """Test that a request does not wait for another one to complete and
+        that the server is not idle while a request is being compiled
+        """
+        started = threading.Event()
+        release = threading.Event()
+        compile_main = manifest_compiler.main
+
+        def main(argv, *args):
+            if argv == ["--block"]:
+                started.set()
+                release.wait(10)
+                return 0
+            return compile_main(argv, *args)
+
+        responses = []
+        with mock.patch.object(manifest_compiler, "main", main):
+            thread = threading.Thread(target=lambda: responses.append(
+                manifest_compiler_client.run_on_server(self.socket_path,
+                                                       ["--block"])))
+            thread.start()
+            try:
+                self.assertTrue(started.wait(10))
+                self.write_consts("5f902ace-5e5c-4cd8-ae54-87b88c22ddaf")
+                response = self.compile(
+                    os.path.join(self.tmp_dir.name, "app.manifest"))
+                self.assertFalse(release.is_set())
+                self.assertEqual(response["status"], 0, response["stderr"])
+                self.server.handle_timeout()
+                self.assertFalse(self.server.idle)
+            finally:
+                release.set()
+                thread.join()
+        self.assertEqual(responses[0]["status"], 0)
+
+        deadline = time.monotonic() + 10
+        while self.server.active_requests and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.server.handle_timeout()
+        self.assertTrue(self.server.idle)
+
+    def test_server_declines_worker_pools(self):
+        """Test that the client runs --batch and --decode itself"""
+        for argv in (["--batch", "entries.rsp", "-j", "2"],
+                     ["--deco", self.tmp_dir.name], ["--batch"]):
+            with self.subTest(argv=argv):
+                self.assertIn(
+                    "declined",
+                    self.send_request(
+                        {"argv": argv, "cwd": self.tmp_dir.name,
+                         "env": {manifest_compiler.CACHE_DIR_ENV: None}}))
+                self.assertIsNone(manifest_compiler_client.run_on_server(
+                    self.socket_path, argv))
+        self.assertIsNone(manifest_compiler_server.declined_option(
+            ["-i", self.manifest, "-o", "app.manifest",
+             "--enable-shadow-call-stack"]))
+
+    def test_client_without_server(self):
+        """Test that the client runs the compiler itself without a server"""
+        output = os.path.join(self.tmp_dir.name, "client.manifest")
+        env = dict(os.environ)
+        env[manifest_compiler_client.SOCKET_ENV] = os.path.join(
+            self.tmp_dir.name, "missing.sock")
+        result = subprocess.run(
+            [sys.executable, manifest_compiler_client.__file__,
+             "-i", self.manifest, "-o", output],
+            env=env, check=False)
+        self.assertEqual(result.returncode, 1)
+        write_json_file(self.manifest, {
+            "uuid": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf", "min_heap": 4096,
+            "min_stack": 4096})
+        result = subprocess.run(
+            [sys.executable, manifest_compiler_client.__file__,
+             "-i", self.manifest, "-o", output],
+            env=env, check=False)
+        self.assertEqual(result.returncode, 0)
+        self.assertTrue(os.path.exists(output))
+
+
+class TestOutputCache(unittest.TestCase):
+    """Test the content-addressed output cache"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.cache_dir = self.path("cache")
+        self.consts = self.path("consts.json")
+        self.write_consts("5f902ace-5e5c-4cd8-ae54-87b88c22ddaf")
+        self.manifest = self.path("app", "manifest.json")
+        write_json_file(self.manifest, {"uuid": TEST_UUID, "min_heap": 4096,
+                                        "min_stack": 4096})
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir.name, *parts)
+
+    def write_consts(self, uuid):
+        write_json_file(self.consts, {
+            "header": "sub/test_consts.h",
+            "constants": [{"name": TEST_UUID, "value": uuid, "type": "uuid"}]
+        })
+
+    def compile(self, build_dir, *extra_args):
+        return manifest_compiler.main(
+            ["-i", self.manifest, "-o", os.path.join(build_dir, "app.manifest"),
+             "-c", self.consts, "--header-dir",
+             os.path.join(build_dir, "include"), "--cache-dir",
+             self.cache_dir] + list(extra_args))
+
+    def read_outputs(self, build_dir):
+        outputs = []
+        for name in ("app.manifest", "include/sub/test_consts.h"):
+            with open(os.path.join(build_dir, name), "rb") as output_file:
+                outputs.append(output_file.read())
+        return outputs
+
+    def test_cache_hit_skips_compile(self):
+        """Test that a second build takes its outputs from the cache"""
+        self.assertEqual(self.compile(self.path("build1")), 0)
+        with mock.patch.object(manifest_schema, "parse_manifest_config",
+                               side_effect=AssertionError), \
+                mock.patch.object(manifest_headers,
+                                  "write_consts_to_header_file",
+                                  side_effect=AssertionError):
+            self.assertEqual(self.compile(self.path("build2")), 0)
+        self.assertEqual(self.read_outputs(self.path("build1")),
+                         self.read_outputs(self.path("build2")))
+
+    def test_cache_key_covers_inputs(self):
+        """Test that changed constants and options miss the cache"""
+        self.assertEqual(self.compile(self.path("build1")), 0)
+        self.assertEqual(
+            self.compile(self.path("build2"), "--enable-shadow-call-stack"), 0)
+        self.write_consts("01234567-89ab-cdef-0123-456789abcdef")
+        self.assertEqual(self.compile(self.path("build3")), 0)
+        outputs = [self.read_outputs(self.path(build_dir))
+                   for build_dir in ("build1", "build2", "build3")]
+        self.assertNotEqual(outputs[0][0], outputs[1][0])
+        self.assertEqual(outputs[0][1], outputs[1][1])
+        self.assertNotEqual(outputs[0][0], outputs[2][0])
+        self.assertNotEqual(outputs[0][1], outputs[2][1])
+
+    def test_cache_evicts_least_recently_used(self):
+        """Test that a full shard evicts its least recently used entries"""
+        output = self.path("output")
+        with open(output, "wb") as output_file:
+            output_file.write(b"x" * 100)
+        cache = manifest_cache.OutputCache(
+            self.cache_dir, max_size=280 * manifest_cache.SHARD_COUNT)
+        keys = ["aa" + str(index) * 62 for index in range(3)]
+        cache.store(keys[0], output, None, [])
+        cache.store(keys[1], output, None, [])
+        os.utime(cache.entry_dir(keys[0]), ns=(0, 0))
+        os.utime(cache.entry_dir(keys[1]), ns=(0, 1))
+        self.assertIsNotNone(cache.fetch(keys[0], self.path("fetched"), None))
+        cache.store(keys[2], output, None, [])
+        self.assertTrue(os.path.exists(cache.entry_dir(keys[0])))
+        self.assertFalse(os.path.exists(cache.entry_dir(keys[1])))
+        self.assertTrue(os.path.exists(cache.entry_dir(keys[2])))
+        self.assertEqual(os.listdir(cache.tmp_dir), [])
+
+    def store_entries(self, cache, count, size=100):
+        output = self.path("output")
+        with open(output, "wb") as output_file:
+            output_file.write(b"x" * size)
+        keys = ["aa" + f"{index:062d}" for index in range(count)]
+        for key in keys:
+            cache.store(key, output, None, [])
+        return keys
+
+    def test_cache_scans_full_shards_only(self):
+        """Test that stores only scan a shard once it is estimated full"""
+        cache = manifest_cache.OutputCache(
+            self.cache_dir, max_size=1000 * manifest_cache.SHARD_COUNT)
+        with mock.patch.object(manifest_cache, "entry_size",
+                               wraps=manifest_cache.entry_size) as \
+                entry_size:
+            keys = self.store_entries(cache, 12)
+        # every store measures its own entry; the shard is scanned by the
+        # first store, which finds no usage file, and the eleventh, which
+        # fills it and trims it to 700 bytes
+        self.assertEqual(entry_size.call_count, 12 + 1 + 11)
+        self.assertEqual(
+            [os.path.exists(cache.entry_dir(key)) for key in keys],
+            [False] * 4 + [True] * 8)
+        with open(os.path.join(self.cache_dir, "aa", "usage"), "rb") as \
+                usage_file:
+            self.assertEqual(usage_file.read(), b"700\n100\n")
+
+    def test_cache_keeps_stored_entry(self):
+        """Test that a size limit below one entry still caches it"""
+        cache = manifest_cache.OutputCache(self.cache_dir, max_size=1)
+        keys = self.store_entries(cache, 2)
+        self.assertFalse(os.path.exists(cache.entry_dir(keys[0])))
+        self.assertIsNotNone(cache.fetch(keys[1], self.path("fetched"), None))
+
+    def test_cache_removes_stale_tmp(self):
+        """Test that scans remove what killed compilers left in tmp/"""
+        cache = manifest_cache.OutputCache(self.cache_dir)
+        stale = os.path.join(cache.tmp_dir, "stale")
+        fresh = os.path.join(cache.tmp_dir, "fresh")
+        for path in (stale, fresh):
+            os.makedirs(os.path.join(path, "headers"))
+        stale_time = time.time() - manifest_cache.STALE_TMP_AGE - 1
+        os.utime(stale, (stale_time, stale_time))
+        self.store_entries(cache, 1)
+        self.assertEqual(os.listdir(cache.tmp_dir), ["fresh"])
+
+
+class TestWriteIfChanged(unittest.TestCase):
+    """Test that unchanged outputs are left untouched"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.consts = os.path.join(self.tmp_dir.name, "consts.json")
+        self.manifest = os.path.join(self.tmp_dir.name, "app", "manifest.json")
+        self.output = os.path.join(self.tmp_dir.name, "app.manifest")
+        self.header = os.path.join(self.tmp_dir.name, "include",
+                                   "test_consts.h")
+        self.stamp = os.path.join(self.tmp_dir.name, "app.stamp")
+        write_json_file(self.manifest, {"uuid": TEST_UUID, "min_heap": 4096,
+                                        "min_stack": 4096})
+
+    def compile(self, uuid):
+        write_json_file(self.consts, {
+            "header": "test_consts.h",
+            "constants": [{"name": TEST_UUID, "value": uuid, "type": "uuid"}]
+        })
+        self.assertEqual(manifest_compiler.main(
+            ["-i", self.manifest, "-o", self.output, "-c", self.consts,
+             "--header-dir", os.path.dirname(self.header),
+             "--stamp", self.stamp]), 0)
+
+    def reset_mtimes(self):
+        for output in (self.output, self.header, self.stamp):
+            os.utime(output, ns=(0, 0))
+
+    def mtimes(self):
+        return [os.stat(output).st_mtime_ns
+                for output in (self.output, self.header, self.stamp)]
+
+    def test_unchanged_outputs_keep_mtime(self):
+        """Test that only the stamp file is touched if nothing changed"""
+        self.compile("5f902ace-5e5c-4cd8-ae54-87b88c22ddaf")
+        self.reset_mtimes()
+        self.compile("5f902ace-5e5c-4cd8-ae54-87b88c22ddaf")
+        output_mtime, header_mtime, stamp_mtime = self.mtimes()
+        self.assertEqual(output_mtime, 0)
+        self.assertEqual(header_mtime, 0)
+        self.assertNotEqual(stamp_mtime, 0)
+
+    def test_changed_outputs_are_replaced(self):
+        """Test that changed outputs are rewritten without leftovers"""
+        self.compile("5f902ace-5e5c-4cd8-ae54-87b88c22ddaf")
+        self.reset_mtimes()
+        self.compile("01234567-89ab-cdef-0123-456789abcdef")
+        self.assertNotIn(0, self.mtimes())
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)),
+                         ["app", "app.manifest", "app.stamp", "consts.json",
+                          "include"])
+        self.assertEqual(os.listdir(os.path.dirname(self.header)),
+                         ["test_consts.h"])
+
+class TestDepfile(unittest.TestCase):
+    """Test make dependency files"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.uuid_consts = self.path("uuid_consts.json")
+        write_json_file(self.uuid_consts, {
+            "header": "uuid_consts.h",
+            "constants": [{"name": TEST_UUID,
+                           "value": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+                           "type": "uuid"}]
+        })
+        self.size_consts = self.path("size consts.json")
+        write_json_file(self.size_consts, {
+            "header": "size_consts.h",
+            "constants": [{"name": TEST_SIZE, "value": 8192, "type": "int",
+                           "unsigned": True}]
+        })
+        self.manifest = self.path("app", "manifest.json")
+        self.output = self.path("app.manifest")
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir.name, *parts)
+
+    def compile(self, manifest_dict, *extra_args):
+        write_json_file(self.manifest, manifest_dict)
+        self.assertEqual(manifest_compiler.main(
+            ["-i", self.manifest, "-o", self.output,
+             "-c", self.uuid_consts, "-c", self.size_consts,
+             "--stamp", self.path("app.stamp"), "-MD"] + list(extra_args)), 0)
+        with open(self.path("app.stamp.d"), "r", encoding="utf-8") as depfile:
+            return depfile.read()
+
+    def escape(self, path):
+        return path.replace(" ", "\\ ")
+
+    def test_depfile_lists_used_constants(self):
+        """Test that only constants files with used constants are listed"""
+        depfile = self.compile({"uuid": TEST_UUID, "min_heap": 4096,
+                                "min_stack": 4096})
+        self.assertEqual(depfile,
+                         f"{self.path('app.stamp')}: {self.manifest} \\\n"
+                         f"  {self.uuid_consts}\n"
+                         f"\n{self.uuid_consts}:\n")
+
+        depfile = self.compile({"uuid": TEST_UUID, "min_heap": TEST_SIZE,
+                                "min_stack": 4096})
+        self.assertIn(self.escape(self.size_consts), depfile)
+
+    def test_depfile_lists_all_constants_on_missed_names(self):
+        """Test that all constants files are listed if the manifest uses a
+        name which is not defined by any constants file
+        """
+        write_json_file(self.manifest, {"uuid": TEST_UUID, "min_heap": 4096,
+                                        "min_stack": "UNDEFINED_SIZE"})
+        log = manifest_compiler.Log()
+        cache = manifest_compiler.CompilerCache()
+        config_constants = cache.process_config_constants(
+            [self.uuid_consts, self.size_consts], None, log)
+        constants = manifest_compiler.TrackedConstants(
+            manifest_compiler.index_constants(config_constants))
+        manifest_compiler.compile_manifest(self.manifest, self.output,
+                                           constants, False, 4096, log)
+        self.assertTrue(log.error_occurred())
+        self.assertEqual(
+            constants.used_files([self.uuid_consts, self.size_consts]),
+            [self.uuid_consts, self.size_consts])
+
+    def test_depfile_from_output_cache(self):
+        """Test that cache hits write the same dependency file"""
+        manifest_dict = {"uuid": TEST_UUID, "min_heap": 4096,
+                         "min_stack": 4096}
+        cache_args = ["--cache-dir", self.path("cache")]
+        compiled = self.compile(manifest_dict, *cache_args)
+        os.unlink(self.path("app.stamp.d"))
+        with mock.patch.object(manifest_schema, "parse_manifest_config",
+                               side_effect=AssertionError):
+            self.assertEqual(self.compile(manifest_dict, *cache_args),
+                             compiled)
+
+
+class TestJobserver(unittest.TestCase):
+    """Test sharing the job slots of make with batch workers"""
+
+    def setUp(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        self.jobserver = make_jobserver.Jobserver(read_fd, write_fd)
+
+    def test_parse_makeflags(self):
+        self.assertEqual(
+            make_jobserver.parse_makeflags(" -j8 --jobserver-auth=3,4"),
+            ("pipe", 3, 4))
+        self.assertEqual(
+            make_jobserver.parse_makeflags("k -j --jobserver-fds=5,6"),
+            ("pipe", 5, 6))
+        self.assertEqual(
+            make_jobserver.parse_makeflags(
+                "-j4 --jobserver-auth=fifo:/tmp/GMfifo1"),
+            ("fifo", "/tmp/GMfifo1"))
+        self.assertIsNone(make_jobserver.parse_makeflags("k"))
+        self.assertIsNone(
+            make_jobserver.parse_makeflags("--jobserver-auth=-2,-2"))
+        self.assertIsNone(make_jobserver.parse_makeflags(
+            "k -- V=--jobserver-auth=3,4"))
+
+    def test_from_environ(self):
+        self.assertIsNone(make_jobserver.Jobserver.from_environ({}))
+        jobserver = make_jobserver.Jobserver.from_environ({
+            "MAKEFLAGS": f"--jobserver-auth={self.jobserver.read_fd},"
+                         f"{self.jobserver.write_fd}"})
+        self.assertEqual(jobserver.write_fd, self.jobserver.write_fd)
+        jobserver.release(b"+")
+        self.assertEqual(jobserver.acquire(threading.Event()), b"+")
+        jobserver.close()
+        # the inherited descriptors are left open
+        self.assertTrue(make_jobserver.fd_is_open(self.jobserver.read_fd))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fifo = os.path.join(tmp_dir, "fifo")
+            os.mkfifo(fifo)
+            jobserver = make_jobserver.Jobserver.from_environ(
+                {"MAKEFLAGS": f"-j2 --jobserver-auth=fifo:{fifo}"})
+            jobserver.release(b"+")
+            self.assertEqual(jobserver.acquire(threading.Event()), b"+")
+            jobserver.close()
+
+    def test_acquire_stops_when_asked(self):
+        stop = threading.Event()
+        stop.set()
+        self.assertIsNone(self.jobserver.acquire(stop))
+
+    def test_acquire_stolen_token(self):
+        """Test waiting on when another client takes the token first"""
+        makeflags = (f"--jobserver-auth={self.jobserver.read_fd},"
+                     f"{self.jobserver.write_fd}")
+        jobservers = [self.jobserver]
+        private = make_jobserver.Jobserver.from_environ(
+            {"MAKEFLAGS": makeflags})
+        self.addCleanup(private.close)
+        self.assertNotEqual(private.read_fd, self.jobserver.read_fd)
+        jobservers.append(private)
+
+        for jobserver in jobservers:
+            with self.subTest(read_fd=jobserver.read_fd):
+                os.write(self.jobserver.write_fd, b"+")
+                stop = threading.Event()
+                real_select = select.select
+
+                def steal_token(*args):
+                    """Reports the token, then takes it like another client
+                    before it can be read
+                    """
+                    result = real_select(*args)
+                    if result[0]:
+                        os.read(self.jobserver.read_fd, 1)
+                    else:
+                        stop.set()
+                    return result
+
+                tokens = []
+                with mock.patch.object(make_jobserver.select, "select",
+                                       side_effect=steal_token):
+                    thread = threading.Thread(
+                        target=lambda: tokens.append(jobserver.acquire(stop)),
+                        daemon=True)
+                    thread.start()
+                    thread.join(5)
+                    stop.set()
+                    if thread.is_alive():
+                        # unblock the read
+                        os.write(self.jobserver.write_fd, b"+")
+                        thread.join()
+                self.assertEqual(tokens, [None])
+                # the inherited descriptor is still blocking for make
+                self.assertFalse(
+                    fcntl.fcntl(self.jobserver.read_fd, fcntl.F_GETFL) &
+                    os.O_NONBLOCK)
+
+    def test_batch_jobs(self):
+        self.assertEqual(manifest_compiler.batch_jobs(3, None, {}), 3)
+        self.assertEqual(manifest_compiler.batch_jobs(
+            None, None, {"MAKEFLAGS": "k"}), 1)
+        self.assertEqual(manifest_compiler.batch_jobs(
+            None, self.jobserver, {"MAKEFLAGS": "k"}),
+                         manifest_compiler.default_jobs())
+        self.assertEqual(manifest_compiler.batch_jobs(None, None, {}),
+                         manifest_compiler.default_jobs())
+
+    def test_batch_returns_tokens(self):
+        """Test that a batch returns every token it took from make"""
+        os.write(self.jobserver.write_fd, b"ab")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest = os.path.join(tmp_dir, "manifest.json")
+            write_json_file(manifest, {
+                "uuid": "01234567-89ab-cdef-0123-456789abcdef",
+                "min_heap": 4096,
+                "min_stack": 4096
+            })
+            batch_file = os.path.join(tmp_dir, "manifests.rsp")
+            with open(batch_file, "w", encoding="utf-8") as out_file:
+                for i in range(8):
+                    out_file.write(f"-i {manifest} "
+                                   f"-o {os.path.join(tmp_dir, str(i))}\n")
+            failures = manifest_compiler.compile_batch(
+                batch_file, argparse.Namespace(constants=[], header_dir=None),
+                jobs=4, jobserver=self.jobserver)
+            self.assertEqual(failures, 0)
+            for i in range(8):
+                self.assertTrue(os.path.exists(os.path.join(tmp_dir, str(i))))
+
+        self.assertEqual(sorted(os.read(self.jobserver.read_fd, 16)),
+                         sorted(b"ab"))
+
+
+class TestConstantsDb(unittest.TestCase):
+    """Test compiling manifests against a precompiled constants database"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.consts = self.path("consts.json")
+        write_json_file(self.consts, {
+            "header": "test_consts.h",
+            "constants": [
+                {"name": TEST_UUID,
+                 "value": "5f902ace-5e5c-4cd8-ae54-87b88c22ddaf",
+                 "type": "uuid"},
+                {"name": "HEAP_SIZE", "value": "0x2000", "type": "int",
+                 "unsigned": True},
+                {"name": "PORT", "value": "com.android.trusty.test",
+                 "type": "port"},
+                {"name": "RESTART", "value": True, "type": "bool"},
+            ] + [{"name": f"FILLER_{i}", "value": -i, "type": "int",
+                  "unsigned": False} for i in range(500)]
+        })
+        self.manifest = self.path("app", "manifest.json")
+        write_json_file(self.manifest, {
+            "uuid": TEST_UUID,
+            "min_heap": "HEAP_SIZE",
+            "min_stack": 4096,
+            "mgmt_flags": {"restart_on_exit": "RESTART"},
+            "start_ports": [{"name": "PORT",
+                             "flags": {"allow_ta_connect": True,
+                                       "allow_ns_connect": False}}]
+        })
+        self.db_file = self.path("consts.db")
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir.name, *parts)
+
+    def read_output(self, name):
+        with open(self.path(name), "rb") as output_file:
+            return output_file.read()
+
+    def build_db(self):
+        ret = manifest_compiler.main(["--build-constants-db", self.db_file,
+                                      "-c", self.consts,
+                                      "--header-dir", self.path("include")])
+        self.assertEqual(ret, 0)
+
+    def test_db_matches_json_constants(self):
+        """Test that the database yields the same binary as the JSON files"""
+        self.build_db()
+        self.assertTrue(os.path.exists(self.path("include", "test_consts.h")))
+        ret = manifest_compiler.main(["-i", self.manifest, "-o",
+                                      self.path("json.bin"), "-c",
+                                      self.consts, "--header-dir",
+                                      self.path("include")])
+        self.assertEqual(ret, 0)
+        ret = manifest_compiler.main(["-i", self.manifest, "-o",
+                                      self.path("db.bin"), "--constants-db",
+                                      self.db_file, "--depfile",
+                                      self.path("db.d")])
+        self.assertEqual(ret, 0)
+        self.assertEqual(self.read_output("json.bin"),
+                         self.read_output("db.bin"))
+        self.assertIn(self.db_file, self.read_output("db.d").decode())
+
+    def test_db_lookups(self):
+        self.build_db()
+        db = manifest_compiler.CompilerCache().open_constants_db(
+            self.db_file, manifest_compiler.Log())
+        const = db.get("HEAP_SIZE")
+        self.assertEqual((const.value, const.type, const.unsigned,
+                          const.hex_num, const.source),
+                         (0x2000, "int", True, True,
+                          os.path.abspath(self.consts)))
+        self.assertEqual(db.get(TEST_UUID).value,
+                         bytes.fromhex("5f902ace5e5c4cd8ae5487b88c22ddaf"))
+        self.assertIs(db.get("RESTART").value, True)
+        self.assertEqual(db.get("PORT").value, "com.android.trusty.test")
+        for i in range(500):
+            self.assertEqual(db.get(f"FILLER_{i}").value, -i)
+        self.assertIsNone(db.get("MISSING"))
+        self.assertIsNone(db.get(4096))
+
+    def test_stale_db_is_rejected(self):
+        self.build_db()
+        with open(self.consts, "a", encoding="utf-8") as consts_file:
+            consts_file.write("\n")
+        log = manifest_compiler.Log(out=io.StringIO())
+        db = manifest_compiler.CompilerCache().open_constants_db(self.db_file,
+                                                                 log)
+        self.assertIsNone(db)
+        self.assertIn("out of date", log.out.getvalue())
+
+    def test_invalid_db_is_rejected(self):
+        with open(self.db_file, "wb") as db_file:
+            db_file.write(b"not a database")
+        log = manifest_compiler.Log(out=io.StringIO())
+        db = manifest_compiler.CompilerCache().open_constants_db(self.db_file,
+                                                                 log)
+        self.assertIsNone(db)
+        self.assertTrue(log.error_occurred())
+
+    def test_invalid_db_header_is_rejected(self):
+        """Test that bucket counts which lookups cannot use, or which do not
+        fit in the file, are rejected when the database is opened
+        """
+        self.build_db()
+        with open(self.db_file, "rb") as db_file:
+            data = db_file.read()
+        header = constants_db.HEADER.unpack_from(data, 0)
+        for bucket_count, error in ((0, "bucket count 0"),
+                                    (3, "bucket count 3"),
+                                    (header[3], f"bucket count {header[3]}"),
+                                    (1 << 30, "truncated")):
+            with self.subTest(bucket_count=bucket_count):
+                with open(self.db_file, "wb") as db_file:
+                    db_file.write(constants_db.HEADER.pack(
+                        *header[:4], bucket_count))
+                    db_file.write(data[constants_db.HEADER.size:])
+                log = manifest_compiler.Log(out=io.StringIO())
+                db = manifest_compiler.CompilerCache().open_constants_db(
+                    self.db_file, log)
+                self.assertIsNone(db)
+                self.assertIn("unable to open constants database",
+                              log.out.getvalue())
+                self.assertIn(error, log.out.getvalue())
+
+
+class TestEntryPoints(unittest.TestCase):
+    """Test running the compiler with the Python interpreter directly"""
+
+    def test_script_and_module_entry_points(self):
+        tools_dir = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, PYTHONPATH=tools_dir)
+        env.pop("MAKEFLAGS", None)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest = os.path.join(tmp_dir, "app", "manifest.json")
+            write_json_file(manifest, {
+                "uuid": "01234567-89ab-cdef-0123-456789abcdef",
+                "min_heap": 4096,
+                "min_stack": 4096
+            })
+            outputs = []
+            for entry_point in (
+                    [os.path.join(tools_dir, "manifest_compiler.py")],
+                    ["-m", "manifest_compiler"]):
+                output = os.path.join(tmp_dir, f"{len(outputs)}.bin")
+                subprocess.run([sys.executable] + entry_point +
+                               ["-i", manifest, "-o", output],
+                               env=env, cwd=tmp_dir, check=True)
+                with open(output, "rb") as output_file:
+                    outputs.append(output_file.read())
+        self.assertEqual(outputs[0], outputs[1])
+
+
+class TestStartup(unittest.TestCase):
+    """Test the modules imported by compiler runs and the time spent on it"""
+
+    # Budget for the time a compiler process spends importing modules, as a
+    # multiple of the time spent importing the standard library modules every
+    # run needs, so that the budget scales with the speed of the machine
+    IMPORT_TIME_RATIO = 3
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.consts = os.path.join(self.tmp_dir.name, "consts.json")
+        write_json_file(self.consts, {
+            "header": "test_consts.h",
+            "constants": [{"name": "HEAP_SIZE", "value": 4096, "type": "int",
+                           "unsigned": True}]
+        })
+        self.manifest = os.path.join(self.tmp_dir.name, "app", "manifest.json")
+        write_json_file(self.manifest, {
+            "uuid": "01234567-89ab-cdef-0123-456789abcdef",
+            "min_heap": "HEAP_SIZE",
+            "min_stack": 4096
+        })
+
+    def run_compiler(self, *args):
+        """Runs the compiler with -X importtime.
+
+        :returns: tuple of the names of the imported modules and the total
+                  import time in milliseconds
+        """
+        compiler = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "manifest_compiler.py")
+        return self.run_python(compiler, *args)
+
+    def run_python(self, *args):
+        """Runs Python with -X importtime, see run_compiler()"""
+        env = dict(os.environ)
+        env.pop("MAKEFLAGS", None)
+        env.pop(manifest_compiler.CACHE_DIR_ENV, None)
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime"] + list(args),
+            env=env, cwd=self.tmp_dir.name, stderr=subprocess.PIPE,
+            check=True, universal_newlines=True)
+
+        modules = set()
+        total_us = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            modules.add(name.strip())
+            if not name.startswith("  "):
+                total_us += int(cumulative)
+        return modules, total_us / 1000
+
+    def test_header_only_run_skips_packer(self):
+        modules, _ = self.run_compiler("-c", self.consts, "--header-dir",
+                                       "include")
+        self.assertIn("manifest_headers", modules)
+        self.assertNotIn("manifest_packer", modules)
+        self.assertNotIn("manifest_unpacker", modules)
+        self.assertNotIn("struct", modules)
+
+    def test_manifest_run_skips_headers(self):
+        modules, _ = self.run_compiler("-i", self.manifest, "-o", "app.bin",
+                                       "-c", self.consts)
+        self.assertIn("manifest_packer", modules)
+        self.assertNotIn("manifest_headers", modules)
+        self.assertNotIn("manifest_unpacker", modules)
+        for module in ("constants_db", "make_jobserver", "manifest_cache",
+                       "tempfile", "hashlib", "shlex"):
+            self.assertNotIn(module, modules)
+
+    def test_import_time_budget(self):
+        # the best of a few runs, to ignore other load on the machine
+        import_time = min(
+            self.run_compiler("-i", self.manifest, "-o", "app.bin", "-c",
+                              self.consts, "--header-dir", "include")[1]
+            for _ in range(3))
+        baseline = min(
+            self.run_python("-c", "import argparse, json")[1]
+            for _ in range(3))
+        self.assertLess(import_time, baseline * self.IMPORT_TIME_RATIO)
+
+
 if __name__ == "__main__":
     unittest.main()